@@ -1,18 +1,13 @@
 from flask import Flask, request, jsonify, render_template, redirect, url_for, session, send_file
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit, join_room
 import logging
 import ast
 import os
 import json
 import sqlite3
-import joblib
-import cv2
-import numpy as np
-from collections import Counter, deque
 from datetime import datetime
 import pytz
-import pickle
-import pandas as pd
+from functools import partial
 
 from BarangayDashboard import get_barangay_stats, get_latest_alert
 from CDRRMODashboard import get_cdrrmo_stats
@@ -25,13 +20,28 @@ from CDRRMOAnalytics import get_cdrrmo_trends, get_cdrrmo_distribution, get_cdrr
 from PNPAnalytics import get_pnp_trends, get_pnp_distribution, get_pnp_causes
 from BFPAnalytics import get_bfp_trends, get_bfp_distribution, get_bfp_causes
 
+from alert_data import alerts, bus
+from alert_dedup import AlertDeduplicator
+from alert_store import ROLES, alert_rooms, new_alert_id, session_rooms
+from analytics_windows import WindowedAnalytics
+from dataset_cache import DatasetCache
+from heatmap import LAYERS, SEVERITIES, SOURCES, HeatmapGrid
+from image_store import ImageStore, guess_mimetype
+from image_batcher import ImageBatcher, ImageDecodeError, ImageQueueFull, PredictionCache
+from model_registry import ModelRegistry
+from responder_units import AGENCIES, ResponderUnits
+from risk_scoring import RiskScorer
+from spatial_index import BarangayIndex, parse_point
+from user_db import UserDatabase, UserDatabaseBusy
+
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Replace with a strong, secret key
 socketio = SocketIO(app, cors_allowed_origins="*")
 logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 # Ensure data directory exists
-data_dir = os.path.join(os.path.dirname(__file__), 'data')
+data_dir = os.getenv('ALERT_DATA_DIR', os.path.join(os.path.dirname(__file__), 'data'))
 if not os.path.exists(data_dir):
     os.makedirs(data_dir)
     logging.info(f"Created data directory at {data_dir}")
@@ -47,56 +57,119 @@ except Exception as e:
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-here')
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", client_manager=bus.socketio_manager())
+
+# Uploaded photos live on disk; alerts only carry the image id and a thumbnail
+image_store = ImageStore(os.path.join(data_dir, 'images'))
+
+@socketio.on('connect')
+def handle_connect():
+    rooms = session_rooms(session.get('role'), session.get('assigned_municipality'), session.get('barangay'),
+                          session.get('unique_id'))
+    for room in rooms:
+        join_room(room)
+    logger.debug(f"Socket joined rooms: {rooms}")
+    if session.get('role') in AGENCIES and session.get('unique_id'):
+        responders.connect(session['unique_id'])
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    # Once its last dashboard closes, a unit can't be sent anywhere until it reports again
+    if session.get('role') in AGENCIES and session.get('unique_id'):
+        responders.disconnect(session['unique_id'])
+
+@socketio.on('unit_status')
+def handle_unit_status(data):
+    role = session.get('role')
+    if role not in AGENCIES or not session.get('unique_id'):
+        logger.warning(f"Ignoring unit_status from a session that is not a responder unit: {role}")
+        return
+    data = data or {}
+    try:
+        responders.report(session['unique_id'], role, data.get('lat'), data.get('lon'),
+                          municipality=session.get('assigned_municipality'), available=data.get('available', True))
+    except ValueError as e:
+        logger.warning(f"Ignoring unit_status: {e}")
+
+def emit_to_alert(event, payload, alert):
+    """Emits to an alert's rooms; one with no barangay or municipality to scope it is logged, not broadcast."""
+    rooms = alert_rooms(alert)
+    if not rooms:
+        # An empty room list would make Socket.IO send to every connected dashboard
+        logger.warning(f"Not sending {event} for alert {alert.get('id')}: it has no barangay or municipality")
+        return
+    socketio.emit(event, payload, to=rooms)
+
+def apply_transition(data, status, event):
+    alert_id = data.get('id')
+    if not alert_id:
+        logger.warning(f"Ignoring {status} event without an alert id: {data}")
+        return
+    alert, changed = alerts.transition(alert_id, status)
+    if alert is None:
+        logger.warning(f"Ignoring {status} event for unknown alert {alert_id}")
+        return
+    if not changed:
+        logger.debug(f"Alert {alert_id} already {alert['status']}; not re-broadcasting {status}")
+        return
+    # Dashboards mark an alert responded once the unit has dealt with it, so that frees the unit
+    if status in ('responded', 'closed') and alert.get('assigned_unit'):
+        responders.release(alert['assigned_unit'], alert_id)
+    emit_to_alert(event, {
+        'id': alert_id,
+        'seq': alert['updated_seq'],
+        'status': alert['status'],
+        'timestamp': alert.get('timestamp'),
+        'lat': alert.get('lat'),
+        'lon': alert.get('lon'),
+        'barangay': alert.get('barangay'),
+        'emergency_type': alert.get('emergency_type')
+    }, alert)
+
+@socketio.on('catch_up')
+def handle_catch_up(data):
+    try:
+        since = int((data or {}).get('since', 0))
+    except (TypeError, ValueError):
+        logger.warning(f"Ignoring catch_up with invalid since: {data}")
+        return
+    rooms = set(session_rooms(session.get('role'), session.get('assigned_municipality'), session.get('barangay'),
+                              session.get('unique_id')))
+    changed, last_seq, truncated = alerts.changes_since(since)
+    visible = [alert for alert in changed if rooms.intersection(alert_rooms(alert))]
+    emit('replay', {
+        'alerts': [alert for alert in visible if alert['seq'] > since],
+        'updates': [{'id': alert['id'], 'seq': alert['updated_seq'], 'status': alert.get('status'),
+                     'image_id': alert.get('image_id'), 'thumbnail': alert.get('thumbnail'),
+                     'reporters': alert.get('reporters', 1)}
+                    for alert in visible if alert['seq'] <= since],
+        'last_seq': last_seq,
+        'truncated': truncated
+    })
 
-# Initialize alerts deque
-alerts = deque(maxlen=100)
+@socketio.on('acknowledged')
+def handle_acknowledged(data):
+    apply_transition(data, 'acknowledged', 'alert_acknowledged')
 
 # SocketIO event for alert response
 @socketio.on('responded')
 def handle_responded(data):
-    timestamp = data.get('timestamp')
-    for alert in alerts:
-        if alert.get('timestamp') == timestamp:
-            alert['responded'] = True
-            break
-    socketio.emit('alert_responded', {
-        'timestamp': timestamp,
-        'lat': data.get('lat'),
-        'lon': data.get('lon'),
-        'barangay': data.get('barangay'),
-        'emergency_type': data.get('emergency_type')
-    })
+    apply_transition(data, 'responded', 'alert_responded')
 
-# Load machine learning models with fallbacks
-dt_classifier = None
-try:
-    dt_classifier = joblib.load('training/decision_tree_model.pkl')
-    logging.info("decision_tree_model.pkl loaded successfully.")
-except FileNotFoundError:
-    logging.error("decision_tree_model.pkl not found. ML prediction will not work.")
-except Exception as e:
-    logging.error(f"Error loading decision_tree_model.pkl: {e}")
+@socketio.on('closed')
+def handle_closed(data):
+    apply_transition(data, 'closed', 'alert_closed')
 
-lr_fire = rf_fire = svm_fire = xgb_fire = None
-try:
-    lr_fire = joblib.load('training/Fire Models/lr_fire_incident.pkl')
-    rf_fire = joblib.load('training/Fire Models/rf_fire_incident.pkl')
-    svm_fire = joblib.load('training/Fire Models/svm_fire_incident.pkl')
-    xgb_fire = joblib.load('training/Fire Models/xgb_fire_incident.pkl')
-    logging.info("Fire incident models loaded successfully.")
-except Exception as e:
-    logging.error(f"Error loading fire incident models: {e}")
+# Models load on first use, each on its own, so workers boot without unpickling them
+models = ModelRegistry(os.path.join(os.path.dirname(__file__), 'training'))
+models.preload(filter(None, os.getenv('MODEL_PRELOAD', '').split(',')))
 
-lr_road = rf_road = svm_road = xgb_road = None
-try:
-    lr_road = joblib.load('training/Road Models/lr_road_accident.pkl')
-    rf_road = joblib.load('training/Road Models/rf_road_accident.pkl')
-    svm_road = joblib.load('training/Road Models/svm_road_accident.pkl')
-    xgb_road = joblib.load('training/Road Models/xgb_road_accident.pkl')
-    logging.info("Road accident models loaded successfully.")
-except Exception as e:
-    logging.error(f"Error loading road accident models: {e}")
+# Concurrent image predictions share one classifier call per micro-batch
+# and repeat photos are answered from a perceptual-hash cache
+image_batcher = ImageBatcher(partial(models.get, 'decision_tree'),
+                             cache=PredictionCache(ttl=float(os.getenv('PREDICTION_CACHE_TTL', '3600'))),
+                             model_version=partial(models.version, 'decision_tree'))
+MAX_BULK_IMAGES = 64
 
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', 'your-google-api-key-here')
 barangay_coords = {}
@@ -108,24 +181,55 @@ except FileNotFoundError:
 except Exception as e:
     logging.error(f"Error loading coords.txt: {e}. Using empty dict.")
 
+barangay_municipality = {
+    barangay: municipality
+    for municipality, barangays in barangay_coords.items()
+    for barangay in barangays
+}
+
+# Nearest-barangay lookups, so alerts are placed by their coordinates rather than client text
+barangay_index = BarangayIndex(barangay_coords)
+
+# Reports of one emergency from the same spot within minutes become a single incident
+dedup = AlertDeduplicator(bus)
+
+# Positions and availability of responder dashboards; new alerts go to the nearest free unit
+responders = ResponderUnits(bus)
+
+# Typed, memory-mapped columns of the historical dataset CSVs, shared by scoring and analytics
+datasets = DatasetCache(os.path.join(os.path.dirname(__file__), 'dataset'))
+
+# Batched fire/road model scoring over barangays, with encoded rows cached
+risk_scorer = RiskScorer(models, barangay_coords, datasets=datasets)
+
+# Cached per-tab analytics over live alerts and the historical datasets
+windowed_analytics = WindowedAnalytics(alerts, barangay_municipality=barangay_municipality, datasets=datasets)
+
+# Incident density per grid cell, so the maps never download raw points
+heatmap = HeatmapGrid(alerts, bus, datasets, barangay_coords)
+
 # Municipality coordinates
 municipality_coords = {
     "San Pablo City": {"lat": 14.0642, "lon": 121.3233},
     "Quezon Province": {"lat": 13.9347, "lon": 121.9473},
 }
 
-def get_db_connection():
-    db_path = os.path.join(os.path.dirname(__file__), 'database', 'users_web.db')
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Pooled connections to the users table; opening it also runs any pending schema migrations
+users = UserDatabase()
 
 def construct_unique_id(role, barangay=None, assigned_municipality=None, contact_no=None):
     if role == 'barangay':
         return f"{barangay}_{contact_no}"
     return f"{role}_{assigned_municipality}_{contact_no}"
 
+@app.errorhandler(UserDatabaseBusy)
+def user_database_busy(e):
+    # Every pooled connection is taken; the client should retry rather than see a crash
+    logger.warning(f"{request.path}: {e}")
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'Too many requests, retry shortly'}), 503, {'Retry-After': '1'}
+    return "Too many requests, retry shortly", 503, {'Retry-After': '1'}
+
 @app.route('/')
 def home():
     logger.debug("Rendering SignUpType.html")
@@ -141,28 +245,23 @@ def signup_barangay():
         password = request.form['password']
         unique_id = construct_unique_id('barangay', barangay=barangay, contact_no=contact_no)
         
-        conn = get_db_connection()
         try:
-            existing_user = conn.execute('SELECT * FROM users WHERE contact_no = ?', (contact_no,)).fetchone()
-            if existing_user:
+            if users.contact_exists(contact_no):
                 logger.error("Signup failed: Contact number %s already exists", contact_no)
                 return "Contact number already exists", 400
             
-            conn.execute('''
-                INSERT INTO users (barangay, role, contact_no, assigned_municipality, province, password)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (barangay, 'barangay', contact_no, assigned_municipality, province, password))
-            conn.commit()
+            users.add_user('barangay', contact_no, password, barangay=barangay,
+                           assigned_municipality=assigned_municipality, province=province)
             logger.debug("User signed up successfully: %s", unique_id)
             return redirect(url_for('login'))
         except sqlite3.IntegrityError as e:
             logger.error("IntegrityError during signup: %s", e)
             return "User already exists", 400
+        except UserDatabaseBusy:
+            raise
         except Exception as e:
             logger.error(f"Signup failed for {unique_id}: {e}", exc_info=True)
             return f"Signup failed: {e}", 500
-        finally:
-            conn.close()
     return render_template('SignUpPage.html')
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -174,15 +273,13 @@ def login():
         password = request.form['  password']
         unique_id = construct_unique_id('barangay', barangay=barangay, contact_no=contact_no)
         
-        conn = get_db_connection()
-        user = conn.execute('''
-            SELECT * FROM users WHERE barangay = ? AND contact_no = ? AND password = ?
-        ''', (barangay, contact_no, password)).fetchone()
-        conn.close()
+        user = users.find_barangay_user(barangay, contact_no, password)
         
         if user:
             session['unique_id'] = unique_id
             session['role'] = user['role']
+            session['barangay'] = user['barangay']
+            session['assigned_municipality'] = user['assigned_municipality']
             logger.debug(f"Web login successful for barangay: {unique_id}")
             return redirect(url_for('barangay_dashboard'))
         logger.warning(f"Web login failed for unique_id: {unique_id}")
@@ -197,11 +294,7 @@ def api_login():
     password = data.get('password')
     unique_id = construct_unique_id('barangay', barangay=barangay, contact_no=contact_no)
     
-    conn = get_db_connection()
-    user = conn.execute('''
-        SELECT * FROM users WHERE barangay = ? AND contact_no = ? AND password = ?
-    ''', (barangay, contact_no, password)).fetchone()
-    conn.close()
+    user = users.find_barangay_user(barangay, contact_no, password)
     
     if user:
         logger.debug(f"API login successful for user: {unique_id} with role: {user['role']}")
@@ -218,28 +311,22 @@ def signup_cdrrmo_pnp_bfp():
         password = request.form['password']
         unique_id = construct_unique_id(role, assigned_municipality=assigned_municipality, contact_no=contact_no)
         
-        conn = get_db_connection()
         try:
-            existing_user = conn.execute('SELECT * FROM users WHERE contact_no = ?', (contact_no,)).fetchone()
-            if existing_user:
+            if users.contact_exists(contact_no):
                 logger.error("Signup failed: Contact number %s already exists", contact_no)
                 return "Contact number already exists", 400
             
-            conn.execute('''
-                INSERT INTO users (role, contact_no, assigned_municipality, password)
-                VALUES (?, ?, ?, ?)
-            ''', (role, contact_no, assigned_municipality, password))
-            conn.commit()
+            users.add_user(role, contact_no, password, assigned_municipality=assigned_municipality)
             logger.debug("User signed up successfully: %s", unique_id)
             return redirect(url_for('login_cdrrmo_pnp_bfp'))
         except sqlite3.IntegrityError as e:
             logger.error("IntegrityError during signup: %s", e)
             return "User already exists", 400
+        except UserDatabaseBusy:
+            raise
         except Exception as e:
             logger.error(f"Signup failed for {unique_id}: {e}", exc_info=True)
             return f"Signup failed: {e}", 500
-        finally:
-            conn.close()
     return render_template('CDRRMOPNPBFPUp.html')
 
 @app.route('/login_cdrrmo_pnp_bfp', methods=['GET', 'POST'])
@@ -251,16 +338,13 @@ def login_cdrrmo_pnp_bfp():
         password = request.form['password']
         role = request.form['role'].lower()
         
-        conn = get_db_connection()
-        user = conn.execute('''
-            SELECT * FROM users WHERE role = ? AND contact_no = ? AND password = ? AND assigned_municipality = ?
-        ''', (role, contact_no, password, assigned_municipality)).fetchone()
-        conn.close()
+        user = users.find_agency_user(role, assigned_municipality, contact_no, password)
         
         if user:
             unique_id = construct_unique_id(user['role'], assigned_municipality=assigned_municipality, contact_no=contact_no)
             session['unique_id'] = unique_id
             session['role'] = user['role']
+            session['assigned_municipality'] = user['assigned_municipality']
             app.logger.debug(f"Web login successful for user: {session['unique_id']} ({user['role']})")
             if user['role'] == 'cdrrmo':
                 return redirect(url_for('cdrrmo_dashboard'))
@@ -325,6 +409,9 @@ def send_alert():
         emergency_type = data.get('emergency_type', 'General')
         image = data.get('image')
         user_role = data.get('user_role', 'unknown')
+        barangay = data.get('barangay', 'N/A')
+        municipality = data.get('municipality') or barangay_municipality.get(barangay)
+        place = barangay_index.resolve(lat, lon)
         image_upload_time = data.get('imageUploadTime', datetime.now(pytz.utc).isoformat())
         upload_time = datetime.fromisoformat(image_upload_time.replace('Z', '+00:00'))
         if (datetime.now(pytz.utc) - upload_time).total_seconds() > 30 * 60:
@@ -332,52 +419,178 @@ def send_alert():
             emergency_type = 'Not Specified'
 
         alert = {
+            'id': new_alert_id(),
             'lat': lat,
             'lon': lon,
             'emergency_type': emergency_type,
-            'image': image,
             'role': user_role,
             'house_no': data.get('house_no', 'N/A'),
             'street_no': data.get('street_no', 'N/A'),
-            'barangay': data.get('barangay', 'N/A'),
+            'barangay': place[0] if place else barangay,
+            'municipality': place[1] if place else municipality,
             'timestamp': datetime.now(pytz.timezone('America/Los_Angeles')).isoformat(),
             'imageUploadTime': image_upload_time,
-            'responded': False
+            'responded': False,
+            'reporters': 1
         }
-        alerts.append(alert)
-        socketio.emit('new_alert', alert)
-        logger.debug("Alert sent successfully")
-        return jsonify({'status': 'success', 'message': 'Alert sent'}), 200
+        if place and place[0] != barangay:
+            alert['reported_barangay'] = barangay
+        claimed = dedup.claim(alert)
+        if claimed:
+            return merge_report(*claimed, alert, image)
+        return create_alert(alert, image)
     except Exception as e:
         logger.error(f"Error processing send_alert: {e}", exc_info=True)
         return jsonify({'error': 'Internal server error'}), 500
 
+def create_alert(alert, image):
+    """Assigns a unit, stores the photo and appends the alert, which dedup already holds as an open incident."""
+    unit = None
+    try:
+        unit = responders.assign(alert)
+        if unit:
+            alert.update(assigned_unit=unit['unit'], assigned_agency=unit['agency'],
+                         unit_distance_km=unit['distance_km'])
+        image_id = store_image(image)
+        alert['image_id'] = image_id
+        alert['thumbnail'] = image_store.read_thumbnail(image_id) if image_id else None
+        alert = alerts.append(alert)
+    except Exception:
+        # Otherwise later reports would merge into an incident that was never stored
+        dedup.release(alert['id'])
+        if unit:
+            responders.release(unit['unit'], alert['id'])
+        raise
+    emit_to_alert('new_alert', alert, alert)
+    if image_id and alert['thumbnail'] is None:
+        image_store.submit_thumbnail(image_id).add_done_callback(partial(publish_thumbnail, alert['id']))
+    logger.debug("Alert sent successfully")
+    return jsonify({'status': 'success', 'message': 'Alert sent', 'id': alert['id']}), 200
+
+def merge_report(incident_id, reporters, report, image):
+    """Folds a duplicate report into its open incident and sends the change as a small delta.
+
+    If the incident isn't in the store (its own append failed, or is still
+    in flight on another request), the report becomes an alert of its own.
+    """
+    changes = {'reporters': reporters, 'last_reported': report['timestamp']}
+    incident = alerts.get(incident_id)
+    if incident is None:
+        return report_as_new(incident_id, report, image)
+    # The first photo of an incident is worth keeping even if it came with a later report
+    image_id = None
+    if image and not incident.get('image_id'):
+        image_id = store_image(image)
+        if image_id:
+            changes.update(image_id=image_id, thumbnail=image_store.read_thumbnail(image_id))
+    incident = alerts.update(incident_id, **changes)
+    if incident is None:
+        return report_as_new(incident_id, report, image)
+    emit_to_alert('alert_reporters', dict(changes, id=incident_id, seq=incident['updated_seq']), incident)
+    if image_id and changes['thumbnail'] is None:
+        image_store.submit_thumbnail(image_id).add_done_callback(partial(publish_thumbnail, incident_id))
+    logger.debug(f"Report merged into incident {incident_id} ({reporters} reporters)")
+    return jsonify({'status': 'success', 'message': 'Alert merged into an open incident', 'id': incident_id,
+                    'reporters': reporters}), 200
+
+def report_as_new(incident_id, report, image):
+    logger.warning(f"Incident {incident_id} is not stored; sending the report as a new alert")
+    # Later reports from the spot join this alert rather than the unstored incident
+    dedup.release(incident_id)
+    dedup.register(report)
+    return create_alert(report, image)
+
+def store_image(image):
+    """Saves an alert's photo and returns its id; a photo that can't be decoded is dropped, not the alert."""
+    if not image:
+        return None
+    # Bad base64 raises binascii.Error, a ValueError; non-ASCII text raises a plain ValueError
+    try:
+        return image_store.put(image)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Sending alert without its image, which could not be decoded: {e}")
+        return None
+
+def publish_thumbnail(alert_id, future):
+    try:
+        thumbnail = future.result()
+    except Exception as e:
+        logger.error(f"Thumbnail generation failed for alert {alert_id}: {e}", exc_info=True)
+        return
+    if thumbnail is None:
+        return
+    alert = alerts.update(alert_id, thumbnail=thumbnail)
+    if alert is not None:
+        emit_to_alert('alert_thumbnail', {
+            'id': alert_id,
+            'seq': alert['updated_seq'],
+            'image_id': alert['image_id'],
+            'thumbnail': thumbnail
+        }, alert)
+
+@app.route('/images/<image_id>')
+def get_image(image_id):
+    return serve_image(image_id, thumbnail=False)
+
+@app.route('/images/<image_id>/thumbnail')
+def get_image_thumbnail(image_id):
+    return serve_image(image_id, thumbnail=True)
+
+def serve_image(image_id, thumbnail):
+    try:
+        path = image_store.path(image_id, thumbnail=thumbnail)
+    except ValueError:
+        return jsonify({'error': 'Invalid image id'}), 400
+    if not os.path.exists(path):
+        return jsonify({'error': 'Image not found'}), 404
+    with open(path, 'rb') as f:
+        mimetype = guess_mimetype(f.read(16))
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=image_id, max_age=31536000)
+    # Content-addressed, so a given URL never changes
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/api/stats')
 def get_stats():
     try:
-        total = len(alerts)
-        critical = len([a for a in alerts if a.get('emergency_type', '').lower() == 'critical'])
+        role = request.args.get('role')
+        counts = alerts.counts(role=role if role in ROLES else None)
+        total = sum(counts.values())
+        critical = sum(n for emergency_type, n in counts.items() if emergency_type.lower() == 'critical')
         return jsonify({'total': total, 'critical': critical})
     except Exception as e:
         logger.error(f"Error in get_stats: {e}", exc_info=True)
         return jsonify({'error': 'Failed to retrieve stats'}), 500
 
+@app.route('/api/alerts_nearby')
+def get_alerts_nearby():
+    role = session.get('role')
+    if role not in ROLES:
+        return jsonify({'error': 'Not logged in'}), 401
+    point = parse_point(request.args.get('lat'), request.args.get('lon'))
+    if point is None:
+        return jsonify({'error': 'lat and lon are required'}), 400
+    try:
+        radius_km = float(request.args.get('radius_km', 2))
+    except ValueError:
+        return jsonify({'error': 'radius_km must be a number'}), 400
+    if not 0 < radius_km <= 50:
+        return jsonify({'error': 'radius_km must be between 0 and 50'}), 400
+    try:
+        found = alerts.nearby(*point, radius_km, role=role)
+        return jsonify([dict(alert, distance_km=round(distance, 3)) for alert, distance in found])
+    except Exception as e:
+        logger.error(f"Error in get_alerts_nearby: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to retrieve nearby alerts'}), 500
+
 @app.route('/api/distribution')
 def get_distribution():
     try:
         role = request.args.get('role', 'all')
-        if role == 'barangay':
-            filtered_alerts = [a for a in alerts if a.get('role') == 'barangay' or a.get('barangay')]
-        elif role == 'cdrrmo':
-            filtered_alerts = [a for a in alerts if a.get('role') == 'cdrrmo' or a.get('assigned_municipality')]
-        elif role == 'pnp':
-            filtered_alerts = [a for a in alerts if a.get('role') == 'pnp' or a.get('assigned_municipality')]
-        elif role == 'bfp':
-            filtered_alerts = [a for a in alerts if a.get('role') == 'bfp' or a.get('assigned_municipality')]
-        else:
-            filtered_alerts = alerts
-        types = [a.get('emergency_type', 'unknown') for a in filtered_alerts]
-        return jsonify(dict(Counter(types)))
+        counts = alerts.count_by_type(role=role if role in ROLES else None,
+                                      municipality=request.args.get('municipality'),
+                                      barangay=request.args.get('barangay'))
+        return jsonify(dict(counts))
     except Exception as e:
         logger.error(f"Error in get_distribution: {e}", exc_info=True)
         return jsonify({'error': 'Failed to retrieve distribution'}), 500
@@ -409,9 +622,27 @@ def get_analytics():
         logger.error(f"Error in get_analytics: {e}", exc_info=True)
         return jsonify({'error': 'Failed to retrieve analytics'}), 500
 
+@app.route('/api/barangay_analytics_data')
+def get_barangay_analytics_data():
+    role = session.get('role')
+    if role not in ROLES:
+        logger.warning("Unauthorized access to barangay_analytics_data")
+        return jsonify({'error': 'Not logged in'}), 401
+    barangay = session.get('barangay') if role == 'barangay' else request.args.get('barangay') or None
+    municipality = session.get('assigned_municipality') or barangay_municipality.get(barangay)
+    try:
+        return jsonify(windowed_analytics.get(request.args.get('time', 'today'), role,
+                                              municipality=None if barangay else municipality,
+                                              barangay=barangay))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_barangay_analytics_data: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to retrieve analytics'}), 500
+
 @app.route('/api/predict_image', methods=['POST'])
 def predict_image():
-    if dt_classifier is None:
+    if models.get('decision_tree') is None:
         logger.error("Machine learning model not loaded")
         return jsonify({'error': 'Model not loaded'}), 500
     data = request.get_json()
@@ -419,34 +650,145 @@ def predict_image():
     if not base64_image:
         logger.error("No image provided in predict_image")
         return jsonify({'error': 'No image provided'}), 400
-    
-    try:
-        import base64
-        img_data = base64.b64decode(base64_image)
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
-        
-        if img is None:
-            logger.error("Failed to decode image")
-            return jsonify({'error': 'Failed to decode image'}), 400
 
-        img = cv2.resize(img, (64, 64))
-        features = img.flatten().reshape(1, -1)
-        prediction = dt_classifier.predict(features)[0]
+    try:
+        prediction = image_batcher.predict(base64_image)
         logger.debug(f"Image predicted as: {prediction}")
         return jsonify({'emergency_type': prediction})
+    except ImageDecodeError:
+        logger.error("Failed to decode image")
+        return jsonify({'error': 'Failed to decode image'}), 400
+    except ImageQueueFull as e:
+        logger.warning(f"Rejecting image prediction: {e}")
+        return jsonify({'error': 'Too many images queued, retry shortly'}), 503, {'Retry-After': '1'}
     except Exception as e:
         logger.error(f"Image prediction failed: {e}", exc_info=True)
         return jsonify({'error': 'Prediction failed'}), 500
 
+@app.route('/api/predict_images', methods=['POST'])
+def predict_images():
+    if models.get('decision_tree') is None:
+        logger.error("Machine learning model not loaded")
+        return jsonify({'error': 'Model not loaded'}), 500
+    images = (request.get_json(silent=True) or {}).get('images')
+    if not images or not isinstance(images, list):
+        return jsonify({'error': 'No images provided'}), 400
+    if len(images) > MAX_BULK_IMAGES:
+        return jsonify({'error': f'At most {MAX_BULK_IMAGES} images per request'}), 400
+
+    predictions = []
+    for result in image_batcher.predict_many(images):
+        if isinstance(result, ImageDecodeError):
+            predictions.append({'error': 'Failed to decode image'})
+        elif isinstance(result, ImageQueueFull):
+            predictions.append({'error': 'Too many images queued, retry shortly'})
+        elif isinstance(result, Exception):
+            logger.error(f"Image prediction failed: {result}")
+            predictions.append({'error': 'Prediction failed'})
+        else:
+            predictions.append({'emergency_type': result})
+    return jsonify({'predictions': predictions})
+
+@app.route('/api/risk_scores', methods=['GET', 'POST'])
+def get_risk_scores():
+    """Scores every barangay (optionally one municipality) under a weather and hour, or posted rows.
+
+    deadline_ms overrides each model's latency budget for this request.
+    """
+    params = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    family = params.get('type', 'fire')
+    try:
+        hour = int(params.get('hour', datetime.now(pytz.timezone('Asia/Manila')).hour))
+        rows = params.get('rows') if request.method == 'POST' else None
+        if rows is None:
+            rows = risk_scorer.barangay_rows(params.get('weather', 'Sunny'), hour, params.get('municipality'))
+        elif not isinstance(rows, list) or not all(isinstance(row, dict) and isinstance(row.get('barangay'), str)
+                                                    for row in rows):
+            return jsonify({'error': 'Invalid risk query: rows must be a list of objects with a barangay name'}), 400
+        else:
+            rows = [{'barangay': row['barangay'],
+                     'municipality': row.get('municipality', barangay_municipality.get(row['barangay'])),
+                     'weather': row.get('weather', params.get('weather', 'Sunny')),
+                     'hour': int(row.get('hour', hour))}
+                    for row in rows]
+        if not rows:
+            return jsonify({'error': 'No barangays to score'}), 400
+        deadline = params.get('deadline_ms')
+        result = risk_scorer.score(family, rows, deadline=float(deadline) / 1000 if deadline is not None else None)
+        return jsonify(dict(result, type=family))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid risk query: {e}"}), 400
+    except RuntimeError as e:
+        logger.error(f"Risk scoring unavailable: {e}")
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error in get_risk_scores: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to score risk'}), 500
+
+@app.route('/api/risk_scores/stats')
+def get_risk_score_stats():
+    return jsonify(risk_scorer.stats())
+
+@app.route('/api/heatmap')
+def get_heatmap():
+    """Non-empty grid cells of the chosen layers, sources, severities and hours (e.g. hours=18-23,0-5).
+
+    bbox=south,west,north,east limits the cells to the map's viewport.
+    """
+    def names(param, allowed):
+        value = request.args.get(param)
+        return allowed if not value else [name.strip() for name in value.split(',') if name.strip()]
+
+    try:
+        hours = set()
+        for part in (request.args.get('hours') or '0-23').split(','):
+            first, _, last = part.partition('-')
+            hours.update(range(int(first), int(last or first) + 1))
+        bbox = request.args.get('bbox')
+        bbox = tuple(float(value) for value in bbox.split(',')) if bbox else None
+        if bbox is not None and len(bbox) != 4:
+            raise ValueError('bbox must be south,west,north,east')
+        etag = f"{heatmap.version}:{request.query_string.decode()}"
+        if etag in request.if_none_match:
+            return '', 304
+        response = jsonify(heatmap.tiles(names('layers', LAYERS), names('sources', SOURCES),
+                                         names('severities', SEVERITIES), hours, bbox))
+        response.set_etag(etag)
+        return response
+    except ValueError as e:
+        return jsonify({'error': f"Invalid heatmap query: {e}"}), 400
+    except Exception as e:
+        logger.error(f"Error in get_heatmap: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to build heatmap'}), 500
+
+@app.route('/api/responders/stats')
+def get_responder_stats():
+    return jsonify(responders.stats())
+
+@app.route('/api/user_db/stats')
+def get_user_db_stats():
+    return jsonify(users.stats())
+
+@app.route('/api/alert_dedup/stats')
+def get_alert_dedup_stats():
+    return jsonify(dedup.stats())
+
+@app.route('/api/heatmap/stats')
+def get_heatmap_stats():
+    return jsonify(heatmap.stats())
+
+@app.route('/api/models')
+def get_models():
+    return jsonify(models.stats())
+
+@app.route('/api/image_queue')
+def get_image_queue():
+    return jsonify(image_batcher.stats())
+
 @app.route('/barangay_dashboard')
 def barangay_dashboard():
     unique_id = session.get('unique_id')
-    conn = get_db_connection()
-    user = conn.execute('''
-        SELECT * FROM users WHERE barangay = ? AND contact_no = ?
-    ''', (unique_id.split('_')[0], unique_id.split('_')[1])).fetchone()
-    conn.close()
+    user = users.find_barangay_user(unique_id.split('_')[0], unique_id.split('_')[1])
     
     if not unique_id or not user or user['role'] != 'barangay':
         logger.warning("Unauthorized access to barangay_dashboard. Session: %s, User: %s", session, user)
@@ -454,8 +796,8 @@ def barangay_dashboard():
     
     barangay = user['barangay']
     assigned_municipality = user['assigned_municipality'] or 'San Pablo City'
-    latest_alert = get_latest_alert()
-    stats = get_barangay_stats()
+    latest_alert = get_latest_alert(barangay)
+    stats = get_barangay_stats(barangay)
     coords = barangay_coords.get(assigned_municipality, {}).get(barangay, {'lat': 14.5995, 'lon': 120.9842})
     
     try:
@@ -468,6 +810,7 @@ def barangay_dashboard():
 
     logger.debug(f"Rendering BarangayDashboard for {barangay} in {assigned_municipality}")
     return render_template('BarangayDashboard.html', 
+                           last_seq=alerts.last_seq, 
                            latest_alert=latest_alert, 
                            stats=stats, 
                            barangay=barangay, 
@@ -478,18 +821,14 @@ def barangay_dashboard():
 @app.route('/cdrrmo_dashboard')
 def cdrrmo_dashboard():
     unique_id = session.get('unique_id')
-    conn = get_db_connection()
-    user = conn.execute('''
-        SELECT * FROM users WHERE role = ? AND contact_no = ? AND assigned_municipality = ?
-    ''', ('cdrrmo', unique_id.split('_')[2], unique_id.split('_')[1])).fetchone()
-    conn.close()
+    user = users.find_agency_user('cdrrmo', unique_id.split('_')[1], unique_id.split('_')[2])
     
     if not unique_id or not user or user['role'] != 'cdrrmo':
         logger.warning("Unauthorized access to cdrrmo_dashboard. Session: %s, User: %s", session, user)
         return redirect(url_for('login_cdrrmo_pnp_bfp'))
     
     assigned_municipality = user['assigned_municipality'] or "San Pablo City"
-    stats = get_cdrrmo_stats()
+    stats = get_cdrrmo_stats(assigned_municipality)
     coords = municipality_coords.get(assigned_municipality, {'lat': 14.5995, 'lon': 120.9842})
     
     try:
@@ -502,6 +841,7 @@ def cdrrmo_dashboard():
 
     logger.debug(f"Rendering CDRRMODashboard for {assigned_municipality}")
     return render_template('CDRRMODashboard.html', 
+                           last_seq=alerts.last_seq, 
                            stats=stats, 
                            municipality=assigned_municipality, 
                            lat_coord=lat_coord, 
@@ -511,18 +851,14 @@ def cdrrmo_dashboard():
 @app.route('/pnp_dashboard')
 def pnp_dashboard():
     unique_id = session.get('unique_id')
-    conn = get_db_connection()
-    user = conn.execute('''
-        SELECT * FROM users WHERE role = ? AND contact_no = ? AND assigned_municipality = ?
-    ''', ('pnp', unique_id.split('_')[2], unique_id.split('_')[1])).fetchone()
-    conn.close()
+    user = users.find_agency_user('pnp', unique_id.split('_')[1], unique_id.split('_')[2])
     
     if not unique_id or not user or user['role'] != 'pnp':
         logger.warning("Unauthorized access to pnp_dashboard. Session: %s, User: %s", session, user)
         return redirect(url_for('login_cdrrmo_pnp_bfp'))
     
     assigned_municipality = user['assigned_municipality'] or "San Pablo City"
-    stats = get_pnp_stats()
+    stats = get_pnp_stats(assigned_municipality)
     coords = municipality_coords.get(assigned_municipality, {'lat': 14.5995, 'lon': 120.9842})
     
     try:
@@ -535,6 +871,7 @@ def pnp_dashboard():
 
     logger.debug(f"Rendering PNPDashboard for {assigned_municipality}")
     return render_template('PNPDashboard.html', 
+                           last_seq=alerts.last_seq, 
                            stats=stats, 
                            municipality=assigned_municipality, 
                            lat_coord=lat_coord, 
@@ -544,18 +881,14 @@ def pnp_dashboard():
 @app.route('/bfp_dashboard')
 def bfp_dashboard():
     unique_id = session.get('unique_id')
-    conn = get_db_connection()
-    user = conn.execute('''
-        SELECT * FROM users WHERE role = ? AND contact_no = ? AND assigned_municipality = ?
-    ''', ('bfp', unique_id.split('_')[2], unique_id.split('_')[1])).fetchone()
-    conn.close()
+    user = users.find_agency_user('bfp', unique_id.split('_')[1], unique_id.split('_')[2])
     
     if not unique_id or not user or user['role'] != 'bfp':
         logger.warning("Unauthorized access to bfp_dashboard. Session: %s, User: %s", session, user)
         return redirect(url_for('login_cdrrmo_pnp_bfp'))
     
     assigned_municipality = user['assigned_municipality'] or "San Pablo City"
-    stats = get_bfp_stats()
+    stats = get_bfp_stats(assigned_municipality)
     coords = municipality_coords.get(assigned_municipality, {'lat': 14.5995, 'lon': 120.9842})
     
     try:
@@ -568,6 +901,7 @@ def bfp_dashboard():
 
     logger.debug(f"Rendering BFPDashboard for {assigned_municipality}")
     return render_template('BFPDashboard.html', 
+                           last_seq=alerts.last_seq,
                            stats=stats, 
                            municipality=assigned_municipality, 
                            lat_coord=lat_coord,
@@ -616,26 +950,6 @@ def bfp_analytics():
     return render_template('BFPAnalytics.html', trends=trends, distribution=distribution, causes=causes)
 
 if __name__ == '__main__':
-    db_path = os.path.join(os.path.dirname(__file__), 'database', 'users_web.db')
-    try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                barangay TEXT,
-                role TEXT NOT NULL,
-                contact_no TEXT UNIQUE NOT NULL,
-                assigned_municipality TEXT,
-                province TEXT,
-                password TEXT NOT NULL
-            )
-        ''')
-        conn.commit()
-        conn.close()
-        logger.info("Database 'users_web.db' initialized successfully or already exists.")
-    except Exception as e:
-        logger.error(f"Failed to initialize database: {e}", exc_info=True)
-
     # In production (e.g., Render), Gunicorn will be used via render.yaml
     # This block is for local development only
     port = int(os.environ.get('PORT', 5000))
@@ -1,6 +1,4 @@
 from alert_data import alerts
-from collections import Counter
 
-def get_bfp_stats():
-    types = [a.get('emergency_type', 'unknown') for a in alerts if a.get('role') == 'bfp' or a.get('municipality')]
-    return Counter(types)
+def get_bfp_stats(municipality=None):
+    return alerts.count_by_type(role='bfp', municipality=municipality)
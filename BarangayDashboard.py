@@ -1,11 +1,10 @@
 from alert_data import alerts
-from collections import Counter
 
-def get_barangay_stats():
-    types = [a.get('emergency_type', 'unknown') for a in alerts if a.get('role') == 'barangay' or a.get('barangay')]
-    return Counter(types)
+def get_barangay_stats(barangay=None):
+    return alerts.count_by_type(role='barangay', barangay=barangay)
 
-def get_latest_alert():
-    if alerts:
-        return list(alerts)[-1]
-    return None
+def get_latest_alert(barangay=None):
+    if barangay is None:
+        return alerts.latest()
+    matching = alerts.query(role='barangay', barangay=barangay)
+    return matching[-1] if matching else None
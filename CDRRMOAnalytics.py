@@ -1,40 +1,27 @@
-import pandas as pd
 import logging
 from datetime import datetime, timedelta
 import pytz
-import logging
 
-def get_cdrrmo_trends():
+from alert_data import alerts
+
+logger = logging.getLogger(__name__)
+
+def get_cdrrmo_trends(municipality=None, days=7):
     try:
-        cdrrmo_alerts = [a for a in alerts if a.get('role') == 'cdrrmo' or a.get('assigned_municipality')]
         today = datetime.now(pytz.timezone('Asia/Manila')).date()
-        labels = [(today - timedelta(days=i)).strftime('%b %d') for i in range(6, -1, -1)]
-        total = [0] * 7
-        responded = [0] * 7
-        
-        for alert in cdrrmo_alerts:
-            alert_date = datetime.fromisoformat(alert['timestamp']).date()
-            days_ago = (today - alert_date).days
-            if 0 <= days_ago < 7:
-                total[6 - days_ago] += 1
-                if alert.get('responded', False):
-                    responded[6 - days_ago] += 1
-        
+        labels = [(today - timedelta(days=i)).strftime('%b %d') for i in range(days - 1, -1, -1)]
+        total, responded = alerts.trend('day', days, role='cdrrmo', municipality=municipality)
         return {'labels': labels, 'total': total, 'responded': responded}
     except Exception as e:
         logger.error(f"Error in get_cdrrmo_trends: {e}")
         return {'labels': [], 'total': [], 'responded': []}
 
-def get_cdrrmo_distribution():
+def get_cdrrmo_distribution(municipality=None):
     try:
-        cdrrmo_alerts = [a for a in alerts if a.get('role') == 'cdrrmo' or a.get('assigned_municipality')]
-        distribution = defaultdict(lambda: {'total': 0, 'responded': 0})
-        for alert in cdrrmo_alerts:
-            emergency_type = alert.get('emergency_type', 'unknown')
-            distribution[emergency_type]['total'] += 1
-            if alert.get('responded', False):
-                distribution[emergency_type]['responded'] += 1
-        return distribution
+        total = alerts.counts(role='cdrrmo', municipality=municipality)
+        responded = alerts.counts(role='cdrrmo', municipality=municipality, responded=True)
+        return {emergency_type: {'total': count, 'responded': responded[emergency_type]}
+                for emergency_type, count in total.items()}
     except Exception as e:
         logging.error(f"Error in get_cdrrmo_distribution: {e}", exc_info=True)
         return {}
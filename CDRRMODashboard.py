@@ -1,6 +1,4 @@
 from alert_data import alerts
-from collections import Counter
 
-def get_cdrrmo_stats():
-    types = [a.get('emergency_type', 'unknown') for a in alerts if a.get('role') == 'cdrrmo' or a.get('municipality')]
-    return Counter(types)
\ No newline at end of file
+def get_cdrrmo_stats(municipality=None):
+    return alerts.count_by_type(role='cdrrmo', municipality=municipality)
@@ -1,40 +1,27 @@
-import pandas as pd
 import logging
 from datetime import datetime, timedelta
 import pytz
-import logging
 
-def get_pnp_trends():
+from alert_data import alerts
+
+logger = logging.getLogger(__name__)
+
+def get_pnp_trends(municipality=None, days=7):
     try:
-        pnp_alerts = [a for a in alerts if a.get('role') == 'pnp' or a.get('emergency_type') == 'road_accident']
         today = datetime.now(pytz.timezone('Asia/Manila')).date()
-        labels = [(today - timedelta(days=i)).strftime('%b %d') for i in range(6, -1, -1)]
-        total = [0] * 7
-        responded = [0] * 7
-        
-        for alert in pnp_alerts:
-            alert_date = datetime.fromisoformat(alert['timestamp']).date()
-            days_ago = (today - alert_date).days
-            if 0 <= days_ago < 7:
-                total[6 - days_ago] += 1
-                if alert.get('responded', False):
-                    responded[6 - days_ago] += 1
-        
+        labels = [(today - timedelta(days=i)).strftime('%b %d') for i in range(days - 1, -1, -1)]
+        total, responded = alerts.trend('day', days, role='pnp', municipality=municipality)
         return {'labels': labels, 'total': total, 'responded': responded}
     except Exception as e:
         logger.error(f"Error in get_pnp_trends: {e}")
         return {'labels': [], 'total': [], 'responded': []}
 
-def get_pnp_distribution():
+def get_pnp_distribution(municipality=None):
     try:
-        pnp_alerts = [a for a in alerts if a.get('role') == 'pnp' or a.get('emergency_type') == 'road_accident']
-        distribution = defaultdict(lambda: {'total': 0, 'responded': 0})
-        for alert in pnp_alerts:
-            emergency_type = alert.get('emergency_type', 'unknown')
-            distribution[emergency_type]['total'] += 1
-            if alert.get('responded', False):
-                distribution[emergency_type]['responded'] += 1
-        return distribution
+        total = alerts.counts(role='pnp', municipality=municipality)
+        responded = alerts.counts(role='pnp', municipality=municipality, responded=True)
+        return {emergency_type: {'total': count, 'responded': responded[emergency_type]}
+                for emergency_type, count in total.items()}
     except Exception as e:
         logging.error(f"Error in get_pnp_distribution: {e}", exc_info=True)
         return {}
@@ -1,5 +1,5 @@
 from flask import Blueprint, request, redirect, url_for, render_template
-from AlertNow import app  # Ensure you import the app instance
+from AlertNow import app, users  # Ensure you import the app instance
 import sqlite3
 import os
 
@@ -7,16 +7,6 @@ signup_bp = Blueprint('signup', __name__)
 
 
 
-def get_db_connection():
-    db_path = os.getenv('DB_PATH', os.path.join(os.path.dirname(__file__), 'database', 'users_web.db'))
-    if not os.path.exists(db_path):
-        if not os.path.exists(os.path.dirname(db_path)):
-            os.makedirs(os.path.dirname(db_path))
-        open(db_path, 'a').close()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 def get_connection_to_db():
     if os.getenv('RENDER') == 'true':  # Render sets this environment variable
         db_path = '/database/users_web.db'
@@ -37,21 +27,15 @@ def signup_barangay():
         password = request.form['password']
         username = f"{barangay}_{contact_no}"
 
-        conn = get_db_connection()
         try:
-            conn.execute('''
-                INSERT INTO users (barangay, role, contact_no, assigned_municipality, province, password)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (barangay, 'barangay', contact_no, assigned_municipality, province, password))
-            conn.commit()
+            users.add_user('barangay', contact_no, password, barangay=barangay,
+                           assigned_municipality=assigned_municipality, province=province)
             return redirect(url_for('login'))
         except sqlite3.IntegrityError:
             return "User already exists", 400
         except Exception as e:
             app.logger.error(f"Signup failed for {barangay}: {e}", exc_info=True)  # Use current_app
             return f"Signup failed: {e}", 500
-        finally:
-            conn.close()
     return render_template('SignUpPage.html')
 
 @signup_bp.route('/signup_na', methods=['GET'])
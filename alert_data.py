@@ -1,3 +1,11 @@
-from collections import deque
+import os
 
-alerts = deque(maxlen=1000)
\ No newline at end of file
+from alert_store import AlertStore
+from event_bus import create_event_bus
+
+# Set ALERT_BUS_URL=unix:///private/dir/bus.sock when running more than one worker;
+# the directory is created with mode 700 and must not be reachable by other users
+bus = create_event_bus(os.getenv('ALERT_BUS_URL'))
+
+# Single alert repository shared by AlertNow and every dashboard/analytics module
+alerts = AlertStore(bus=bus)
@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from spatial_index import KM_PER_DEGREE, cells_within, grid_cell, haversine_km, parse_point
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RADIUS_M = float(os.getenv('ALERT_DEDUP_RADIUS_M', '150'))
+DEFAULT_WINDOW = float(os.getenv('ALERT_DEDUP_WINDOW_S', '180'))
+
+
+class _Incident:
+    __slots__ = ('id', 'lat', 'lon', 'emergency_type', 'cell', 'last_seen', 'reporters')
+
+    def __init__(self, alert_id, point, emergency_type, cell, seen, reporters):
+        self.id = alert_id
+        self.lat, self.lon = point
+        self.emergency_type = emergency_type
+        self.cell = cell
+        self.last_seen = seen
+        self.reporters = reporters
+
+
+class AlertDeduplicator:
+    """Folds bursts of reports from one place into a single incident at ingest.
+
+    A report of the same emergency type within radius_m of an incident
+    that was last reported less than window seconds ago joins it instead
+    of becoming a new alert; each report extends the incident's window.
+    Open incidents sit in a spatial hash of radius-sized cells, so a check
+    looks at the handful of cells around the report however many are open,
+    and expired ones are dropped from the front of an arrival-ordered queue.
+
+    Inserts and reporter counts published by other workers are applied from
+    the bus, so every worker merges against the same open incidents.
+    """
+
+    def __init__(self, bus=None, radius_m=DEFAULT_RADIUS_M, window=DEFAULT_WINDOW, clock=time.monotonic):
+        self.radius_km = radius_m / 1000
+        self.window = window
+        self.clock = clock
+        self.cell_deg = max(self.radius_km, 1e-6) / KM_PER_DEGREE
+        self._lock = threading.Lock()
+        self._open = {}  # incident id -> _Incident
+        self._cells = defaultdict(dict)  # cell -> {incident id: _Incident}
+        self._expiry = deque()  # (last_seen, incident id), oldest first
+        self.merged = 0
+        self.incidents = 0
+        if bus is not None:
+            bus.subscribe('alerts', self._apply)
+
+    @property
+    def enabled(self):
+        return self.radius_km > 0 and self.window > 0
+
+    def claim(self, alert):
+        """Returns (incident id, reporters) if alert joins an open incident, else registers it and returns None.
+
+        The alert must already carry its id so the registration and the
+        later append refer to the same incident.
+        """
+        point = parse_point(alert.get('lat'), alert.get('lon'))
+        if not self.enabled or point is None:
+            return None
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            incident = self._match(point, alert.get('emergency_type'))
+            if incident is not None:
+                incident.reporters += 1
+                self._touch(incident, now)
+                self.merged += 1
+                return incident.id, incident.reporters
+            self._register(alert['id'], point, alert.get('emergency_type'), now, 1)
+            return None
+
+    def register(self, alert):
+        """Opens an incident for an alert that is stored without going through claim()."""
+        point = parse_point(alert.get('lat'), alert.get('lon'))
+        if not self.enabled or point is None:
+            return
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            self._register(alert['id'], point, alert.get('emergency_type'), now, alert.get('reporters', 1))
+
+    def release(self, alert_id):
+        """Forgets an incident whose alert never made it into the store, so no report merges into it."""
+        with self._lock:
+            self._drop(alert_id)
+
+    def _match(self, point, emergency_type):
+        best, best_km = None, self.radius_km
+        for cell in cells_within(*point, self.radius_km, self.cell_deg):
+            for incident in self._cells.get(cell, {}).values():
+                if incident.emergency_type != emergency_type:
+                    continue
+                km = float(haversine_km(point[0], point[1], incident.lat, incident.lon))
+                if km <= best_km:
+                    best, best_km = incident, km
+        return best
+
+    def _register(self, alert_id, point, emergency_type, now, reporters):
+        if alert_id in self._open:
+            return
+        cell = grid_cell(*point, self.cell_deg)
+        incident = _Incident(alert_id, point, emergency_type, cell, now, reporters)
+        self._open[alert_id] = incident
+        self._cells[cell][alert_id] = incident
+        self._expiry.append((now, alert_id))
+        self.incidents += 1
+
+    def _touch(self, incident, now):
+        incident.last_seen = now
+        # The older queue entry is skipped when it reaches the front
+        self._expiry.append((now, incident.id))
+
+    def _expire(self, now):
+        while self._expiry and now - self._expiry[0][0] > self.window:
+            seen, alert_id = self._expiry.popleft()
+            incident = self._open.get(alert_id)
+            if incident is not None and incident.last_seen == seen:
+                self._drop(alert_id)
+
+    def _drop(self, alert_id):
+        incident = self._open.pop(alert_id, None)
+        if incident is None:
+            return
+        bucket = self._cells[incident.cell]
+        bucket.pop(alert_id, None)
+        if not bucket:
+            del self._cells[incident.cell]
+
+    def _apply(self, message, seq, is_origin):
+        if not self.enabled:
+            return None
+        now = self.clock()
+        with self._lock:
+            if message['op'] == 'transition' and message['status'] == 'closed':
+                # A new report after the incident was closed is a new emergency
+                self._drop(message['id'])
+            elif is_origin:
+                # This worker already registered or counted it in claim()
+                return None
+            elif message['op'] == 'insert':
+                alert = message['alert']
+                point = parse_point(alert.get('lat'), alert.get('lon'))
+                if point is not None:
+                    self._expire(now)
+                    self._register(alert['id'], point, alert.get('emergency_type'), now, alert.get('reporters', 1))
+            elif message['op'] == 'update' and 'reporters' in message['changes']:
+                incident = self._open.get(message['id'])
+                if incident is not None:
+                    incident.reporters = max(incident.reporters, message['changes']['reporters'])
+                    self._touch(incident, now)
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {'open_incidents': len(self._open), 'incidents': self.incidents, 'merged_reports': self.merged,
+                    'radius_m': round(self.radius_km * 1000, 1), 'window_s': self.window}
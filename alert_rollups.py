@@ -0,0 +1,135 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Asia/Manila has no DST, so local day and hour buckets are fixed offsets from UTC
+MANILA_OFFSET = 8 * 3600
+GRANULARITIES = {'hour': 3600, 'day': 86400}
+
+
+def bucket_of(epoch, granularity):
+    return int((epoch + MANILA_OFFSET) // GRANULARITIES[granularity])
+
+
+class AlertRollups:
+    """Hourly and daily alert totals, pre-summed per role, scope and emergency type.
+
+    A scope is None (everything), ('municipality', name) or ('barangay', name),
+    matching AlertStore.counts(). Trends read a contiguous run of buckets
+    instead of re-parsing every alert timestamp.
+    """
+
+    def __init__(self):
+        # (granularity, role, scope, emergency_type) -> {bucket: [total, responded]}
+        self._series = defaultdict(dict)
+        # (granularity, role, scope) -> emergency types seen, for per-type breakdowns
+        self._types = defaultdict(set)
+
+    def add_bucket(self, granularity, keys, bucket, total, responded):
+        for role, scope, emergency_type in keys:
+            counts = self._series[(granularity, role, scope, emergency_type)].setdefault(bucket, [0, 0])
+            counts[0] += total
+            counts[1] += responded
+            if emergency_type is not None:
+                self._types[(granularity, role, scope)].add(emergency_type)
+
+    def series(self, granularity, count, role=None, scope=None, emergency_type=None, now=None):
+        """Returns (total, responded) lists for the count buckets ending at now."""
+        end = bucket_of(time.time() if now is None else now, granularity)
+        buckets = self._series.get((granularity, role, scope, emergency_type), {})
+        total = [0] * count
+        responded = [0] * count
+        for i, bucket in enumerate(range(end - count + 1, end + 1)):
+            counts = buckets.get(bucket)
+            if counts is not None:
+                total[i], responded[i] = counts
+        return total, responded
+
+    def series_by_type(self, granularity, count, role=None, scope=None, now=None):
+        """Returns {emergency_type: (total, responded)} for the count buckets ending at now."""
+        return {emergency_type: self.series(granularity, count, role, scope, emergency_type, now)
+                for emergency_type in sorted(self._types.get((granularity, role, scope), ()))}
+
+
+def benchmark(rows=1000000, days=365, calls=1000, seed=0):
+    """Startup rebuild over rows stored alerts and the cost of a days-long trend, against re-parsing.
+
+    Rows are spread over two years and written straight to SQLite. The
+    baseline parses every stored timestamp into a day bucket, which is
+    what each trend call cost before the rollups.
+    """
+    from alert_store import AlertStore
+
+    rng = random.Random(seed)
+    manila = timezone(timedelta(seconds=MANILA_OFFSET))
+    now = time.time()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'alerts.db')
+        AlertStore(path).close()
+        conn = sqlite3.connect(path)
+        batch = []
+        for seq in range(1, rows + 1):
+            when = datetime.fromtimestamp(now - rng.uniform(0, 730 * 86400), manila).isoformat()
+            emergency_type = rng.choice(['fire', 'road_accident', 'General'])
+            alert = {'seq': seq, 'id': str(seq), 'timestamp': when, 'role': 'barangay',
+                     'barangay': f"Barangay {seq % 80}", 'municipality': 'San Pablo City',
+                     'emergency_type': emergency_type, 'responded': seq % 3 == 0}
+            batch.append((seq, str(seq), seq, when, alert['barangay'], alert['municipality'], 'barangay',
+                          emergency_type, int(alert['responded']), json.dumps(alert)))
+        conn.executemany('''
+            INSERT INTO alerts (seq, id, updated_seq, timestamp, barangay, municipality, role, emergency_type,
+                                responded, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+        conn.commit()
+        timestamps = [row[3] for row in batch]
+        del batch
+
+        started = time.perf_counter()
+        store = AlertStore(path)
+        startup_s = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(calls):
+            total, responded = store.trend('day', days, role='barangay', now=now)
+        trend_ms = (time.perf_counter() - started) / calls * 1000
+        store.close()
+
+        cutoff = bucket_of(now, 'day') - days + 1
+        expected = conn.execute('''
+            SELECT COUNT(*) FROM alerts WHERE (CAST(strftime('%s', timestamp) AS INTEGER) + ?) / 86400 >= ?
+        ''', (MANILA_OFFSET, cutoff)).fetchone()[0]
+        conn.close()
+
+    started = time.perf_counter()
+    counts = defaultdict(int)
+    for when in timestamps:
+        bucket = bucket_of(datetime.fromisoformat(when).timestamp(), 'day')
+        if bucket >= cutoff:
+            counts[bucket] += 1
+    reparse_ms = (time.perf_counter() - started) * 1000
+    return {'rows': rows, 'startup_s': round(startup_s, 2), 'trend_ms': round(trend_ms, 3),
+            'reparse_trend_ms': round(reparse_ms, 1), 'trend_total': sum(total), 'sql_total': expected,
+            'reparse_total': sum(counts.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the alert rollup rebuild and trend reads.')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=365)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for key, value in benchmark(args.rows, args.days).items():
+        logger.info(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,935 @@
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from operator import itemgetter
+
+from alert_rollups import GRANULARITIES, MANILA_OFFSET, AlertRollups, bucket_of
+from event_bus import LocalEventBus
+from spatial_index import cells_within, grid_cell, haversine_km, parse_point
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_DIR = os.getenv('ALERT_DATA_DIR', os.path.join(os.path.dirname(__file__), 'data'))
+DEFAULT_DB_PATH = os.path.join(DEFAULT_DATA_DIR, 'alerts.db')
+
+ROLES = ('barangay', 'cdrrmo', 'pnp', 'bfp')
+INDEXED_FIELDS = ('municipality', 'barangay', 'emergency_type')
+STATUSES = ('new', 'acknowledged', 'responded', 'closed')
+ROUTING_FIELDS = ('role', 'barangay', 'municipality', 'emergency_type', 'timestamp')
+# Hourly buckets older than this are not rebuilt on startup; daily ones always are
+HOURLY_HISTORY_DAYS = 31
+# Hot alerts are hashed into cells this many degrees (~1.1 km) on a side for radius queries
+ALERT_CELL_DEG = 0.01
+# A batch that fails to commit is retried this many times, then written row by row
+WRITE_ATTEMPTS = 3
+WRITE_RETRY_DELAY = 0.1
+# json.dumps() builds an encoder per call; rows share this one. Alerts are decoded
+# request bodies and cannot refer to themselves, so the cycle check is wasted work
+_encode_row = json.JSONEncoder(default=str, check_circular=False).encode
+# At ten columns a row this stays inside SQLite's historical 999-variable limit
+INSERT_ROWS_PER_STATEMENT = 99
+# How long the writer sleeps between looks at an empty queue while a batch fills
+WRITER_NAP = 0.002
+# Deferred rollup buckets are folded in once this many pile up without a trend read
+MAX_UNSETTLED_ROLLUPS = 4096
+
+_CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+# Every two-character Crockford string, indexed by the 10 bits it encodes
+_CROCKFORD_PAIRS = [first + second for first in _CROCKFORD for second in _CROCKFORD]
+_id_lock = threading.Lock()
+_last_id_ms = 0
+_last_id_random = 0
+_last_id_prefix = ''
+_last_id = ''
+# os.urandom releases the GIL, so draw random bits for many ids per call
+_RANDOM_POOL_IDS = 256
+_random_pool = b''
+_random_offset = 0
+
+
+def _random_bits():
+    global _random_pool, _random_offset
+    if _random_offset >= len(_random_pool):
+        _random_pool, _random_offset = os.urandom(10 * _RANDOM_POOL_IDS), 0
+    _random_offset += 10
+    return int.from_bytes(_random_pool[_random_offset - 10:_random_offset], 'big')
+
+
+def new_alert_id():
+    """Returns a ULID: 48-bit millisecond time plus 80 random bits, monotonic per process."""
+    global _last_id_ms, _last_id_random, _last_id_prefix, _last_id
+    with _id_lock:
+        ms = int(time.time() * 1000)
+        if ms <= _last_id_ms:
+            ms = _last_id_ms
+            random_bits = _last_id_random + 1
+            if random_bits >> 80:
+                ms += 1
+                random_bits = _random_bits()
+            elif random_bits >> 10 == _last_id_random >> 10:
+                # Within a burst only the last two characters change
+                _last_id_random = random_bits
+                _last_id = _last_id[:24] + _CROCKFORD_PAIRS[random_bits & 1023]
+                return _last_id
+        else:
+            random_bits = _random_bits()
+        if ms != _last_id_ms or not _last_id_prefix:
+            # The time takes the first 10 characters, the random bits the other 16
+            _last_id_prefix = ''.join([_CROCKFORD_PAIRS[(ms >> shift) & 1023] for shift in range(40, -1, -10)])
+        _last_id_ms, _last_id_random = ms, random_bits
+        _last_id = _last_id_prefix + ''.join([_CROCKFORD_PAIRS[(random_bits >> shift) & 1023]
+                                              for shift in range(70, -1, -10)])
+        return _last_id
+
+
+def route_roles(alert):
+    """Returns the dashboard roles an alert is shown to."""
+    roles = set()
+    if alert.get('role') in ROLES:
+        roles.add(alert['role'])
+    barangay = alert.get('barangay')
+    if barangay and barangay != 'N/A':
+        roles.add('barangay')
+    if alert.get('municipality'):
+        roles.update(('cdrrmo', 'pnp', 'bfp'))
+    if alert.get('emergency_type') == 'fire':
+        roles.add('bfp')
+    elif alert.get('emergency_type') == 'road_accident':
+        roles.add('pnp')
+    return roles
+
+
+def unit_room(unit_id):
+    return f"unit:{unit_id}"
+
+
+def alert_rooms(alert):
+    """Returns the Socket.IO rooms an alert's events are delivered to.
+
+    Every room is scoped to a barangay, a municipality or a unit; an alert
+    with nothing to scope it by has no rooms rather than reaching every
+    dashboard of a role.
+    """
+    rooms = []
+    if alert.get('assigned_unit'):
+        # An assigned alert goes to its unit instead of every responder dashboard
+        rooms.append(unit_room(alert['assigned_unit']))
+    for role in sorted(route_roles(alert)):
+        if alert.get('assigned_unit') and role != 'barangay':
+            continue
+        if role == 'barangay':
+            if alert.get('barangay') not in (None, '', 'N/A'):
+                rooms.append(f"barangay:{alert['barangay']}")
+        elif alert.get('municipality'):
+            rooms.append(f"{role}:{alert['municipality']}")
+    return rooms
+
+
+def session_rooms(role, municipality=None, barangay=None, unit_id=None):
+    """Returns the scoped rooms a logged-in dashboard joins on connect."""
+    if role not in ROLES:
+        return []
+    rooms = []
+    if role == 'barangay' and barangay:
+        rooms.append(f"barangay:{barangay}")
+    elif role != 'barangay' and municipality:
+        rooms.append(f"{role}:{municipality}")
+    if role != 'barangay' and unit_id:
+        rooms.append(unit_room(unit_id))
+    return rooms
+
+
+def _to_epoch(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value.timestamp()
+
+
+class AlertStore:
+    """Durable alert log backed by SQLite (WAL) with an in-memory hot window.
+
+    Appends are acknowledged as soon as the alert is in the hot window; a
+    background writer encodes and commits queued rows in batches so a burst
+    of alerts shares one fsync instead of paying one each. The window's
+    route and spatial indexes are brought up to date by the next read, and
+    counter and rollup deltas are tallied per route and only fanned out to
+    every role, scope and type key when a count or trend is read.
+
+    Every mutation is published on the event bus and applied when it comes
+    back, so all workers sharing a bus keep identical hot windows and
+    sequence numbers; only the publishing worker writes the row.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, hot_size=1000, batch_size=256, flush_interval=0.05,
+                 check_counters=None, replay_size=5000, bus=None):
+        if check_counters is None:
+            check_counters = os.getenv('ALERT_STORE_CHECK_COUNTERS') == '1'
+        self.db_path = db_path
+        self.check_counters = check_counters
+        self.hot_size = hot_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._hot = deque()
+        # route -> {seq: alert}; each index key maps to the routes it covers
+        self._by_route = {}
+        self._index = defaultdict(set)
+        self._by_id = {}
+        self._epoch = {}
+        # Hot alerts above this seq are not in the route, spatial or counter indexes yet
+        self._indexed_seq = 0
+        # seq -> ((lat, lon), spatial-hash cell)
+        self._points = {}
+        self._cells = defaultdict(dict)
+        self._totals = defaultdict(Counter)
+        self._responded = defaultdict(Counter)
+        # Hot totals per route are the route's bucket size; these are the sizes already in
+        # _totals and the routes resized since, then responded and rollup deltas not yet fanned out
+        self._counted = {}
+        self._resized = set()
+        self._unsettled_responded = Counter()
+        self._unsettled_rollups = {}
+        # route -> (index keys, counter keys, rollup keys)
+        self._route_keys = {}
+        self._changes = deque(maxlen=replay_size)
+        self.rollups = AlertRollups()
+        self._pending = queue.SimpleQueue()
+        self._closed = False
+        self._bus = bus or LocalEventBus()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = self._connect()
+        try:
+            self._init_schema(conn)
+            row = conn.execute('SELECT MAX(seq), MAX(updated_seq) FROM alerts').fetchone()
+            self._last_seq = max(row[0] or 0, row[1] or 0)
+            # Changes at or below this sequence are only available from SQLite
+            self._replay_floor = self._last_seq
+            self._load_hot(conn)
+            self._load_rollups(conn)
+        finally:
+            conn.close()
+
+        self._writer = threading.Thread(target=self._writer_loop, name='alert-store-writer', daemon=True)
+        self._writer.start()
+        self._bus.subscribe('alerts', self._apply)
+        self._bus.seed(self._last_seq)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _init_schema(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS alerts (
+                seq INTEGER PRIMARY KEY,
+                id TEXT,
+                updated_seq INTEGER,
+                timestamp TEXT NOT NULL,
+                barangay TEXT,
+                municipality TEXT,
+                role TEXT,
+                emergency_type TEXT,
+                responded INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL
+            )
+        ''')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(alerts)')}
+        if 'municipality' not in columns:
+            conn.execute('ALTER TABLE alerts ADD COLUMN municipality TEXT')
+        if 'id' not in columns:
+            conn.execute('ALTER TABLE alerts ADD COLUMN id TEXT')
+        if 'updated_seq' not in columns:
+            conn.execute('ALTER TABLE alerts ADD COLUMN updated_seq INTEGER')
+            conn.execute('UPDATE alerts SET updated_seq = seq')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_updated_seq ON alerts (updated_seq)')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_id ON alerts (id)')
+        # Filtering by these happens in the hot window's indexes and rollups; on disk they only slowed every insert
+        for column in ('timestamp', 'barangay', 'municipality', 'role', 'emergency_type'):
+            conn.execute(f'DROP INDEX IF EXISTS idx_alerts_{column}')
+        conn.commit()
+
+    def _load_hot(self, conn):
+        rows = conn.execute('SELECT data FROM alerts ORDER BY seq DESC LIMIT ?', (self.hot_size,)).fetchall()
+        for (data,) in reversed(rows):
+            self._add_hot(self._decode(data))
+
+    def _load_rollups(self, conn):
+        # Bucket inside SQLite so a large history costs one grouped scan, not one parse per alert.
+        # Recent rows are also split by hour; older ones only by day
+        epoch = "CAST(strftime('%s', timestamp) AS INTEGER)"
+        cutoff = int(time.time()) - HOURLY_HISTORY_DAYS * 86400
+        rows = conn.execute(f'''
+            SELECT role, barangay, municipality, emergency_type, (epoch + ?) / ?,
+                   CASE WHEN epoch >= ? THEN (epoch + ?) / ? END, COUNT(*), SUM(responded)
+            FROM (SELECT *, {epoch} AS epoch FROM alerts)
+            GROUP BY 1, 2, 3, 4, 5, 6
+        ''', (MANILA_OFFSET, GRANULARITIES['day'], cutoff, MANILA_OFFSET, GRANULARITIES['hour'])).fetchall()
+        for role, barangay, municipality, emergency_type, day, hour, total, responded in rows:
+            if day is None:
+                continue
+            keys = self._keys((role, barangay, municipality, emergency_type))[2]
+            self.rollups.add_bucket('day', keys, day, total, responded or 0)
+            if hour is not None:
+                self.rollups.add_bucket('hour', keys, hour, total, responded or 0)
+
+    @staticmethod
+    def _decode(data):
+        alert = json.loads(data)
+        # Rows written before alerts carried ids fall back to their sequence number
+        alert.setdefault('id', str(alert['seq']))
+        alert.setdefault('status', 'responded' if alert.get('responded') else 'new')
+        alert.setdefault('updated_seq', alert['seq'])
+        return alert
+
+    def _record_change(self, alert, seq):
+        """Stamps an alert with its bus sequence number; caller holds the lock."""
+        alert['updated_seq'] = seq
+        if len(self._changes) == self._changes.maxlen:
+            self._replay_floor = self._changes[0][0]
+        self._changes.append((seq, alert['id']))
+
+    def _index_keys(self, alert):
+        keys = [('role', role) for role in route_roles(alert)]
+        keys.extend((field, alert.get(field)) for field in INDEXED_FIELDS if alert.get(field))
+        return keys
+
+    def _counter_keys(self, alert):
+        scopes = [None]
+        if alert.get('municipality'):
+            scopes.append(('municipality', alert['municipality']))
+        if alert.get('barangay'):
+            scopes.append(('barangay', alert['barangay']))
+        for role in [None, *route_roles(alert)]:
+            for scope in scopes:
+                yield (role, scope)
+
+    def _rollup_keys(self, alert):
+        emergency_type = alert.get('emergency_type') or 'unknown'
+        return [(role, scope, type_key) for role, scope in self._counter_keys(alert)
+                for type_key in (None, emergency_type)]
+
+    @staticmethod
+    def _route(alert):
+        return alert.get('role'), alert.get('barangay'), alert.get('municipality'), alert.get('emergency_type')
+
+    def _keys(self, route):
+        """Returns (index, counter, rollup) keys for a route, derived once per distinct route."""
+        keys = self._route_keys.get(route)
+        if keys is None:
+            alert = dict(zip(ROUTING_FIELDS, route))
+            keys = self._route_keys[route] = (self._index_keys(alert), list(self._counter_keys(alert)),
+                                              self._rollup_keys(alert))
+        return keys
+
+    def _alert_epoch(self, alert):
+        try:
+            return _to_epoch(alert.get('timestamp')) or time.time()
+        except ValueError:
+            return time.time()
+
+    def _roll_up(self, route, epoch, total, responded):
+        counts = self._unsettled_rollups.setdefault((route, bucket_of(epoch, 'hour')), [0, 0])
+        counts[0] += total
+        counts[1] += responded
+        if len(self._unsettled_rollups) > MAX_UNSETTLED_ROLLUPS:
+            self._settle_rollups()
+
+    def _settle(self):
+        """Fans tallied counter and rollup deltas out to every key; caller holds the lock.
+
+        An append and its eviction cancel out here, and a burst from one
+        barangay pays the role and scope fan-out once rather than per alert.
+        """
+        self._catch_up()
+        for route in self._resized:
+            size = len(self._by_route.get(route, ()))
+            self._fan_out(self._totals, route, size - self._counted.get(route, 0))
+            if size:
+                self._counted[route] = size
+            else:
+                self._counted.pop(route, None)
+        self._resized.clear()
+        for route, delta in self._unsettled_responded.items():
+            self._fan_out(self._responded, route, delta)
+        self._unsettled_responded.clear()
+        self._settle_rollups()
+
+    def _fan_out(self, target, route, delta):
+        if delta:
+            emergency_type = route[3] or 'unknown'
+            for key in self._keys(route)[1]:
+                target[key][emergency_type] += delta
+
+    def _settle_rollups(self):
+        for (route, hour), (total, responded) in self._unsettled_rollups.items():
+            keys = self._keys(route)[2]
+            self.rollups.add_bucket('hour', keys, hour, total, responded)
+            # Manila days are whole hours, so the day bucket follows from the hour
+            self.rollups.add_bucket('day', keys, hour * GRANULARITIES['hour'] // GRANULARITIES['day'],
+                                    total, responded)
+        self._unsettled_rollups.clear()
+
+    def _add_hot(self, alert):
+        """Adds an alert to the window; it is indexed by the next read that needs it."""
+        self._hot.append(alert)
+        self._by_id[alert['id']] = alert
+        epoch = self._epoch[alert['seq']] = self._alert_epoch(alert)
+        while len(self._hot) > self.hot_size:
+            self._evict(self._hot.popleft())
+        return epoch
+
+    def _evict(self, alert):
+        seq = alert['seq']
+        self._epoch.pop(seq, None)
+        self._by_id.pop(alert['id'], None)
+        # Alerts evicted before any read needed them were never indexed
+        if seq <= self._indexed_seq:
+            self._unindex(alert)
+
+    def _catch_up(self):
+        """Indexes alerts added since the last read; caller holds the lock."""
+        added = []
+        for alert in reversed(self._hot):
+            if alert['seq'] <= self._indexed_seq:
+                break
+            added.append(alert)
+        for alert in reversed(added):
+            self._index_alert(alert)
+        if added:
+            self._indexed_seq = added[0]['seq']
+
+    def _index_alert(self, alert):
+        seq = alert['seq']
+        route = self._route(alert)
+        bucket = self._by_route.get(route)
+        if bucket is None:
+            bucket = self._by_route[route] = {}
+            for key in self._keys(route)[0]:
+                self._index[key].add(route)
+        bucket[seq] = alert
+        self._resized.add(route)
+        point = parse_point(alert.get('lat'), alert.get('lon'))
+        if point is not None:
+            cell = grid_cell(*point, ALERT_CELL_DEG)
+            self._points[seq] = point, cell
+            self._cells[cell][seq] = alert
+        if alert.get('responded'):
+            self._unsettled_responded[route] += 1
+
+    def _unindex(self, alert):
+        seq = alert['seq']
+        route = self._route(alert)
+        located = self._points.pop(seq, None)
+        if located is not None:
+            cell = located[1]
+            self._cells[cell].pop(seq, None)
+            if not self._cells[cell]:
+                del self._cells[cell]
+        if alert.get('responded'):
+            self._unsettled_responded[route] -= 1
+        bucket = self._by_route[route]
+        del bucket[seq]
+        self._resized.add(route)
+        if not bucket:
+            del self._by_route[route]
+            for key in self._keys(route)[0]:
+                routes = self._index[key]
+                routes.discard(route)
+                if not routes:
+                    del self._index[key]
+
+    def append(self, alert):
+        """Adds an alert and returns the stored copy, stamped with id and seq."""
+        alert.setdefault('id', new_alert_id())
+        alert.setdefault('status', 'new')
+        return self._bus.publish('alerts', {'op': 'insert', 'alert': alert}, sequenced=True)
+
+    def _apply(self, message, seq, is_origin):
+        op = message['op']
+        with self._lock:
+            self._last_seq = max(self._last_seq, seq)
+            if op == 'insert':
+                alert = message['alert']
+                alert['seq'] = seq
+                self._record_change(alert, seq)
+                epoch = self._add_hot(alert)
+                self._roll_up(self._route(alert), epoch, 1, 1 if alert.get('responded') else 0)
+                if is_origin:
+                    self._queue_write('insert', alert)
+                return alert
+            if op == 'transition':
+                return self._apply_transition(message, seq, is_origin)
+            if op == 'update':
+                alert = self._by_id.get(message['id'])
+                if alert is None:
+                    return None
+                alert.update(message['changes'])
+                self._record_change(alert, seq)
+                if is_origin:
+                    self._queue_write('update', alert)
+                return alert
+        raise ValueError(f"Unknown alert store operation: {op}")
+
+    def _queue_write(self, op, alert):
+        """Queues the row as it is now; caller holds the lock.
+
+        Changes replace top-level fields rather than mutating them, so a
+        shallow copy keeps a later update() out of the row while the writer
+        encodes it off the lock.
+        """
+        self._pending.put((op, dict(alert)))
+
+    @staticmethod
+    def _row(op, alert):
+        data = _encode_row(alert)
+        responded = int(bool(alert.get('responded')))
+        if op == 'insert':
+            return (alert['seq'], alert['id'], alert['updated_seq'], alert.get('timestamp'), alert.get('barangay'),
+                    alert.get('municipality'), alert.get('role'), alert.get('emergency_type'), responded, data)
+        return alert['id'], alert['updated_seq'], responded, data, alert['seq']
+
+    def get(self, alert_id):
+        with self._lock:
+            alert = self._by_id.get(alert_id)
+        if alert is None:
+            alert = self._load_by_id(alert_id)
+        return alert
+
+    def _load_by_id(self, alert_id):
+        # The row may still be queued with a change the evicted copy already had
+        self.flush()
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT data FROM alerts WHERE id = ?', (alert_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._decode(row[0]) if row else None
+
+    def transition(self, alert_id, status):
+        """Moves an alert forward to status; returns (alert, changed).
+
+        Repeating or going back to an earlier status is a no-op, so several
+        responders sending the same event only change the alert once.
+        """
+        if status not in STATUSES:
+            raise ValueError(f"Unknown alert status: {status}")
+        alert = self.get(alert_id)
+        if alert is None:
+            return None, False
+        if STATUSES.index(status) <= STATUSES.index(alert.get('status', 'new')):
+            return alert, False
+        # Workers that already evicted the alert still need its routing fields for rollups
+        snapshot = {field: alert.get(field) for field in ROUTING_FIELDS + ('status', 'responded')}
+        return self._bus.publish('alerts', {'op': 'transition', 'id': alert_id, 'status': status,
+                                            'snapshot': snapshot}, sequenced=True)
+
+    def _apply_transition(self, message, seq, is_origin):
+        alert_id, status = message['id'], message['status']
+        alert = self._by_id.get(alert_id)
+        in_hot = alert is not None
+        if alert is None:
+            # Only the publishing worker persists changes to evicted alerts
+            alert = self._load_by_id(alert_id) if is_origin else dict(message['snapshot'], id=alert_id)
+            if alert is None:
+                return None, False
+        if STATUSES.index(status) <= STATUSES.index(alert.get('status', 'new')):
+            return alert, False
+        alert['status'] = status
+        if STATUSES.index(status) >= STATUSES.index('responded') and not alert.get('responded'):
+            alert['responded'] = True
+            route = self._route(alert)
+            # Alerts not indexed yet are counted as responded when they are
+            if in_hot and alert['seq'] <= self._indexed_seq:
+                self._unsettled_responded[route] += 1
+            self._roll_up(route, self._alert_epoch(alert), 0, 1)
+        self._record_change(alert, seq)
+        if is_origin:
+            self._queue_write('update', alert)
+        return alert, True
+
+    def mark_responded(self, alert_id):
+        return self.transition(alert_id, 'responded')
+
+    def update(self, alert_id, **changes):
+        """Sets display-only fields (not role, location or type) on a hot alert."""
+        return self._bus.publish('alerts', {'op': 'update', 'id': alert_id, 'changes': changes}, sequenced=True)
+
+    def query(self, role=None, municipality=None, barangay=None, emergency_type=None, since=None, until=None):
+        """Returns hot-window alerts matching every given filter, oldest first.
+
+        Alerts are bucketed by route (role, barangay, municipality, type) and
+        each filter names the routes it covers, so only the buckets of routes
+        matching every filter are walked rather than the whole window.
+        """
+        filters = [(field, value) for field, value in (('role', role), ('municipality', municipality),
+                                                       ('barangay', barangay), ('emergency_type', emergency_type))
+                   if value is not None]
+        since = _to_epoch(since)
+        until = _to_epoch(until)
+        with self._lock:
+            self._catch_up()
+            if filters:
+                routes = set.intersection(*(self._index.get(key, set()) for key in filters))
+                buckets = [self._by_route[route].values() for route in routes]
+                if len(buckets) == 1:
+                    matched = list(buckets[0])
+                else:
+                    matched = list(heapq.merge(*buckets, key=itemgetter('seq')))
+            else:
+                matched = list(self._hot)
+            if since is not None or until is not None:
+                matched = [alert for alert in matched
+                           if (since is None or self._epoch[alert['seq']] >= since)
+                           and (until is None or self._epoch[alert['seq']] < until)]
+        return matched
+
+    def nearby(self, lat, lon, radius_km, **filters):
+        """Returns [(alert, distance_km)] of hot-window alerts within radius_km of a point, nearest first.
+
+        Only the spatial-hash cells the circle overlaps are visited; filters
+        are those of query() and are applied to the alerts found there.
+        """
+        with self._lock:
+            self._catch_up()
+            candidates = [alert for cell in cells_within(lat, lon, radius_km, ALERT_CELL_DEG)
+                          for alert in self._cells.get(cell, {}).values()]
+            if candidates and any(value is not None for value in filters.values()):
+                matching = {alert['seq'] for alert in self.query(**filters)}
+                candidates = [alert for alert in candidates if alert['seq'] in matching]
+            points = [self._points[alert['seq']][0] for alert in candidates]
+        if not candidates:
+            return []
+        km = haversine_km(lat, lon, [p[0] for p in points], [p[1] for p in points])
+        return sorted(((alert, float(d)) for alert, d in zip(candidates, km) if d <= radius_km),
+                      key=lambda pair: pair[1])
+
+    def counts(self, role=None, municipality=None, barangay=None, responded=False):
+        """Returns per-emergency-type counts for the hot window without rescanning it.
+
+        At most one of municipality or barangay may be given; the counters
+        follow route bucket sizes and responded tallies, so a read only pays
+        for what changed since the last one.
+        """
+        scope = self._scope('counts', municipality, barangay)
+        source = self._responded if responded else self._totals
+        with self._lock:
+            self._settle()
+            result = +source.get((role, scope), Counter())
+            if self.check_counters:
+                self._verify(result, role, municipality, barangay, responded)
+        return result
+
+    def count_by_type(self, role=None, municipality=None, barangay=None, emergency_type=None, since=None, until=None):
+        if emergency_type is None and since is None and until is None and (municipality is None or barangay is None):
+            return self.counts(role=role, municipality=municipality, barangay=barangay)
+        return Counter(alert.get('emergency_type') or 'unknown'
+                       for alert in self.query(role=role, municipality=municipality, barangay=barangay,
+                                               emergency_type=emergency_type, since=since, until=until))
+
+    def _verify(self, result, role, municipality, barangay, responded):
+        matched = self.query(role=role, municipality=municipality, barangay=barangay)
+        expected = Counter(alert.get('emergency_type') or 'unknown'
+                           for alert in matched if not responded or alert.get('responded'))
+        if result != expected:
+            raise AssertionError(f"Alert counters out of sync for role={role} municipality={municipality} "
+                                 f"barangay={barangay} responded={responded}: {dict(result)} != {dict(expected)}")
+
+    def verify_counters(self):
+        """Checks every maintained counter against a full scan of the hot window."""
+        with self._lock:
+            self._settle()
+            for role, scope in list(self._totals):
+                municipality = scope[1] if scope and scope[0] == 'municipality' else None
+                barangay = scope[1] if scope and scope[0] == 'barangay' else None
+                for responded in (False, True):
+                    source = self._responded if responded else self._totals
+                    self._verify(+source.get((role, scope), Counter()), role, municipality, barangay, responded)
+
+    def trend(self, granularity, count, role=None, municipality=None, barangay=None, emergency_type=None, now=None):
+        """Returns (total, responded) per hour or day for the last count buckets, Manila time."""
+        scope = self._scope('trend', municipality, barangay)
+        with self._lock:
+            self._settle_rollups()
+            return self.rollups.series(granularity, count, role=role, scope=scope,
+                                       emergency_type=emergency_type, now=now)
+
+    def trend_by_type(self, granularity, count, role=None, municipality=None, barangay=None, now=None):
+        """Like trend(), split into {emergency_type: (total, responded)}."""
+        scope = self._scope('trend_by_type', municipality, barangay)
+        with self._lock:
+            self._settle_rollups()
+            return self.rollups.series_by_type(granularity, count, role=role, scope=scope, now=now)
+
+    @staticmethod
+    def _scope(caller, municipality, barangay):
+        if municipality is not None and barangay is not None:
+            raise ValueError(f'{caller}() takes municipality or barangay, not both')
+        if municipality is not None:
+            return ('municipality', municipality)
+        if barangay is not None:
+            return ('barangay', barangay)
+        return None
+
+    @property
+    def last_seq(self):
+        with self._lock:
+            return self._last_seq
+
+    def changes_since(self, since, limit=500):
+        """Returns (alerts, last_seq, truncated) for everything changed after since.
+
+        Each alert appears once, in its current state, ordered by its last
+        change. Recent changes come from the in-memory ring; older gaps are
+        read from SQLite.
+        """
+        with self._lock:
+            if since >= self._replay_floor:
+                latest = {}
+                for seq, alert_id in reversed(self._changes):
+                    if seq <= since:
+                        break
+                    latest.setdefault(alert_id, seq)
+                ordered = sorted(latest, key=latest.get)
+                truncated = len(ordered) > limit
+                snapshots = [self._by_id.get(alert_id) for alert_id in ordered[:limit]]
+                if None not in snapshots:
+                    last_seq = snapshots[-1]['updated_seq'] if truncated else self._last_seq
+                    return snapshots, last_seq, truncated
+
+        self.flush()
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT data FROM alerts WHERE updated_seq > ? ORDER BY updated_seq LIMIT ?',
+                                (since, limit + 1)).fetchall()
+        finally:
+            conn.close()
+        snapshots = [self._decode(data) for (data,) in rows]
+        truncated = len(snapshots) > limit
+        snapshots = snapshots[:limit]
+        if truncated:
+            last_seq = snapshots[-1]['updated_seq']
+        else:
+            last_seq = max([self.last_seq] + [alert['updated_seq'] for alert in snapshots])
+        return snapshots, last_seq, truncated
+
+    def latest(self):
+        with self._lock:
+            return self._hot[-1] if self._hot else None
+
+    def history(self, limit=100, offset=0):
+        """Reads alerts older than the hot window straight from SQLite."""
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT data FROM alerts ORDER BY seq DESC LIMIT ? OFFSET ?', (limit, offset)).fetchall()
+        finally:
+            conn.close()
+        return [self._decode(data) for (data,) in rows]
+
+    def locations(self, until_seq=None):
+        """Returns (lat, lon, epoch, emergency_type) of every stored alert up to until_seq, from SQLite."""
+        self.flush()
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'''
+                SELECT json_extract(data, '$.lat'), json_extract(data, '$.lon'),
+                       CAST(strftime('%s', timestamp) AS INTEGER), emergency_type
+                FROM alerts {'WHERE seq <= ?' if until_seq is not None else ''}
+            ''', () if until_seq is None else (until_seq,)).fetchall()
+        finally:
+            conn.close()
+        return rows
+
+    def __len__(self):
+        with self._lock:
+            return len(self._hot)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._hot))
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def flush(self, timeout=None):
+        """Blocks until every queued write has been committed."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._pending.put(('barrier', done))
+        return done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pending.put(None)
+        self._writer.join()
+
+    def _writer_loop(self):
+        conn = self._connect()
+        try:
+            while True:
+                item = self._pending.get()
+                if item is None:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.flush_interval
+                stop = False
+                # Napping while the queue is empty, rather than blocking on it, spares the
+                # appending threads a writer wake-up per row; a flush() is written at once
+                while len(batch) < self.batch_size and batch[-1][0] != 'barrier':
+                    try:
+                        item = self._pending.get_nowait()
+                    except queue.Empty:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        time.sleep(min(remaining, WRITER_NAP))
+                        continue
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._write_batch(conn, batch)
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn, batch):
+        writes = [(op, self._row(op, payload)) for op, payload in batch if op != 'barrier']
+        try:
+            for attempt in range(1, WRITE_ATTEMPTS + 1):
+                try:
+                    self._execute_writes(conn, writes)
+                    return
+                except Exception as e:
+                    logger.warning(f"Failed to persist {len(writes)} alert writes (attempt {attempt}): {e}")
+                    if attempt < WRITE_ATTEMPTS:
+                        time.sleep(WRITE_RETRY_DELAY * attempt)
+            # Keep every row that can be written rather than losing the whole batch to one
+            for op, params in writes:
+                try:
+                    self._execute_writes(conn, [(op, params)])
+                except Exception as e:
+                    seq = params[0] if op == 'insert' else params[-1]
+                    logger.error(f"Dropping alert {op} for seq {seq}: {e}", exc_info=True)
+        finally:
+            for op, payload in batch:
+                if op == 'barrier':
+                    payload.set()
+
+    @staticmethod
+    def _execute_writes(conn, writes):
+        with conn:
+            for op, run in itertools.groupby(writes, key=lambda write: write[0]):
+                rows = [params for _, params in run]
+                if op == 'insert':
+                    # Many rows per statement: SQLite drops the GIL on every step, and one step
+                    # per row hands it to the appending threads (and back) once per alert
+                    for start in range(0, len(rows), INSERT_ROWS_PER_STATEMENT):
+                        chunk = rows[start:start + INSERT_ROWS_PER_STATEMENT]
+                        conn.execute(f'''
+                            INSERT OR REPLACE INTO alerts (seq, id, updated_seq, timestamp, barangay, municipality,
+                                                           role, emergency_type, responded, data)
+                            VALUES {', '.join(['(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'] * len(chunk))}
+                        ''', [value for row in chunk for value in row])
+                else:
+                    conn.executemany('''
+                        UPDATE alerts SET id = ?, updated_seq = ?, responded = ?, data = ? WHERE seq = ?
+                    ''', rows)
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return (round(samples[len(samples) // 2] * 1e6, 1),
+            round(samples[min(len(samples) - 1, len(samples) * 99 // 100)] * 1e6, 1))
+
+
+def benchmark(alerts=20000, seed=0):
+    """Per-append latency (what a request waits for) and time to have every alert committed.
+
+    Two baselines run on the same alerts: appending to a bounded deque, the
+    in-memory list alerts lived in before the store, and one INSERT and
+    commit per alert on the caller's thread, a store without the background
+    writer. Neither keeps a hot window, counters or rollups.
+    """
+    rng = random.Random(seed)
+    types = ['fire', 'road_accident', 'General']
+    batch = [{'lat': 14.07 + rng.uniform(-0.05, 0.05), 'lon': 121.32 + rng.uniform(-0.05, 0.05),
+              'emergency_type': rng.choice(types), 'role': 'barangay', 'barangay': f"Barangay {i % 80}",
+              'municipality': 'San Pablo City', 'timestamp': datetime.now().astimezone().isoformat(),
+              'responded': False}
+             for i in range(alerts)]
+    clock = time.perf_counter
+    with tempfile.TemporaryDirectory() as directory:
+        store = AlertStore(os.path.join(directory, 'alerts.db'))
+        append_times = []
+        started = clock()
+        for alert in batch:
+            before = clock()
+            store.append(alert)
+            append_times.append(clock() - before)
+        append_s = clock() - started
+        store.flush()
+        total_s = clock() - started
+        store.close()
+
+        hot = deque(maxlen=store.hot_size)
+        deque_times = []
+        for alert in batch:
+            before = clock()
+            hot.append(dict(alert))
+            deque_times.append(clock() - before)
+
+        conn = sqlite3.connect(os.path.join(directory, 'baseline.db'))
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE alerts (seq INTEGER PRIMARY KEY, timestamp TEXT, data TEXT)')
+        commit_times = []
+        started = clock()
+        for seq, alert in enumerate(batch, start=1):
+            before = clock()
+            with conn:
+                conn.execute('INSERT INTO alerts VALUES (?, ?, ?)', (seq, alert['timestamp'], json.dumps(alert)))
+            commit_times.append(clock() - before)
+        baseline_s = clock() - started
+        conn.close()
+    append_p50, append_p99 = _percentiles(append_times)
+    deque_p50, deque_p99 = _percentiles(deque_times)
+    commit_p50, commit_p99 = _percentiles(commit_times)
+    return {'alerts': alerts, 'append_us': round(append_s / alerts * 1e6, 1),
+            'append_p50_us': append_p50, 'append_p99_us': append_p99,
+            'append_and_commit_s': round(total_s, 3), 'committed_per_s': round(alerts / total_s),
+            'deque_append_p50_us': deque_p50, 'deque_append_p99_us': deque_p99,
+            'commit_per_alert_p50_us': commit_p50, 'commit_per_alert_p99_us': commit_p99,
+            'commit_per_alert_per_s': round(alerts / baseline_s)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched alert persistence.')
+    parser.add_argument('--alerts', type=int, default=20000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for key, value in benchmark(args.alerts).items():
+        logger.info(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
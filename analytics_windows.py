@@ -0,0 +1,222 @@
+import logging
+import re
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+from dataset_cache import DATASETS, DEFAULT_DATASET_DIR, DatasetCache, epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+MANILA = pytz.timezone('Asia/Manila')
+WINDOWS = ('today', 'week', 'month', 'year')
+# Tab names used by the analytics templates
+WINDOW_ALIASES = {'daily': 'today', 'weekly': 'week', 'monthly': 'month', 'yearly': 'year'}
+# Historical datasets that feed each role's breakdowns
+ROLE_DATASETS = {'bfp': ('fire',), 'pnp': ('road',), 'cdrrmo': ('fire', 'road'), 'barangay': ('fire', 'road')}
+DRIVER_AGE_BINS = [0, 25, 35, 45, 55, 200]
+DRIVER_AGE_LABELS = ['18-24', '25-34', '35-44', '45-54', '55+']
+
+
+def resolve_window(name):
+    window = WINDOW_ALIASES.get(name, name)
+    if window not in WINDOWS:
+        raise ValueError(f"Unknown analytics window: {name}")
+    return window
+
+
+def coords_barangay_name(name):
+    """Maps dataset names like 'I-C (Bagong Bayan)' onto the coords.txt spelling ('Barangay I-C')."""
+    name = re.sub(r'\s*\(.*\)$', '', str(name)).strip()
+    return f"Barangay {name}" if re.fullmatch(r'[IVX]+-[A-Z]', name) else name
+
+
+def window_buckets(window, end):
+    """Returns (granularity, start, labels) for a window ending at the naive local datetime end."""
+    if window == 'today':
+        start = end.replace(hour=0, minute=0, second=0, microsecond=0)
+        return 'hour', start, [f"{hour:02d}:00" for hour in range(end.hour + 1)]
+    if window in ('week', 'month'):
+        days = 7 if window == 'week' else 30
+        start = datetime.combine(end.date() - timedelta(days=days - 1), datetime.min.time())
+        return 'day', start, [(start + timedelta(days=i)).strftime('%b %d') for i in range(days)]
+    first = end.year * 12 + end.month - 12
+    months = [datetime(m // 12, m % 12 + 1, 1) for m in range(first, first + 12)]
+    return 'month', months[0], [month.strftime('%b %Y') for month in months]
+
+
+def bucket_index(granularity, start, data, rows):
+    """Bucket positions of a ColumnarDataset's rows relative to the window start."""
+    if granularity == 'hour':
+        return (data['when'][rows] - epoch_seconds(start)) // 3600
+    if granularity == 'day':
+        return data['day'][rows] - epoch_seconds(start) // 86400
+    return data['month'][rows] - ((start.year - 1970) * 12 + start.month - 1)
+
+
+class WindowedAnalytics:
+    """Trends, distribution and breakdowns for the analytics time tabs.
+
+    Live trends and distribution come from the alert store rollups; the
+    breakdowns the alerts don't carry (causes, weather, casualties...) come
+    from the historical datasets' columnar cache, over the same window
+    ending at the last recorded incident. Results are cached per (role, municipality,
+    barangay, window) until the store or a dataset changes or the hour rolls
+    over, so flipping between tabs is a dict lookup.
+    """
+
+    def __init__(self, store, dataset_dir=DEFAULT_DATASET_DIR, barangay_municipality=None, max_entries=256,
+                 datasets=None):
+        self.store = store
+        self.datasets = datasets or DatasetCache(dataset_dir)
+        self.barangay_municipality = barangay_municipality or {}
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results = {}
+        self._history = {}
+        self._versions = {}
+
+    def get(self, window, role, municipality=None, barangay=None, now=None):
+        window = resolve_window(window)
+        now = now or datetime.now(MANILA)
+        key = (role, municipality, barangay, window)
+        names = ROLE_DATASETS.get(role, tuple(DATASETS))
+        datasets = {name: self._load(name) for name in names}
+        datasets = {name: data for name, data in datasets.items() if data is not None}
+        # Loading only stats the CSVs, so an edited dataset is noticed before the cached result is served
+        stamp = (self.store.last_seq, now.strftime('%Y-%m-%d %H'),
+                 tuple((name, data.version) for name, data in datasets.items()))
+        with self._lock:
+            cached = self._results.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        result = self._live(window, role, municipality, barangay, now.replace(tzinfo=None))
+        result.update(self._historical(window, names, datasets, municipality, barangay, now.replace(tzinfo=None)))
+        with self._lock:
+            if len(self._results) >= self.max_entries:
+                self._results.clear()
+            self._results[key] = (stamp, result)
+        return result
+
+    def _live(self, window, role, municipality, barangay, end):
+        granularity, start, labels = window_buckets(window, end)
+        scope = {'barangay': barangay} if barangay else {'municipality': municipality}
+        if granularity == 'month':
+            # Rollups stop at days; a year window sums them into calendar months
+            days = (end.date() - start.date()).days + 1
+            months = [(start + timedelta(days=i)).month for i in range(days)]
+            positions = [(month - start.month) % 12 for month in months]
+
+            def fold(series):
+                folded = [0] * len(labels)
+                for position, value in zip(positions, series):
+                    folded[position] += value
+                return folded
+
+            total, responded = self.store.trend('day', days, role=role, **scope)
+            by_type = self.store.trend_by_type('day', days, role=role, **scope)
+            total, responded = fold(total), fold(responded)
+        else:
+            total, responded = self.store.trend(granularity, len(labels), role=role, **scope)
+            by_type = self.store.trend_by_type(granularity, len(labels), role=role, **scope)
+
+        distribution = {emergency_type: {'total': sum(t), 'responded': sum(r)}
+                        for emergency_type, (t, r) in by_type.items() if sum(t)}
+        return {'window': window,
+                'trends': {'labels': labels, 'total': total, 'responded': responded},
+                'distribution': distribution}
+
+    def _historical(self, window, names, datasets, municipality, barangay, now):
+        if not datasets:
+            return {'causes': {}}
+        anchor = datetime(1970, 1, 1) + timedelta(seconds=int(max(data['when'].max() for data in datasets.values())))
+        # Same shape of window as the live trend, ending on the last recorded day
+        end = datetime.combine(anchor.date(), now.time())
+        key = (names, municipality, barangay, window, end)
+        with self._lock:
+            cached = self._history.get(key)
+        if cached is not None:
+            return cached
+
+        granularity, start, labels = window_buckets(window, end)
+        result = {'history': {'start': start.isoformat(), 'end': end.isoformat(), 'labels': labels},
+                  'causes': {}, 'weather': {}}
+        for name, data in datasets.items():
+            when = data['when']
+            mask = (when >= epoch_seconds(start)) & (when <= epoch_seconds(end))
+            if barangay or municipality:
+                mask &= self._place_table(data, municipality, barangay)[data['Barangay']]
+            rows = np.flatnonzero(mask)
+            index = bucket_index(granularity, start, data, rows)
+            size = len(labels)
+
+            def per_bucket(column, mean=False):
+                sums = np.bincount(index, weights=data[column][rows].astype(float), minlength=size)[:size]
+                if not mean:
+                    return [int(v) for v in sums]
+                counts = np.bincount(index, minlength=size)[:size]
+                return [round(float(s / c), 1) if c else 0 for s, c in zip(sums, counts)]
+
+            for weather, count in data.counts('Weather', rows).items():
+                result['weather'][weather] = result['weather'].get(weather, 0) + count
+            if name == 'fire':
+                causes = data.counts('Fire_Cause', rows)
+                result.update({
+                    'property_types': data.counts('Property_Type', rows),
+                    'fire_severity': data.counts('Fire_Severity', rows),
+                    'casualty_count': per_bucket('Casualty_Count'),
+                    'response_time': per_bucket('Response_Time', mean=True),
+                    'fire_duration': per_bucket('Fire_Duration', mean=True),
+                })
+            else:
+                causes = data.counts('Accident_Type', rows)
+                # Half-open age bins, as pd.cut(right=False) drew them
+                ages = np.searchsorted(DRIVER_AGE_BINS, data['Driver_Age'][rows], side='right') - 1
+                ages = np.bincount(ages[(ages >= 0) & (ages < len(DRIVER_AGE_LABELS))],
+                                   minlength=len(DRIVER_AGE_LABELS))
+                injuries = per_bucket('Injuries')
+                fatalities = per_bucket('Fatalities')
+                result.update({
+                    'road_conditions': data.counts('Road_Condition', rows),
+                    'vehicle_types': data.counts('Vehicle_Type', rows),
+                    'driver_age': {label: int(count) for label, count in zip(DRIVER_AGE_LABELS, ages)},
+                    'driver_gender': data.counts('Driver_Gender', rows),
+                    'accident_type': data.counts('Accident_Type', rows),
+                    'injuries': injuries,
+                    'fatalities': fatalities,
+                    'injuries_by_time': {'labels': labels, 'data': injuries},
+                    'fatalities_by_time': {'labels': labels, 'data': fatalities},
+                })
+            for cause, count in causes.items():
+                result['causes'][cause] = result['causes'].get(cause, 0) + count
+
+        with self._lock:
+            if len(self._history) >= self.max_entries:
+                self._history.clear()
+            self._history[key] = result
+        return result
+
+    def _place_table(self, data, municipality, barangay):
+        """Which Barangay codes fall in the scope: a boolean per code, plus False for missing (-1)."""
+        hits = []
+        for name in data.dictionaries['Barangay']:
+            place = coords_barangay_name(name)
+            if barangay:
+                hits.append(name == barangay or place == barangay)
+            else:
+                hits.append(self.barangay_municipality.get(place) == municipality)
+        return np.array(hits + [False])
+
+    def _load(self, name):
+        data = self.datasets.load(name)
+        if data is None:
+            return None
+        with self._lock:
+            if self._versions.get(name, data.version) != data.version:
+                # Breakdowns are keyed by window, not version; live results carry the versions in their stamp
+                self._history.clear()
+            self._versions[name] = data.version
+        return data
@@ -0,0 +1,455 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(__file__), 'training')
+DEFAULT_COMPACT_DIR = os.path.join(DEFAULT_MODEL_DIR, 'compact')
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+
+class UnsupportedModel(ValueError):
+    pass
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def artifact_dir(pickle_path, model_dir=DEFAULT_MODEL_DIR, compact_dir=DEFAULT_COMPACT_DIR):
+    """training/Fire Models/lr_fire_incident.pkl -> training/compact/Fire Models/lr_fire_incident"""
+    relative = os.path.relpath(pickle_path, model_dir)
+    return os.path.join(compact_dir, os.path.splitext(relative)[0])
+
+
+# --- Loading and evaluation (NumPy only) ---
+
+class CompactPreprocessor:
+    """The ColumnTransformer of a training pipeline: imputed and scaled numeric
+    columns followed by imputed one-hot categorical columns, as a dense array."""
+
+    def __init__(self, spec, arrays):
+        self.numeric = spec['numeric']
+        self.categorical = spec['categorical']
+        self.numeric_fill = arrays['numeric_fill']
+        self.mean = arrays['scale_mean']
+        self.scale = arrays['scale']
+        self.categorical_fill = spec['categorical_fill']
+        self.n_features = spec['n_features']
+        # value -> output column (or -1 for the dropped category), per categorical column
+        self._columns = []
+        offset = len(self.numeric)
+        for categories, drop in zip(spec['categories'], spec['drop']):
+            lookup = {}
+            for i, category in enumerate(categories):
+                if i == drop:
+                    lookup[category] = -1
+                else:
+                    lookup[category] = offset
+                    offset += 1
+            self._columns.append(lookup)
+        if offset != self.n_features:
+            raise UnsupportedModel(f"Categories add up to {offset} features, expected {self.n_features}")
+
+    def transform(self, frame):
+        """frame is anything indexable by column name: a DataFrame or a dict of arrays."""
+        numeric = np.column_stack([np.asarray(frame[column], dtype=np.float64) for column in self.numeric])
+        rows = len(numeric)
+        out = np.zeros((rows, self.n_features))
+        out[:, :len(self.numeric)] = (np.where(np.isnan(numeric), self.numeric_fill, numeric) - self.mean) / self.scale
+        for column, fill, lookup in zip(self.categorical, self.categorical_fill, self._columns):
+            values = [fill if _is_missing(value) else value for value in np.asarray(frame[column], dtype=object)]
+            # Unknown categories encode to all zeros, like handle_unknown='ignore'
+            positions = np.fromiter((lookup.get(value, -1) for value in values), dtype=np.int64, count=rows)
+            hit = positions >= 0
+            out[np.flatnonzero(hit), positions[hit]] = 1.0
+        return out
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _dense(X):
+    return X.toarray() if hasattr(X, 'toarray') else np.asarray(X)
+
+
+class CompactLogistic:
+    """LogisticRegression.predict_proba from its weight arrays."""
+
+    def __init__(self, spec, arrays):
+        self.classes_ = np.array(spec['classes'])
+        self.multinomial = spec['multinomial']
+        self.coef = arrays['coef']
+        self.intercept = arrays['intercept']
+
+    def decision_function(self, X):
+        scores = X @ self.coef.T + self.intercept
+        return np.asarray(scores)
+
+    def predict_proba(self, X):
+        scores = self.decision_function(X)
+        if not self.multinomial:
+            probabilities = 1 / (1 + np.exp(-scores))
+            if probabilities.shape[1] == 1:
+                return np.hstack([1 - probabilities, probabilities])
+            return probabilities / probabilities.sum(axis=1, keepdims=True)
+        if scores.shape[1] == 1:
+            scores = np.hstack([-scores, scores])
+        return _softmax(scores)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class CompactTrees:
+    """A decision tree or boosted ensemble as flat node arrays.
+
+    All trees are walked at once: every row holds one node index per tree
+    and takes a step down each tree per level, so a batch costs max_depth
+    vectorized gathers whatever the number of trees. Node i's children sit
+    at children[2i] (left) and children[2i + 1] (right); leaves point at
+    themselves, so rows that reach a leaf early stay put.
+    """
+
+    def __init__(self, spec, arrays):
+        self.classes_ = np.array(spec['classes'])
+        self.kind = spec['kind']
+        self.max_depth = spec['max_depth']
+        self.objective = spec.get('objective')
+        self.zero_is_missing = spec.get('zero_is_missing', False)
+        self.base_score = arrays.get('base_score')
+        self.roots = arrays['roots']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.children = arrays['children']
+        self.default_left = arrays['default_left']
+        self.value = arrays['value']
+        self.tree_class = arrays.get('tree_class')
+
+    def _leaves(self, X):
+        X = _dense(X).astype(np.float32)
+        if self.zero_is_missing:
+            # The pipeline hands XGBoost a sparse matrix, whose absent entries count as missing
+            X[X == 0] = np.nan
+        flat = X.ravel()
+        row_start = (np.arange(len(X), dtype=np.int64) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.max_depth):
+            x = flat[row_start + self.feature[node]]
+            # sklearn sends x <= threshold left, XGBoost x < threshold
+            if self.kind == 'xgboost':
+                right = ~(x < self.threshold[node])
+            else:
+                right = ~(x <= self.threshold[node])
+            missing = np.isnan(x)
+            right[missing] = ~self.default_left[node[missing]]
+            node = self.children[2 * node + right]
+        return node
+
+    def predict_proba(self, X):
+        leaves = self._leaves(X)
+        if self.kind == 'sklearn':
+            value = self.value[leaves[:, 0]]
+            return value / value.sum(axis=1, keepdims=True)
+        margins = np.zeros((len(leaves), len(self.base_score)))
+        np.add.at(margins.T, self.tree_class, self.value[leaves, 0].T)
+        margins += self.base_score
+        if self.objective == 'binary:logistic':
+            positive = 1 / (1 + np.exp(-margins[:, 0]))
+            return np.column_stack([1 - positive, positive])
+        return _softmax(margins)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+class CompactPipeline:
+    """Stands in for the sklearn Pipeline: named_steps, predict and predict_proba."""
+
+    def __init__(self, preprocessor, classifier):
+        self.named_steps = {'preprocessor': preprocessor, 'classifier': classifier}
+        self.classes_ = classifier.classes_
+
+    def predict_proba(self, frame):
+        return self.named_steps['classifier'].predict_proba(self.named_steps['preprocessor'].transform(frame))
+
+    def predict(self, frame):
+        return self.named_steps['classifier'].predict(self.named_steps['preprocessor'].transform(frame))
+
+
+CLASSIFIERS = {'logistic': CompactLogistic, 'trees': CompactTrees}
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def load_compact(path):
+    """Loads an exported artifact directory. Arrays are memory-mapped read-only,
+    so every worker process maps the same page-cache pages."""
+    manifest = read_manifest(path)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise UnsupportedModel(f"{path} has artifact format {manifest.get('format')}, expected {FORMAT_VERSION}")
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in manifest['arrays']}
+    classifier = CLASSIFIERS[manifest['classifier']['type']](manifest['classifier'], arrays)
+    if manifest.get('preprocessor') is None:
+        return classifier
+    return CompactPipeline(CompactPreprocessor(manifest['preprocessor'], arrays), classifier)
+
+
+def artifact_bytes(path):
+    manifest = read_manifest(path)
+    return sum(os.path.getsize(os.path.join(path, f"{name}.npy")) for name in manifest['arrays'])
+
+
+# --- Export (needs the pickles' sklearn/xgboost classes to unpickle) ---
+
+def _export_preprocessor(preprocessor, arrays):
+    transformers = [(name, transformer, columns) for name, transformer, columns in preprocessor.transformers_
+                    if name != 'remainder' and transformer != 'drop']
+    if [name for name, _, _ in transformers] != ['num', 'cat'] or preprocessor.remainder != 'drop':
+        raise UnsupportedModel(f"Expected num and cat transformers, got {[name for name, _, _ in transformers]}")
+    (_, numeric, numeric_columns), (_, categorical, categorical_columns) = transformers
+    num_steps = dict(numeric.steps)
+    cat_steps = dict(categorical.steps)
+    if set(num_steps) != {'imputer', 'scaler'} or set(cat_steps) != {'imputer', 'onehot'}:
+        raise UnsupportedModel(f"Unexpected preprocessing steps {list(num_steps)} / {list(cat_steps)}")
+    scaler = num_steps['scaler']
+    onehot = cat_steps['onehot']
+    if getattr(onehot, 'infrequent_categories_', None) and any(c is not None for c in onehot.infrequent_categories_):
+        raise UnsupportedModel("Infrequent category grouping is not supported")
+    count = len(numeric_columns)
+    arrays['numeric_fill'] = np.asarray(num_steps['imputer'].statistics_, dtype=np.float64)
+    arrays['scale_mean'] = np.asarray(scaler.mean_ if scaler.with_mean else np.zeros(count), dtype=np.float64)
+    arrays['scale'] = np.asarray(scaler.scale_ if scaler.with_std else np.ones(count), dtype=np.float64)
+    drop = onehot.drop_idx_ if onehot.drop_idx_ is not None else [None] * len(categorical_columns)
+    return {
+        'columns': [str(column) for column in preprocessor.feature_names_in_],
+        'numeric': list(numeric_columns),
+        'categorical': list(categorical_columns),
+        'categorical_fill': cat_steps['imputer'].statistics_.tolist(),
+        'categories': [categories.tolist() for categories in onehot.categories_],
+        'drop': [-1 if index is None else int(index) for index in drop],
+        'n_features': int(len(preprocessor.get_feature_names_out())),
+        # XGBoost reads the absent entries of a sparse matrix as missing values
+        'sparse_output': bool(preprocessor.sparse_output_),
+    }
+
+
+def _export_logistic(model, arrays):
+    classes = model.classes_
+    multi_class = getattr(model, 'multi_class', 'auto')
+    ovr = multi_class in ('ovr', 'warn') or (multi_class in ('auto', 'deprecated')
+                                            and (len(classes) == 2 or model.solver == 'liblinear'))
+    arrays['coef'] = np.asarray(model.coef_, dtype=np.float64)
+    arrays['intercept'] = np.asarray(model.intercept_, dtype=np.float64)
+    return {'type': 'logistic', 'classes': classes.tolist(), 'multinomial': not ovr}
+
+
+def _flatten(trees, arrays):
+    """Concatenates per-tree node arrays into one set of global arrays; leaves point at themselves."""
+    roots, feature, threshold, children, default_left, value = [], [], [], [], [], []
+    offset = 0
+    for tree in trees:
+        size = len(tree['left'])
+        is_leaf = tree['left'] < 0
+        own = np.arange(size) + offset
+        roots.append(offset)
+        feature.append(np.where(is_leaf, 0, tree['feature']))
+        threshold.append(tree['threshold'])
+        children.append(np.column_stack([np.where(is_leaf, own, tree['left'] + offset),
+                                         np.where(is_leaf, own, tree['right'] + offset)]).ravel())
+        default_left.append(tree['default_left'])
+        value.append(tree['value'])
+        offset += size
+    arrays['roots'] = np.asarray(roots, dtype=np.int32)
+    arrays['feature'] = np.concatenate(feature).astype(np.int32)
+    arrays['children'] = np.concatenate(children).astype(np.int32)
+    arrays['default_left'] = np.concatenate(default_left).astype(bool)
+    arrays['value'] = np.concatenate(value).astype(np.float64)
+    return threshold
+
+
+def _export_sklearn_tree(model, arrays):
+    tree = model.tree_
+    if tree.n_outputs != 1:
+        raise UnsupportedModel("Multi-output trees are not supported")
+    go_left = getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=bool)).astype(bool)
+    threshold = _flatten([{
+        'feature': tree.feature, 'threshold': tree.threshold, 'left': tree.children_left,
+        'right': tree.children_right, 'default_left': go_left,
+        'value': tree.value[:, 0, :],
+    }], arrays)
+    # sklearn compares float32 features against float64 thresholds
+    arrays['threshold'] = np.concatenate(threshold).astype(np.float64)
+    return {'type': 'trees', 'kind': 'sklearn', 'classes': model.classes_.tolist(), 'max_depth': int(tree.max_depth)}
+
+
+def _export_xgboost(model, arrays, sparse_input):
+    booster = json.loads(model.get_booster().save_raw(raw_format='json'))['learner']
+    objective = booster['objective']['name']
+    if objective not in ('multi:softprob', 'multi:softmax', 'binary:logistic'):
+        raise UnsupportedModel(f"XGBoost objective {objective} is not supported")
+    if booster['gradient_booster']['name'] != 'gbtree':
+        raise UnsupportedModel(f"XGBoost booster {booster['gradient_booster']['name']} is not supported")
+    forest = booster['gradient_booster']['model']
+    trees = []
+    max_depth = 0
+    for tree in forest['trees']:
+        if any(tree['split_type']):
+            raise UnsupportedModel("Categorical XGBoost splits are not supported")
+        left = np.asarray(tree['left_children'])
+        right = np.asarray(tree['right_children'])
+        default_left = np.asarray(tree['default_left'], dtype=bool)
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        depth = np.zeros(len(left), dtype=np.int64)
+        for node in range(len(left)):
+            if left[node] >= 0:
+                depth[left[node]] = depth[right[node]] = depth[node] + 1
+        max_depth = max(max_depth, int(depth.max()))
+        trees.append({
+            'feature': np.asarray(tree['split_indices']), 'threshold': conditions, 'left': left, 'right': right,
+            'default_left': default_left,
+            # A leaf's split condition holds its value
+            'value': np.where(left < 0, conditions, 0).astype(np.float64)[:, None],
+        })
+    threshold = _flatten(trees, arrays)
+    arrays['threshold'] = np.concatenate(threshold).astype(np.float32)
+    arrays['tree_class'] = np.asarray(forest['tree_info'], dtype=np.int32)
+    base_score = booster['learner_model_param']['base_score'].strip('[]').split(',')
+    classes = max(1, int(booster['learner_model_param'].get('num_class', '0')))
+    base_score = np.asarray([float(score) for score in base_score], dtype=np.float64)
+    arrays['base_score'] = np.resize(base_score, classes)
+    if objective == 'binary:logistic':
+        # The margin starts from the logit of the base probability
+        arrays['base_score'] = np.log(arrays['base_score'] / (1 - arrays['base_score']))
+    return {'type': 'trees', 'kind': 'xgboost', 'classes': model.classes_.tolist(), 'max_depth': max_depth,
+            'objective': objective, 'zero_is_missing': sparse_input}
+
+
+def export_model(model, out_dir, source=None):
+    """Writes model as a manifest plus one .npy per array into out_dir.
+
+    Supports the training pipelines (ColumnTransformer + LogisticRegression
+    or XGBClassifier) and bare DecisionTreeClassifiers; anything else raises
+    UnsupportedModel.
+    """
+    arrays = {}
+    preprocessor = None
+    classifier = model
+    if hasattr(model, 'named_steps'):
+        if list(model.named_steps) != ['preprocessor', 'classifier']:
+            raise UnsupportedModel(f"Unexpected pipeline steps {list(model.named_steps)}")
+        preprocessor = _export_preprocessor(model.named_steps['preprocessor'], arrays)
+        classifier = model.named_steps['classifier']
+    name = type(classifier).__name__
+    if name == 'LogisticRegression':
+        spec = _export_logistic(classifier, arrays)
+    elif name == 'DecisionTreeClassifier':
+        spec = _export_sklearn_tree(classifier, arrays)
+    elif name == 'XGBClassifier':
+        spec = _export_xgboost(classifier, arrays, sparse_input=bool(preprocessor and preprocessor['sparse_output']))
+    else:
+        raise UnsupportedModel(f"{name} has no compact form")
+
+    os.makedirs(out_dir, exist_ok=True)
+    for array_name, array in arrays.items():
+        np.save(os.path.join(out_dir, f"{array_name}.npy"), np.ascontiguousarray(array))
+    manifest = {'format': FORMAT_VERSION, 'preprocessor': preprocessor, 'classifier': spec,
+                'arrays': sorted(arrays)}
+    if source is not None:
+        manifest.update(source=os.path.basename(source), source_sha256=file_sha256(source))
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def served_pickles(model_dir=DEFAULT_MODEL_DIR):
+    """The pickles under model_dir that ModelRegistry serves; other experiments there are not exported."""
+    from model_registry import MODEL_PATHS
+
+    paths = (os.path.join(model_dir, path) for path in MODEL_PATHS.values())
+    return [path for path in paths if os.path.exists(path)]
+
+
+def export_all(model_dir=DEFAULT_MODEL_DIR, compact_dir=DEFAULT_COMPACT_DIR):
+    """Exports every supported served pickle; returns {pickle path: artifact dir}."""
+    import joblib
+
+    exported = {}
+    for path in served_pickles(model_dir):
+        out_dir = artifact_dir(path, model_dir, compact_dir)
+        try:
+            export_model(joblib.load(path), out_dir, source=path)
+        except UnsupportedModel as e:
+            logger.info(f"Skipping {os.path.relpath(path, model_dir)}: {e}")
+            continue
+        exported[path] = out_dir
+        logger.info(f"Exported {os.path.relpath(path, model_dir)} ({artifact_bytes(out_dir) / 1024:.0f} KiB)")
+    return exported
+
+
+def verify(pickle_path, out_dir, dataset_dir, rows=2000, tolerance=1e-6):
+    """Compares the compact model with the pickle on dataset rows; returns (max |dp|, label agreement)."""
+    import joblib
+
+    original = joblib.load(pickle_path)
+    compact = load_compact(out_dir)
+    manifest = read_manifest(out_dir)
+    if manifest['preprocessor'] is None:
+        features = np.random.default_rng(0).integers(0, 256, (rows, original.n_features_in_), dtype=np.uint8)
+    else:
+        import pandas as pd
+
+        columns = manifest['preprocessor']['columns']
+        dataset = 'fire_incident.csv' if 'fire' in os.path.basename(pickle_path) else 'road_accident.csv'
+        data = pd.read_csv(os.path.join(dataset_dir, dataset))
+        features = data.sample(min(rows, len(data)), random_state=0)[columns]
+    expected = np.asarray(original.predict_proba(features))
+    actual = compact.predict_proba(features)
+    error = float(np.abs(expected - actual).max())
+    agreement = float((original.predict(features) == compact.predict(features)).mean())
+    status = 'ok' if error <= tolerance and agreement == 1.0 else 'MISMATCH'
+    logger.info(f"{os.path.basename(pickle_path)}: max |dp| {error:.2e}, label agreement {agreement:.4f} {status}")
+    return error, agreement
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export trained models as memory-mappable NumPy artifacts.')
+    parser.add_argument('--models', default=DEFAULT_MODEL_DIR, help='directory holding the .pkl models')
+    parser.add_argument('--out', default=DEFAULT_COMPACT_DIR, help='where to write the artifacts')
+    parser.add_argument('--verify', action='store_true', help='check each artifact against its pickle')
+    parser.add_argument('--dataset', default=os.path.join(os.path.dirname(__file__), 'dataset'))
+    parser.add_argument('--tolerance', type=float, default=1e-6)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    exported = export_all(args.models, args.out)
+    if args.verify:
+        failed = []
+        for path, out_dir in exported.items():
+            error, agreement = verify(path, out_dir, args.dataset, tolerance=args.tolerance)
+            if error > args.tolerance or agreement < 1.0:
+                failed.append(path)
+        if failed:
+            raise SystemExit(f"{len(failed)} artifacts disagree with their pickles")
+
+if __name__ == '__main__':
+    main()
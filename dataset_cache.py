@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from compact_models import file_sha256
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATASET_DIR = os.path.join(os.path.dirname(__file__), 'dataset')
+DATASETS = {'fire': 'fire_incident.csv', 'road': 'road_accident.csv'}
+FORMAT_VERSION = 1
+# 'when' of rows whose Date/Time don't parse; sorts before every real timestamp
+MISSING_WHEN = np.iinfo(np.int64).min
+DERIVED = ('when', 'day', 'month')
+
+
+def epoch_seconds(moment):
+    """Seconds since 1970-01-01 of a naive local datetime, the unit of the 'when' column."""
+    return int((np.datetime64(moment, 's') - np.datetime64(0, 's')).astype(np.int64))
+
+
+class ColumnarDataset:
+    """One dataset CSV as typed, memory-mapped column arrays.
+
+    Text columns are int32 codes into a sorted dictionary (-1 for a
+    missing value); numeric columns keep their parsed dtype. Derived
+    columns: 'when' (seconds since the epoch of the local Date + Time),
+    'day' (days since the epoch) and 'month' (months since January 1970).
+    """
+
+    def __init__(self, name, manifest, arrays):
+        self.name = name
+        self.version = manifest['source']['sha256']
+        self.rows = manifest['rows']
+        self.columns = manifest['columns']
+        self.dictionaries = manifest['dictionaries']
+        self._arrays = arrays
+        self._lookups = {}
+
+    def __getitem__(self, column):
+        return self._arrays[column]
+
+    def is_categorical(self, column):
+        return column in self.dictionaries
+
+    def code(self, column, value):
+        """The code of value in a text column, or -1 if it never occurs."""
+        lookup = self._lookups.get(column)
+        if lookup is None:
+            lookup = self._lookups[column] = {v: i for i, v in enumerate(self.dictionaries[column])}
+        return lookup.get(value, -1)
+
+    def values(self, column, rows=None):
+        """Decoded values of a column (None where missing)."""
+        data = self._arrays[column] if rows is None else self._arrays[column][rows]
+        if column not in self.dictionaries:
+            return np.asarray(data)
+        return np.asarray(self.dictionaries[column] + [None], dtype=object)[data]
+
+    def counts(self, column, rows=None):
+        """{value: count} of a text column over rows, most frequent first, like value_counts()."""
+        codes = self._arrays[column] if rows is None else self._arrays[column][rows]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.dictionaries[column]))
+        order = np.argsort(-counts, kind='stable')
+        return {self.dictionaries[column][i]: int(counts[i]) for i in order if counts[i]}
+
+    def mode(self, column):
+        """Most frequent value; ties go to the value that sorts first, as with Series.mode()."""
+        codes = self._arrays[column]
+        return self.dictionaries[column][int(np.bincount(codes[codes >= 0]).argmax())]
+
+    def to_frame(self):
+        """The original columns as a pandas DataFrame, text decoded back to strings."""
+        import pandas as pd
+
+        return pd.DataFrame({column: self.values(column) for column in self.columns})
+
+
+class DatasetCache:
+    """Typed columnar copies of the dataset CSVs under cache_dir/<name>/
+    (dataset_dir/.cache unless given).
+
+    The first load parses the CSV once (pandas, day-first dates) and writes
+    one .npy per column plus a manifest of dtypes, dictionaries and the
+    source's size, mtime and sha256; later loads memory-map the arrays.
+    Every load stats the CSV: a changed size or mtime is re-hashed, and a
+    changed hash rebuilds the cache.
+    """
+
+    def __init__(self, dataset_dir=DEFAULT_DATASET_DIR, cache_dir=None):
+        self.dataset_dir = dataset_dir
+        self.cache_dir = cache_dir or os.path.join(dataset_dir, '.cache')
+        self._lock = threading.Lock()
+        self._loaded = {}  # name -> (stat key, ColumnarDataset)
+
+    def path(self, name):
+        return os.path.join(self.dataset_dir, DATASETS[name])
+
+    def load(self, name):
+        """Returns the ColumnarDataset for name, or None if its CSV is missing."""
+        try:
+            stat = os.stat(self.path(name))
+        except OSError:
+            logger.error(f"{DATASETS[name]} not found in {self.dataset_dir}")
+            return None
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._loaded.get(name)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            data = self._open(name, stat)
+            self._loaded[name] = (key, data)
+            return data
+
+    def _open(self, name, stat):
+        out_dir = os.path.join(self.cache_dir, name)
+        manifest_path = os.path.join(out_dir, 'manifest.json')
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if manifest is not None and manifest.get('format') == FORMAT_VERSION:
+            source = manifest['source']
+            if (source['size'], source['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+                # Touched but identical files (a fresh checkout, a copy) keep their cache
+                if source['sha256'] == file_sha256(self.path(name)):
+                    source.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                    _write_json(manifest_path, manifest)
+                else:
+                    manifest = None
+        else:
+            manifest = None
+        if manifest is None:
+            manifest = self._ingest(name, out_dir)
+        arrays = {column: np.load(os.path.join(out_dir, f"{column}.npy"), mmap_mode='r')
+                  for column in manifest['columns'] + list(DERIVED)}
+        return ColumnarDataset(name, manifest, arrays)
+
+    def _ingest(self, name, out_dir):
+        import pandas as pd
+
+        started = time.perf_counter()
+        path = self.path(name)
+        stat = os.stat(path)
+        digest = file_sha256(path)
+        frame = pd.read_csv(path)
+        tmp_dir = f"{out_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        dictionaries, dtypes = {}, {}
+        for column in frame.columns:
+            series = frame[column]
+            if pd.api.types.is_numeric_dtype(series):
+                array = series.to_numpy()
+            else:
+                codes, uniques = pd.factorize(series.astype(object), sort=True)
+                array = codes.astype(np.int32)
+                dictionaries[column] = [str(value) for value in uniques]
+            dtypes[column] = str(array.dtype)
+            np.save(os.path.join(tmp_dir, f"{column}.npy"), array)
+
+        when = pd.to_datetime(frame['Date'] + ' ' + frame['Time'], format='%d/%m/%Y %H:%M', errors='coerce')
+        when = when.to_numpy(dtype='datetime64[s]')
+        missing = np.isnat(when)
+        np.save(os.path.join(tmp_dir, 'when.npy'), np.where(missing, MISSING_WHEN, when.astype(np.int64)))
+        for column, unit in (('day', 'D'), ('month', 'M')):
+            since_epoch = np.where(missing, np.iinfo(np.int32).min, when.astype(f"datetime64[{unit}]").astype(np.int64))
+            np.save(os.path.join(tmp_dir, f"{column}.npy"), since_epoch.astype(np.int32))
+
+        manifest = {'format': FORMAT_VERSION, 'rows': len(frame), 'columns': list(frame.columns), 'dtypes': dtypes,
+                    'dictionaries': dictionaries,
+                    'source': {'file': DATASETS[name], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                               'sha256': digest}}
+        _write_json(os.path.join(tmp_dir, 'manifest.json'), manifest)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+        logger.info(f"Cached {len(frame)} rows of {DATASETS[name]} as columns in "
+                    f"{(time.perf_counter() - started) * 1000:.0f} ms")
+        return manifest
+
+
+def _write_json(path, data):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
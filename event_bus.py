@@ -0,0 +1,472 @@
+import fcntl
+import logging
+import os
+import pickle
+import queue
+import socket
+import struct
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from urllib.parse import urlparse
+
+import socketio
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('!I')
+
+
+def _encode_frame(obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(data)) + data
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError('Event bus connection closed')
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _recv_raw_frame(sock):
+    header = _recv_exact(sock, _HEADER.size)
+    return header + _recv_exact(sock, _HEADER.unpack(header)[0])
+
+
+def _recv_frame(sock):
+    return pickle.loads(_recv_raw_frame(sock)[_HEADER.size:])
+
+
+def _ensure_private_dir(directory):
+    """Creates the socket's directory, refusing one that other local users can reach.
+
+    Frames are pickles, so anyone who can connect to the socket can run
+    code in every worker.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"Event bus directory {directory} must belong to this user and be private (chmod 700)")
+
+
+def create_event_bus(url=None):
+    """Builds the bus named by url: unset or local:// for one process, unix:///path to share a host."""
+    if not url or url.startswith('local://'):
+        return LocalEventBus()
+    parsed = urlparse(url)
+    if parsed.scheme == 'unix':
+        return UnixSocketEventBus(parsed.path)
+    raise ValueError(f"Unsupported event bus URL: {url}")
+
+
+class LocalEventBus:
+    """In-process stand-in used when a single worker serves every client."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._handlers = defaultdict(list)
+        self._seq = 0
+
+    def seed(self, seq):
+        with self._lock:
+            self._seq = max(self._seq, seq)
+
+    def subscribe(self, channel, handler):
+        """Registers handler(message, seq, is_origin) for a channel."""
+        self._handlers[channel].append(handler)
+
+    def publish(self, channel, message, sequenced=False):
+        """Delivers message to every subscriber and returns the first one's result.
+
+        Sequenced messages are stamped with the next bus-wide number and
+        delivered in that order.
+        """
+        with self._lock:
+            seq = None
+            if sequenced:
+                self._seq += 1
+                seq = self._seq
+            results = [handler(message, seq, True) for handler in self._handlers[channel]]
+        return results[0] if results else None
+
+    def socketio_manager(self):
+        # The default in-memory Socket.IO manager already covers one process
+        return None
+
+
+class UnixSocketEventBus:
+    """Event bus shared by every worker process on one host over a Unix socket.
+
+    Whichever process holds the lock file runs the relay. The relay stamps
+    sequenced messages and forwards every message to all workers in a single
+    order, publisher included, so every worker applies the same stream. If
+    that process exits, the next worker to reconnect takes the lock over.
+
+    The relay keeps the last replay_size sequenced frames, and so does every
+    worker, so a relay started by a worker inherits that worker's copy. A
+    worker that reconnects resumes after the last seq it applied and is sent
+    what it missed first. If the missed frames are no longer kept, the jump
+    in seq is logged and counted in missed.
+    """
+
+    def __init__(self, path, timeout=5.0, replay_size=10000):
+        self.path = path
+        self.timeout = timeout
+        self.replay_size = replay_size
+        self.missed = 0
+        self.node_id = uuid.uuid4().hex
+        self._handlers = defaultdict(list)
+        self._send_lock = threading.Lock()
+        self._waiters = {}
+        self._connected = threading.Event()
+        self._sock = None
+        self._seq = 0
+        self._history = deque(maxlen=replay_size)
+        self._lock_file = None
+        self._relay = None
+
+        _ensure_private_dir(os.path.dirname(os.path.abspath(path)))
+        self._connect(deadline=time.monotonic() + timeout)
+        threading.Thread(target=self._listen_loop, name='event-bus-listener', daemon=True).start()
+
+    def seed(self, seq):
+        self._seq = max(self._seq, seq)
+        self._send(('seed', seq))
+
+    def subscribe(self, channel, handler):
+        self._handlers[channel].append(handler)
+
+    def publish(self, channel, message, sequenced=False):
+        if not sequenced:
+            try:
+                self._send(('publish', channel, message, False, self.node_id, None))
+            except RuntimeError as e:
+                logger.warning(f"Dropping {channel} message: {e}")
+            return None
+        msg_id = uuid.uuid4().hex
+        waiter = self._waiters[msg_id] = [threading.Event(), None]
+        try:
+            self._send(('publish', channel, message, True, self.node_id, msg_id))
+            if not waiter[0].wait(self.timeout):
+                raise RuntimeError(f"Timed out waiting for {channel} message to be sequenced")
+            return waiter[1]
+        finally:
+            self._waiters.pop(msg_id, None)
+
+    def socketio_manager(self):
+        return BusClientManager(self)
+
+    def _send(self, frame):
+        if not self._connected.wait(self.timeout):
+            raise RuntimeError('Event bus is not connected')
+        data = _encode_frame(frame)
+        try:
+            with self._send_lock:
+                self._sock.sendall(data)
+        except OSError as e:
+            raise RuntimeError(f"Event bus send failed: {e}") from e
+
+    def _connect(self, deadline=None, resume=False):
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if not self._try_start_relay():
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise RuntimeError(f"Could not connect to event bus at {self.path}")
+                    time.sleep(0.05)
+                continue
+            self._sock = sock
+            with self._send_lock:
+                sock.sendall(_encode_frame(('resume' if resume else 'seed', self._seq)))
+            self._connected.set()
+            logger.info(f"Connected to event bus at {self.path}")
+            return
+
+    def _try_start_relay(self):
+        if self._relay is not None:
+            return True
+        lock_file = open(f"{self.path}.lock", 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        # Holding the lock means any existing socket file belongs to a dead relay
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen(128)
+        self._lock_file = lock_file
+        self._relay = _Relay(server, self._history, self.replay_size)
+        logger.info(f"Started event bus relay at {self.path} in process {os.getpid()}")
+        return True
+
+    def _listen_loop(self):
+        while True:
+            try:
+                data = _recv_raw_frame(self._sock)
+                frame = pickle.loads(data[_HEADER.size:])
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                self._connected.clear()
+                logger.warning(f"Event bus connection lost ({e}); reconnecting")
+                self._sock.close()
+                self._connect(resume=True)
+                continue
+            _, channel, message, seq, origin, msg_id = frame
+            if seq is not None:
+                if self._seq and seq > self._seq + 1:
+                    self.missed += seq - self._seq - 1
+                    logger.error(f"Event bus messages {self._seq + 1} to {seq - 1} were lost; "
+                                 f"this worker's state may be stale")
+                self._seq = max(self._seq, seq)
+                self._history.append((seq, data))
+            is_origin = origin == self.node_id
+            results = []
+            for handler in self._handlers[channel]:
+                try:
+                    results.append(handler(message, seq, is_origin))
+                except Exception as e:
+                    logger.error(f"Event bus handler for {channel} failed: {e}", exc_info=True)
+            waiter = self._waiters.get(msg_id) if is_origin and msg_id else None
+            if waiter is not None:
+                waiter[1] = results[0] if results else None
+                waiter[0].set()
+
+
+class _RelayClient:
+    """A worker's connection to the relay, written by its own thread.
+
+    The relay only queues frames here, so a worker that reads slowly delays
+    its own stream and not everyone else's. One that falls max_backlog
+    frames behind is disconnected.
+    """
+
+    def __init__(self, conn, max_backlog):
+        self.conn = conn
+        self._queue = queue.Queue(max_backlog)
+        threading.Thread(target=self._send_loop, name='event-bus-relay-writer', daemon=True).start()
+
+    def send(self, data):
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except queue.Full:
+            return False
+
+    def _send_loop(self):
+        try:
+            while True:
+                frames = [self._queue.get()]
+                # Everything already queued goes out in one write
+                while len(frames) < 256:
+                    try:
+                        frames.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in frames:
+                    frames = frames[:frames.index(None)]
+                    if frames:
+                        self.conn.sendall(b''.join(frames))
+                    return
+                self.conn.sendall(b''.join(frames))
+        except OSError:
+            pass
+        finally:
+            self.close()
+            self.conn.close()
+
+    def close(self):
+        # Wakes the relay's reader for this connection, which drops the client
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _Relay:
+    """Fans messages out to every connected worker, stamping sequenced ones.
+
+    The last replay_size sequenced frames are kept for workers that resume
+    after losing their connection.
+    """
+
+    def __init__(self, server, history=(), replay_size=10000, max_backlog=100000):
+        self._server = server
+        self.max_backlog = max_backlog
+        self._clients = []
+        self._lock = threading.Lock()
+        self._history = deque(history, maxlen=replay_size)
+        self._seq = self._history[-1][0] if self._history else 0
+        threading.Thread(target=self._accept_loop, name='event-bus-relay', daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            conn, _ = self._server.accept()
+            client = _RelayClient(conn, self.max_backlog)
+            threading.Thread(target=self._client_loop, args=(client,), name='event-bus-relay-client',
+                             daemon=True).start()
+
+    def _register(self, client, frame):
+        """Adds a worker once it has said where its stream starts; a resuming one is sent what it missed."""
+        kind, seq = frame
+        with self._lock:
+            self._seq = max(self._seq, seq)
+            if kind == 'resume':
+                # Queued before the client joins the broadcast, so nothing arrives out of order
+                for stamped, data in self._history:
+                    if stamped > seq:
+                        client.send(data)
+            self._clients.append(client)
+
+    def _client_loop(self, client):
+        try:
+            self._register(client, _recv_frame(client.conn))
+            while True:
+                frame = _recv_frame(client.conn)
+                if frame[0] == 'seed':
+                    with self._lock:
+                        self._seq = max(self._seq, frame[1])
+                    continue
+                _, channel, message, sequenced, origin, msg_id = frame
+                with self._lock:
+                    seq = None
+                    if sequenced:
+                        self._seq += 1
+                        seq = self._seq
+                    # Queued under the lock so every worker gets the frames in sequence order
+                    data = _encode_frame(('message', channel, message, seq, origin, msg_id))
+                    if seq is not None:
+                        self._history.append((seq, data))
+                    self._broadcast(data)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        finally:
+            with self._lock:
+                if client in self._clients:
+                    self._clients.remove(client)
+            client.send(None)
+            client.close()
+
+    def _broadcast(self, data):
+        for client in self._clients:
+            if not client.send(data):
+                logger.error(f"Event bus worker fell {self.max_backlog} messages behind; disconnecting it")
+                client.close()
+
+
+class BusClientManager(socketio.PubSubManager):
+    """Socket.IO client manager that shares emits and room changes over the event bus."""
+
+    name = 'alertnow-bus'
+
+    def __init__(self, bus, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus
+        self._inbox = queue.Queue()
+        bus.subscribe(channel, lambda message, seq, is_origin: self._inbox.put(message))
+
+    def _publish(self, data):
+        self.bus.publish(self.channel, data)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+
+def _benchmark_worker(path, messages, publishers, total, ready, start, results):
+    bus = UnixSocketEventBus(path)
+    done, received, lock = threading.Event(), [0], threading.Lock()
+
+    def handler(message, seq, is_origin):
+        with lock:
+            received[0] += 1
+            if received[0] == total:
+                done.set()
+
+    bus.subscribe('benchmark', handler)
+    ready.put(os.getpid())
+    start.wait()
+
+    def publish(count):
+        for i in range(count):
+            bus.publish('benchmark', {'i': i, 'payload': 'x' * 400}, sequenced=True)
+
+    threads = [threading.Thread(target=publish, args=(messages // publishers,)) for _ in range(publishers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(time.time() if done.wait(120) else None)
+
+
+def benchmark(workers=4, messages=4000, publishers=8, stalled=0):
+    """Sequenced messages per second across worker processes sharing one relay.
+
+    Each worker publishes messages from publishers threads and waits until
+    it has applied every worker's messages. stalled extra connections
+    never read, like a worker stuck in a long request; they must not hold
+    the others up.
+    """
+    import multiprocessing
+    import tempfile
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bus', 'bus.sock')
+        ready, results, start = context.Queue(), context.Queue(), context.Event()
+        total = workers * (messages // publishers) * publishers
+        processes = [context.Process(target=_benchmark_worker,
+                                     args=(path, messages, publishers, total, ready, start, results))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.get(timeout=60)
+        idle = []
+        for _ in range(stalled):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+            sock.sendall(_encode_frame(('seed', 0)))
+            idle.append(sock)
+        started = time.time()
+        start.set()
+        finished = [results.get(timeout=180) for _ in processes]
+        for process in processes:
+            process.join()
+        for sock in idle:
+            sock.close()
+    if None in finished:
+        return {'workers': workers, 'stalled': stalled, 'messages': total, 'completed': False}
+    elapsed = max(finished) - started
+    # Every worker applies every message, so deliveries grow with the worker count
+    return {'workers': workers, 'stalled': stalled, 'messages': total, 'completed': True,
+            'seconds': round(elapsed, 2), 'messages_per_s': round(total / elapsed),
+            'deliveries_per_s': round(total * workers / elapsed)}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the Unix socket event bus across worker processes.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--messages', type=int, default=4000, help='messages published by each worker')
+    parser.add_argument('--publishers', type=int, default=8, help='publishing threads per worker')
+    parser.add_argument('--stalled', type=int, default=0, help='extra connections that never read')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for workers in args.workers:
+        logger.info(benchmark(workers, args.messages, args.publishers, args.stalled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+import logging
+import math
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from alert_rollups import MANILA_OFFSET
+from alert_store import _to_epoch
+from dataset_cache import MISSING_WHEN
+from spatial_index import parse_point
+
+logger = logging.getLogger(__name__)
+
+LAYERS = ('fire', 'road', 'other')
+SOURCES = ('history', 'live')
+SEVERITIES = ('low', 'medium', 'high', 'unreported')
+# Live alerts carry no severity; their emergency type picks the layer
+ALERT_LAYERS = {'fire': 'fire', 'road_accident': 'road'}
+DEFAULT_CELL_DEG = 0.005  # ~550 m
+# Padding around the barangays in coords.txt; incidents beyond it are not binned
+DEFAULT_MARGIN_DEG = 0.02
+
+
+def _severity_codes(name, data):
+    """SEVERITIES index per row of a dataset; road accidents are graded by their casualties."""
+    if name == 'fire':
+        labels = [SEVERITIES.index(label.lower()) if label.lower() in SEVERITIES else SEVERITIES.index('unreported')
+                  for label in data.dictionaries['Fire_Severity']]
+        return np.asarray(labels + [SEVERITIES.index('unreported')])[data['Fire_Severity']]
+    return np.select([data['Fatalities'] > 0, data['Injuries'] > 0],
+                     [SEVERITIES.index('high'), SEVERITIES.index('medium')], SEVERITIES.index('low'))
+
+
+class HeatmapGrid:
+    """Incident counts on a fixed lat/lon grid per layer, source, severity and hour of day.
+
+    The historical layers are histogrammed from the dataset columns with
+    one bincount per dataset, kept as their non-empty bins, and rebuilt
+    only when a CSV changes. Live alerts are counted one bin at a time as
+    they arrive on the bus, so every worker keeps the same counts. tiles()
+    sums the requested slices into a sparse list of non-empty cells, which
+    is all the map needs to draw density; sums are cached until the counts
+    change.
+    """
+
+    def __init__(self, store, bus, datasets, barangay_coords, cell_deg=DEFAULT_CELL_DEG,
+                 margin_deg=DEFAULT_MARGIN_DEG, max_entries=128):
+        self.store = store
+        self.datasets = datasets
+        self.cell_deg = cell_deg
+        self.max_entries = max_entries
+        points = [(point['lat'], point['lon']) for barangays in barangay_coords.values() for point in barangays.values()]
+        lats, lons = [lat for lat, _ in points] or [0.0], [lon for _, lon in points] or [0.0]
+        self.origin = (math.floor((min(lats) - margin_deg) / cell_deg) * cell_deg,
+                       math.floor((min(lons) - margin_deg) / cell_deg) * cell_deg)
+        self.shape = (int(math.ceil((max(lats) + margin_deg - self.origin[0]) / cell_deg)),
+                      int(math.ceil((max(lons) + margin_deg - self.origin[1]) / cell_deg)))
+        self._lock = threading.Lock()
+        # name -> (severity, hour, cell, count) arrays of the non-empty historical bins
+        self._history = {}
+        self._history_versions = {}
+        # (layer index, hour, cell) -> live alert count
+        self._live = Counter()
+        self._results = OrderedDict()
+        self.outside = 0
+
+        # Inserts sequenced after the floor come from the bus, everything up to it from SQLite
+        with self._lock:
+            bus.subscribe('alerts', self._apply)
+            self._floor = self._live_seq = store.last_seq
+        self._load_live()
+
+    def cells(self, lat, lon):
+        """(flat cell index, inside) arrays for points; the index is only meaningful where inside."""
+        row = np.floor((np.asarray(lat, dtype=np.float64) - self.origin[0]) / self.cell_deg)
+        col = np.floor((np.asarray(lon, dtype=np.float64) - self.origin[1]) / self.cell_deg)
+        inside = (row >= 0) & (row < self.shape[0]) & (col >= 0) & (col < self.shape[1])
+        return np.where(inside, row * self.shape[1] + col, 0).astype(np.int64), inside
+
+    def _histogram(self, severity, hour, lat, lon):
+        """Non-empty (severity, hour, cell, count) bins of points, by one bincount; also the count outside."""
+        cell, inside = self.cells(lat, lon)
+        cells = self.shape[0] * self.shape[1]
+        flat = (severity[inside] * 24 + hour[inside]) * cells + cell[inside]
+        counts = np.bincount(flat, minlength=len(SEVERITIES) * 24 * cells)
+        bins = np.flatnonzero(counts)
+        slices, cell = np.divmod(bins, cells)
+        severity, hour = np.divmod(slices, 24)
+        return (severity, hour, cell, counts[bins]), int((~inside).sum())
+
+    def _refresh_history(self):
+        """Rebins the historical layers whose dataset changed."""
+        for name in ('fire', 'road'):
+            data = self.datasets.load(name)
+            version = data.version if data is not None else None
+            if name in self._history_versions and self._history_versions[name] == version:
+                continue
+            bins = tuple(np.empty(0, dtype=np.int64) for _ in range(4))
+            if data is not None:
+                when = np.asarray(data['when'])
+                lat, lon = np.asarray(data['Latitude']), np.asarray(data['Longitude'])
+                # Rows without a time of day can't be placed in an hour bin
+                located = (when != MISSING_WHEN) & np.isfinite(lat) & np.isfinite(lon)
+                bins, outside = self._histogram(_severity_codes(name, data)[located], (when[located] // 3600) % 24,
+                                                lat[located], lon[located])
+                logger.info(f"Binned {int(located.sum()) - outside} {name} incidents into the heatmap "
+                            f"({outside} outside the grid)")
+            with self._lock:
+                self._history[name] = bins
+                self._history_versions[name] = version
+                self._results.clear()
+
+    def _load_live(self):
+        points = []
+        for lat, lon, epoch, emergency_type in self.store.locations(until_seq=self._floor):
+            point = parse_point(lat, lon)
+            if point is not None and epoch is not None:
+                points.append((point, epoch, LAYERS.index(ALERT_LAYERS.get(emergency_type, 'other'))))
+        if not points:
+            return
+        lat = np.array([point[0] for point, _, _ in points])
+        lon = np.array([point[1] for point, _, _ in points])
+        hour = (np.array([epoch for _, epoch, _ in points], dtype=np.int64) + MANILA_OFFSET) // 3600 % 24
+        layer = np.array([layer for *_, layer in points])
+        # The layer takes the severity axis's place; live alerts have no severity
+        (layer, hour, cell, counts), outside = self._histogram(layer, hour, lat, lon)
+        with self._lock:
+            self._live.update(dict(zip(zip(layer.tolist(), hour.tolist(), cell.tolist()), counts.tolist())))
+            self.outside += outside
+            self._results.clear()
+        logger.info(f"Binned {len(points) - outside} stored alerts into the heatmap")
+
+    def _apply(self, message, seq, is_origin):
+        if message['op'] != 'insert':
+            return None
+        with self._lock:
+            if seq <= self._floor:
+                return None
+            self._live_seq = max(self._live_seq, seq)
+            self._add_alert(message['alert'])
+        return None
+
+    def _add_alert(self, alert):
+        """Counts one live alert in its bin; caller holds the lock."""
+        point = parse_point(alert.get('lat'), alert.get('lon'))
+        try:
+            epoch = _to_epoch(alert.get('timestamp'))
+        except ValueError:
+            epoch = None
+        if point is None or epoch is None:
+            return
+        cell, inside = self.cells(*point)
+        if not inside:
+            self.outside += 1
+            return
+        hour = int((epoch + MANILA_OFFSET) // 3600 % 24)
+        layer = LAYERS.index(ALERT_LAYERS.get(alert.get('emergency_type'), 'other'))
+        self._live[(layer, hour, int(cell))] += 1
+        self._results.clear()
+
+    @property
+    def version(self):
+        """Changes whenever any count does; usable as an ETag."""
+        self._refresh_history()
+        with self._lock:
+            history = '.'.join((self._history_versions.get(name) or '-')[:8] for name in ('fire', 'road'))
+            return f"{history}.{self._live_seq}"
+
+    def tiles(self, layers=LAYERS, sources=SOURCES, severities=SEVERITIES, hours=range(24), bbox=None):
+        """Non-empty cells of the summed slices: {'origin', 'cell_deg', 'shape', 'rows', 'cols', 'counts', 'max'}.
+
+        bbox is (south, west, north, east) in degrees and limits the cells
+        returned to the map's viewport.
+        """
+        for value, allowed, what in ((layers, LAYERS, 'layer'), (sources, SOURCES, 'source'),
+                                     (severities, SEVERITIES, 'severity')):
+            unknown = [item for item in value if item not in allowed]
+            if unknown:
+                raise ValueError(f"Unknown heatmap {what} {unknown[0]!r}; expected one of {list(allowed)}")
+        hours = sorted(set(hours))
+        if not hours or not all(isinstance(hour, int) and 0 <= hour <= 23 for hour in hours):
+            raise ValueError('Hours must be integers from 0 to 23')
+        self._refresh_history()
+        key = (tuple(sorted(set(layers))), tuple(sorted(set(sources))), tuple(sorted(set(severities))), tuple(hours))
+        with self._lock:
+            summed = self._results.get(key)
+            if summed is None:
+                summed = self._results[key] = self._sum(*key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+            else:
+                self._results.move_to_end(key)
+
+        rows, cols, counts = summed
+        if bbox is not None:
+            south, west, north, east = bbox
+            keep = ((rows >= math.floor((south - self.origin[0]) / self.cell_deg))
+                    & (rows <= math.floor((north - self.origin[0]) / self.cell_deg))
+                    & (cols >= math.floor((west - self.origin[1]) / self.cell_deg))
+                    & (cols <= math.floor((east - self.origin[1]) / self.cell_deg)))
+            rows, cols, counts = rows[keep], cols[keep], counts[keep]
+        return {'origin': [round(self.origin[0], 6), round(self.origin[1], 6)], 'cell_deg': self.cell_deg,
+                'shape': list(self.shape), 'rows': rows.tolist(), 'cols': cols.tolist(),
+                'counts': counts.tolist(), 'max': int(counts.max()) if counts.size else 0}
+
+    def _sum(self, layers, sources, severities, hours):
+        """(rows, cols, counts) of the non-empty cells over the chosen slices; caller holds the lock."""
+        cells, weights = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        if 'history' in sources:
+            wanted = [SEVERITIES.index(severity) for severity in severities]
+            for name in layers:
+                if name not in self._history:
+                    continue
+                severity, hour, cell, count = self._history[name]
+                keep = np.isin(severity, wanted) & np.isin(hour, hours)
+                cells.append(cell[keep])
+                weights.append(count[keep])
+        if 'live' in sources and 'unreported' in severities and self._live:
+            wanted, hours = {LAYERS.index(layer) for layer in layers}, set(hours)
+            live = [(cell, count) for (layer, hour, cell), count in self._live.items()
+                    if layer in wanted and hour in hours]
+            cells.append(np.array([cell for cell, _ in live], dtype=np.int64))
+            weights.append(np.array([count for _, count in live], dtype=np.int64))
+        cells, weights = np.concatenate(cells), np.concatenate(weights)
+        # Sort-and-reduce keeps the cost proportional to the non-empty bins, not the grid
+        unique, inverse = np.unique(cells, return_inverse=True)
+        counts = np.bincount(inverse, weights=weights, minlength=len(unique)).astype(np.int64)
+        rows, cols = np.divmod(unique, self.shape[1])
+        return rows, cols, counts
+
+    def stats(self):
+        self._refresh_history()
+        with self._lock:
+            incidents = {layer: {'history': int(self._history[layer][3].sum()) if layer in self._history else 0,
+                                 'live': sum(count for (index, _, _), count in self._live.items()
+                                             if index == LAYERS.index(layer))}
+                         for layer in LAYERS}
+            return {'shape': list(self.shape), 'cell_deg': self.cell_deg, 'cached_sums': len(self._results),
+                    'live_bins': len(self._live), 'outside_grid_alerts': self.outside, 'incidents': incidents}
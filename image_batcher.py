@@ -0,0 +1,486 @@
+import argparse
+import base64
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SIZE = (64, 64)
+DEFAULT_DECODE_WORKERS = int(os.getenv('IMAGE_DECODE_WORKERS', '2'))
+# Payloads up to this size decode in well under a millisecond, less than a round trip to the pool
+DEFAULT_INLINE_DECODE_BYTES = int(os.getenv('IMAGE_INLINE_DECODE_BYTES', '32768'))
+# Decode workers start from a fresh interpreter rather than a fork of a process that already runs
+# the writer, bus and gevent threads, whose locks a forked child could inherit mid-acquire
+DECODE_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+if DECODE_CONTEXT.get_start_method() == 'forkserver':
+    # Workers fork from a server that has already imported what decoding needs
+    DECODE_CONTEXT.set_forkserver_preload(['image_batcher', 'cv2'])
+
+
+class ImageDecodeError(ValueError):
+    pass
+
+
+class ImageQueueFull(RuntimeError):
+    pass
+
+
+def jpeg_size(data):
+    """Returns (width, height) from a JPEG frame header without decoding, or None."""
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return int.from_bytes(data[i + 7:i + 9], 'big'), int.from_bytes(data[i + 5:i + 7], 'big')
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+
+def _decode_flag(data):
+    import cv2
+
+    # libjpeg can scale by 1/2, 1/4 or 1/8 while decoding; take the smallest that still covers IMAGE_SIZE
+    size = jpeg_size(data)
+    if size is not None:
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                             (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)):
+            if size[0] // factor >= IMAGE_SIZE[0] and size[1] // factor >= IMAGE_SIZE[1]:
+                return flag
+    return cv2.IMREAD_GRAYSCALE
+
+
+def decode_features(data):
+    """Decodes image bytes (or base64 text) into the classifier's flattened 64x64 grayscale row."""
+    import cv2
+
+    if isinstance(data, str):
+        if ',' in data[:64]:
+            data = data.split(',', 1)[1]
+        try:
+            data = base64.b64decode(data)
+        except ValueError as e:
+            raise ImageDecodeError(f'Invalid base64 image: {e}') from e
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), _decode_flag(data))
+    if img is None:
+        raise ImageDecodeError('Failed to decode image')
+    return cv2.resize(img, IMAGE_SIZE).reshape(-1)
+
+
+def perceptual_hash(features):
+    """64-bit median hash of a 64x64 feature row: 8x8 block means against their median.
+
+    Re-sent, re-encoded or resized copies of a photo usually land on the same key.
+    """
+    blocks = features.reshape(8, 8, 8, 8).mean(axis=(1, 3))
+    return np.packbits(blocks > np.median(blocks)).tobytes()
+
+
+class PredictionCache:
+    """LRU of predicted labels keyed by perceptual hash, with a TTL.
+
+    Entries belong to one model version; a different version empties the
+    cache before it is used.
+    """
+
+    def __init__(self, max_entries=4096, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (label, expires)
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """Returns the cached label, or None on a miss."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, label):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (label, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else None, 'model_version': self.version}
+
+
+def _init_decode_worker():
+    # Decoding is background work; the worker's event loop should win any contention for the CPU
+    os.nice(10)
+
+
+@contextmanager
+def _main_script_hidden():
+    """Keeps processes started inside from re-running the main script.
+
+    A forkserver or spawn child re-executes the parent's __main__ file so
+    pickled __main__ objects resolve. Under `python AlertNow.py` that is
+    the whole app: its store, bus connection and models. Decode jobs only
+    reference this module, so children are started while __main__ is a
+    blank module, which multiprocessing leaves alone.
+    """
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+class ImageBatcher:
+    """Micro-batches image classification requests.
+
+    Base64 decoding, JPEG decoding and resizing of payloads larger than
+    inline_decode_bytes run in a small process pool, started on first use,
+    so CPU-heavy photos never hold the worker's event loop; smaller ones
+    are decoded by the caller. At most max_pending images are in flight;
+    beyond that submit() waits up to queue_timeout and then raises
+    ImageQueueFull. Decoded feature rows are
+    stacked by a single batching thread, up to max_batch rows or max_wait
+    seconds after the first one, and run through one predict() call. A
+    row that arrives with nothing queued, batching or decoding is predicted
+    at once, as waiting could only add latency. Each
+    caller gets a future for its own label. With a cache, a row whose
+    perceptual hash was already classified by the current model version
+    skips the classifier.
+    """
+
+    def __init__(self, get_model, max_batch=32, max_wait=0.005, decode_workers=DEFAULT_DECODE_WORKERS,
+                 max_pending=64, queue_timeout=1.0, cache=None, model_version=None,
+                 inline_decode_bytes=DEFAULT_INLINE_DECODE_BYTES):
+        self.get_model = get_model
+        self.cache = cache
+        self.model_version = model_version or (lambda: None)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.decode_workers = decode_workers
+        self.inline_decode_bytes = inline_decode_bytes
+        self._decode_pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._decoding = 0
+        self._decode_backlog = deque()
+        self._batching = False
+        self.peak_pending = 0
+        self.rejected = 0
+        self.batches = 0
+        self.predicted = 0
+        threading.Thread(target=self._run, name='image-batcher', daemon=True).start()
+
+    def submit(self, data):
+        """Returns a future resolving to the predicted label for one image."""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise ImageQueueFull(f"{self.max_pending} images already queued for classification")
+        with self._lock:
+            self._pending += 1
+            self.peak_pending = max(self.peak_pending, self._pending)
+        result = Future()
+        result.add_done_callback(self._release)
+        if len(data) <= self.inline_decode_bytes:
+            try:
+                features = decode_features(data)
+            except Exception as e:
+                result.set_exception(e)
+                return result
+            self._classify(features, result)
+            return result
+        with self._lock:
+            if self._decoding >= self.decode_workers:
+                self._decode_backlog.append((data, result))
+                return result
+            self._decoding += 1
+        self._start_decodes((data, result))
+        return result
+
+    def _start_decodes(self, item):
+        # Only as many images as there are workers are handed to the pool at once. A payload queued
+        # behind busy workers would block the pool's feeder thread on a full pipe, and under gevent
+        # that thread is a greenlet sharing the event loop.
+        while item is not None:
+            data, result = item
+            try:
+                pool = self._pool()
+                try:
+                    decoded = pool.submit(decode_features, data)
+                except BrokenProcessPool:
+                    logger.warning("Image decode pool died; starting a new one")
+                    decoded = self._pool(broken=pool).submit(decode_features, data)
+            except Exception as e:
+                result.set_exception(e)
+                item = self._next_decode()
+                continue
+            decoded.add_done_callback(partial(self._decoded, result))
+            return
+
+    def _next_decode(self):
+        """Hands a finished decode's slot to the oldest waiting image, or frees it."""
+        with self._lock:
+            if self._decode_backlog:
+                return self._decode_backlog.popleft()
+            self._decoding -= 1
+            return None
+
+    def _decoded(self, result, decoded):
+        self._start_decodes(self._next_decode())
+        self._enqueue(decoded, result)
+
+    def stats(self):
+        """Queue depth and throughput counters."""
+        with self._lock:
+            pending = self._pending
+            awaiting_decode = len(self._decode_backlog)
+        stats = {'pending': pending, 'awaiting_decode': awaiting_decode, 'awaiting_batch': self._queue.qsize(),
+                 'decoding': pending - awaiting_decode - self._queue.qsize(), 'max_pending': self.max_pending,
+                 'peak_pending': self.peak_pending, 'rejected': self.rejected, 'batches': self.batches,
+                 'predicted': self.predicted}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+    def _pool(self, broken=None):
+        """The decode pool, started on first use and replaced if it is the broken one."""
+        with self._pool_lock:
+            if self._decode_pool is None or self._decode_pool is broken:
+                pool = ProcessPoolExecutor(max_workers=self.decode_workers, mp_context=DECODE_CONTEXT,
+                                           initializer=_init_decode_worker)
+                # The pool starts a worker per submit until it has max_workers, so start them all now
+                with _main_script_hidden():
+                    for _ in range(self.decode_workers):
+                        pool.submit(int)
+                self._decode_pool = pool
+            return self._decode_pool
+
+    def _release(self, _):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def predict(self, data, timeout=10.0):
+        if len(data) <= self.inline_decode_bytes and self._idle():
+            # Nothing to batch with, so classify here without a future, as an unbatched call would
+            features = decode_features(data)
+            key, label = self._cached(features)
+            if label is None:
+                version, (label,) = self._labels(features[None])
+                if key is not None:
+                    self.cache.put(key, version, label)
+            return label
+        return self.submit(data).result(timeout)
+
+    def predict_many(self, images, timeout=10.0):
+        """Returns one label or exception per image, in order."""
+        futures = []
+        for data in images:
+            try:
+                futures.append(self.submit(data))
+            except ImageQueueFull as e:
+                futures.append(e)
+        results = []
+        for future in futures:
+            if isinstance(future, Exception):
+                results.append(future)
+                continue
+            try:
+                results.append(future.result(timeout))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _enqueue(self, decoded, result):
+        error = decoded.exception()
+        if error is not None:
+            result.set_exception(error)
+            return
+        self._classify(decoded.result(), result)
+
+    def _cached(self, features):
+        """Returns (cache key, cached label or None)."""
+        if self.cache is None:
+            return None, None
+        key = perceptual_hash(features)
+        return key, self.cache.get(key, self.model_version())
+
+    def _classify(self, features, result):
+        key, label = self._cached(features)
+        if label is not None:
+            result.set_result(label)
+            return
+        if self._idle():
+            # No other row could join a batch, so skip the hand-off to the batching thread
+            self._predict([(features, key, result)])
+            return
+        self._queue.put((features, key, result))
+
+    def _idle(self):
+        return not self._batching and self._decoding == 0 and self._queue.empty()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            self._batching = True
+            batch = [item]
+            if self._decoding or not self._queue.empty():
+                deadline = time.monotonic() + self.max_wait
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+            self._predict(batch)
+            self._batching = False
+
+    def _labels(self, rows):
+        """Runs stacked feature rows through the model; returns (model version, labels)."""
+        model = self.get_model()
+        if model is None:
+            raise RuntimeError('Model not loaded')
+        version = self.model_version()
+        labels = model.predict(rows).tolist()
+        with self._lock:
+            self.batches += 1
+            self.predicted += len(labels)
+        return version, labels
+
+    def _predict(self, batch):
+        try:
+            version, labels = self._labels(np.stack([features for features, _, _ in batch]))
+        except Exception as e:
+            logger.error(f"Batch prediction of {len(batch)} images failed: {e}", exc_info=True)
+            for _, _, result in batch:
+                result.set_exception(e)
+            return
+        for (_, key, result), label in zip(batch, labels):
+            if key is not None:
+                self.cache.put(key, version, label)
+            result.set_result(label)
+
+
+def benchmark(clients=64, requests=40, batch_sizes=(1, 2, 4, 8, 16, 32, 64), size=IMAGE_SIZE, seed=0, rounds=5):
+    """Throughput and latency of 64-thread prediction traffic, per request versus micro-batched.
+
+    The unbatched baseline decodes and predicts one row on each client
+    thread, as predict_image did before batching. It alternates for rounds
+    rounds with an ImageBatcher on its defaults, and each reports its
+    median round; default_vs_unbatched is the median ratio of their
+    throughputs. Each max_batch setting then runs once. Photos larger than
+    IMAGE_INLINE_DECODE_BYTES (see --size) take the decode pool.
+    """
+    import cv2
+    from model_registry import ModelRegistry
+
+    model = ModelRegistry().get('decision_tree')
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(clients):
+        pixels = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+        images.append(base64.b64encode(cv2.imencode('.jpg', pixels)[1].tobytes()).decode())
+
+    def run(predict):
+        latencies = []
+
+        def client(image):
+            for _ in range(requests):
+                started = time.perf_counter()
+                predict(image)
+                latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=client, args=(image,)) for image in images]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        latencies = np.array(latencies) * 1000
+        return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+    def describe(run):
+        return f"{round(run[0])}/s p50 {run[1]:.1f} ms p99 {run[2]:.1f} ms"
+
+    def median_run(runs):
+        return sorted(runs)[len(runs) // 2]
+
+    batcher = ImageBatcher(lambda: model, max_pending=clients)
+    batcher.predict(images[0])
+    unbatched, default = [], []
+    # Alternating rounds spread the machine's noise over both paths alike
+    for _ in range(rounds):
+        unbatched.append(run(lambda image: model.predict(decode_features(image)[None])))
+        default.append(run(batcher.predict))
+    ratios = sorted(d[0] / u[0] for u, d in zip(unbatched, default))
+    results = {'clients': clients, 'requests': clients * requests, 'unbatched': describe(median_run(unbatched)),
+               'default': describe(median_run(default)), 'default_vs_unbatched': round(ratios[len(ratios) // 2], 3)}
+    for max_batch in batch_sizes:
+        batcher = ImageBatcher(lambda: model, max_batch=max_batch, max_pending=clients)
+        batcher.predict(images[0])
+        results[f"max_batch={max_batch}"] = describe(run(batcher.predict))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark micro-batched image classification.')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--size', type=int, nargs=2, default=IMAGE_SIZE, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--rounds', type=int, default=5, help='alternating unbatched/default rounds')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for key, value in benchmark(args.clients, args.requests, size=tuple(args.size), rounds=args.rounds).items():
+        logger.info(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from image_batcher import IMAGE_SIZE, ImageDecodeError, decode_features
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(__file__)
+# Label -> folder of example images
+IMAGE_FOLDERS = {'accident': os.path.join(ROOT, 'Road_Accident')}
+DEFAULT_CACHE_DIR = os.path.join(ROOT, 'training', '.cache', 'images')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+FORMAT_VERSION = 1
+
+
+def _decode_file(path, known=frozenset()):
+    """(sha256, feature row or None) for one image; runs in the pool. Known hashes aren't decoded again."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if digest in known:
+        return digest, None
+    try:
+        return digest, decode_features(data)
+    except ImageDecodeError:
+        return digest, None
+
+
+class FeatureCache:
+    """Decoded 64x64 grayscale rows of one image folder, as a memory-mapped .npy.
+
+    manifest.json records each file's size, mtime and sha256 and its row in
+    features.npy. A rebuild decodes only files that are new or whose content
+    changed: an unchanged size and mtime is trusted as is, and a touched file
+    whose hash still matches keeps its row. Removed files drop out.
+    Decoding uses the same decode_features as the prediction endpoints, so
+    training sees exactly what serving sees.
+    """
+
+    def __init__(self, folder, cache_dir):
+        self.folder = folder
+        self.cache_dir = cache_dir
+        self.features_path = os.path.join(cache_dir, 'features.npy')
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+
+    def _manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('format') != FORMAT_VERSION or manifest.get('image_size') != list(IMAGE_SIZE) \
+                or not os.path.exists(self.features_path):
+            return {}
+        return manifest['files']
+
+    def build(self, workers=None):
+        """Brings the cache up to date; returns counts of reused, decoded and failed files."""
+        started = time.perf_counter()
+        names = sorted(name for name in os.listdir(self.folder) if name.lower().endswith(IMAGE_EXTENSIONS))
+        previous = self._manifest()
+        stats = {name: os.stat(os.path.join(self.folder, name)) for name in names}
+        unchanged = [name for name in names if name in previous
+                     and previous[name]['size'] == stats[name].st_size
+                     and previous[name]['mtime_ns'] == stats[name].st_mtime_ns]
+        pending = [name for name in names if name not in set(unchanged)]
+        if not pending and len(unchanged) == len(previous):
+            failed = sum(entry['row'] is None for entry in previous.values())
+            return {'files': len(names), 'reused': len(names) - failed, 'decoded': 0, 'failed': failed,
+                    'seconds': round(time.perf_counter() - started, 3)}
+
+        old = np.load(self.features_path, mmap_mode='r') if previous else None
+        by_hash = {entry['sha256']: entry['row'] for entry in previous.values() if entry['row'] is not None}
+        decoded = {}
+        if pending:
+            paths = [os.path.join(self.folder, name) for name in pending]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(partial(_decode_file, known=frozenset(by_hash)), paths, chunksize=8)
+                decoded = dict(zip(pending, results))
+
+        rows, files, reused, failed = [], {}, 0, 0
+        for name in names:
+            stat = stats[name]
+            if name in decoded:
+                digest, features = decoded[name]
+                if digest in by_hash:
+                    # Touched or renamed but not changed: keep the row already decoded
+                    features, reused = old[by_hash[digest]], reused + 1
+            else:
+                digest, row = previous[name]['sha256'], previous[name]['row']
+                features = None if row is None else old[row]
+                reused += row is not None
+            if features is None:
+                logger.warning(f"Could not decode {name}; leaving it out")
+                failed += 1
+            files[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest,
+                           'row': None if features is None else len(rows)}
+            if features is not None:
+                rows.append(features)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f"{self.features_path}.tmp-{os.getpid()}.npy"
+        matrix = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint8,
+                                           shape=(len(rows), IMAGE_SIZE[0] * IMAGE_SIZE[1]))
+        if rows:
+            matrix[:] = np.stack(rows)
+        matrix.flush()
+        del matrix, old
+        os.replace(tmp, self.features_path)
+        with open(self.manifest_path, 'w') as f:
+            json.dump({'format': FORMAT_VERSION, 'image_size': list(IMAGE_SIZE), 'files': files}, f, indent=1)
+        result = {'files': len(names), 'reused': reused, 'decoded': len(names) - reused - failed, 'failed': failed,
+                  'seconds': round(time.perf_counter() - started, 3)}
+        logger.info(f"Image features for {self.folder}: {result}")
+        return result
+
+    def load(self):
+        """(features memmap, file names in row order)."""
+        rows = {entry['row']: name for name, entry in self._manifest().items() if entry['row'] is not None}
+        names = [rows[row] for row in sorted(rows)]
+        return np.load(self.features_path, mmap_mode='r'), names
+
+
+def load_image_dataset(folders=None, cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """Builds every folder's cache and returns (X, y) for training the image classifier."""
+    folders = IMAGE_FOLDERS if folders is None else folders
+    X, y = [], []
+    for label, folder in folders.items():
+        cache = FeatureCache(folder, os.path.join(cache_dir, label))
+        cache.build(workers)
+        features, _ = cache.load()
+        X.append(features)
+        y.extend([label] * len(features))
+    # A single folder is handed over still memory-mapped
+    return (X[0] if len(X) == 1 else np.concatenate(X)), np.array(y)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the cached feature matrix of the image corpus.')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=None, help='decode processes (default: one per core)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    X, y = load_image_dataset(cache_dir=args.cache_dir, workers=args.workers)
+    logger.info(f"{X.shape[0]} images x {X.shape[1]} features, labels {sorted(set(y.tolist()))}")
+
+
+if __name__ == '__main__':
+    main()
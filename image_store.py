@@ -0,0 +1,94 @@
+import base64
+import hashlib
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_DIR = os.path.join(os.path.dirname(__file__), 'data', 'images')
+IMAGE_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def guess_mimetype(head):
+    if head.startswith(b'\x89PNG'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+class ImageStore:
+    """Content-addressed image files on local disk, keyed by SHA-256.
+
+    Identical uploads share one file. Thumbnails are encoded with OpenCV on a
+    small worker pool so the request thread only hashes and writes bytes.
+    """
+
+    def __init__(self, root=DEFAULT_IMAGE_DIR, thumbnail_width=160, thumbnail_quality=60, workers=2):
+        self.root = root
+        self.thumbnail_width = thumbnail_width
+        self.thumbnail_quality = thumbnail_quality
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, image_id, thumbnail=False):
+        if not IMAGE_ID_RE.match(image_id or ''):
+            raise ValueError(f"Invalid image id: {image_id!r}")
+        name = f"{image_id}.thumb.jpg" if thumbnail else image_id
+        return os.path.join(self.root, image_id[:2], name)
+
+    def put(self, base64_image):
+        """Stores a base64 image and returns its content id."""
+        if ',' in base64_image[:64]:
+            base64_image = base64_image.split(',', 1)[1]
+        data = base64.b64decode(base64_image)
+        image_id = hashlib.sha256(data).hexdigest()
+        path = self.path(image_id)
+        if not os.path.exists(path):
+            self._write(path, data)
+        return image_id
+
+    def read_thumbnail(self, image_id):
+        path = self.path(image_id, thumbnail=True)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('ascii')
+
+    def submit_thumbnail(self, image_id):
+        """Returns a future resolving to the base64 thumbnail (or None)."""
+        return self._pool.submit(self._make_thumbnail, image_id)
+
+    def _make_thumbnail(self, image_id):
+        import cv2
+
+        existing = self.read_thumbnail(image_id)
+        if existing is not None:
+            return existing
+        img = cv2.imread(self.path(image_id), cv2.IMREAD_REDUCED_COLOR_2)
+        if img is None:
+            logger.error(f"Could not decode image {image_id} for thumbnail")
+            return None
+        height, width = img.shape[:2]
+        if width > self.thumbnail_width:
+            size = (self.thumbnail_width, max(1, round(height * self.thumbnail_width / width)))
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.thumbnail_quality])
+        if not ok:
+            logger.error(f"Could not encode thumbnail for {image_id}")
+            return None
+        data = np.asarray(encoded).tobytes()
+        self._write(self.path(image_id, thumbnail=True), data)
+        return base64.b64encode(data).decode('ascii')
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
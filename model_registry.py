@@ -0,0 +1,237 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import compact_models
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(__file__), 'training')
+DEFAULT_MEMORY_BUDGET = int(os.getenv('MODEL_MEMORY_BUDGET_MB', '256')) * 1024 * 1024
+MODEL_PATHS = {
+    'decision_tree': 'decision_tree_model.pkl',
+    'lr_fire': os.path.join('Fire Models', 'lr_fire_incident.pkl'),
+    'rf_fire': os.path.join('Fire Models', 'rf_fire_incident.pkl'),
+    'svm_fire': os.path.join('Fire Models', 'svm_fire_incident.pkl'),
+    'xgb_fire': os.path.join('Fire Models', 'xgb_fire_incident.pkl'),
+    'lr_road': os.path.join('Road Models', 'lr_road_accident.pkl'),
+    'rf_road': os.path.join('Road Models', 'rf_road_accident.pkl'),
+    'svm_road': os.path.join('Road Models', 'svm_road_accident.pkl'),
+    'xgb_road': os.path.join('Road Models', 'xgb_road_accident.pkl'),
+}
+
+
+class ModelRegistry:
+    """Loads pickled models on first use and keeps the recent ones resident.
+
+    Each model loads on its own, so a missing or broken pickle only leaves
+    that model unavailable. Loaded models sit in an LRU bounded by
+    memory_budget bytes, using the pickle size as the estimate of what a
+    model holds in memory. A failed load is retried once the file changes.
+
+    When compact_root holds an artifact exported from the very pickle on
+    disk (see compact_models), that is loaded instead: memory-mapped NumPy
+    arrays, no sklearn or xgboost import, and pages shared between workers.
+    """
+
+    def __init__(self, root=DEFAULT_MODEL_DIR, paths=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 compact_root=compact_models.DEFAULT_COMPACT_DIR):
+        self.root = root
+        self.compact_root = compact_root
+        self.paths = dict(MODEL_PATHS if paths is None else paths)
+        self.memory_budget = memory_budget
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self.paths}
+        self._models = OrderedDict()  # name -> (model, size)
+        self._failures = {}  # name -> (mtime, error)
+        self._versions = {}  # name -> version of the pickle last loaded
+        self._stats = {name: {'loads': 0, 'hits': 0, 'evictions': 0, 'load_seconds': None, 'size_bytes': None,
+                              'format': None, 'error': None} for name in self.paths}
+
+    def path(self, name):
+        return os.path.join(self.root, self.paths[name])
+
+    def get(self, name):
+        """Returns the model, loading it if needed, or None if it can't be loaded."""
+        if name not in self.paths:
+            raise KeyError(f"Unknown model: {name}")
+        model = self._lookup(name)
+        if model is not None:
+            return model
+        with self._load_locks[name]:
+            # Another thread may have finished the load while we waited
+            model = self._lookup(name)
+            if model is not None:
+                return model
+            return self._load(name)
+
+    def version(self, name):
+        """Identifies the pickle behind the loaded model, for caches of its outputs."""
+        with self._lock:
+            return self._versions.get(name)
+
+    def preload(self, names):
+        """Loads names on a background thread so the first request doesn't pay for it."""
+        names = [name for name in names if name in self.paths]
+        if names:
+            threading.Thread(target=lambda: [self.get(name) for name in names], name='model-preload',
+                             daemon=True).start()
+
+    def _lookup(self, name):
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is None:
+                return None
+            self._models.move_to_end(name)
+            self._stats[name]['hits'] += 1
+            return entry[0]
+
+    def _load(self, name):
+        path = self.path(name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        failure = self._failures.get(name)
+        if failure is not None and failure[0] == mtime:
+            return None
+        if mtime is None:
+            return self._fail(name, mtime, f"{self.paths[name]} not found")
+
+        started = time.perf_counter()
+        compact = self._compact_path(name, path)
+        try:
+            if compact is not None:
+                model = compact_models.load_compact(compact)
+                size = compact_models.artifact_bytes(compact)
+            else:
+                import joblib
+
+                model = joblib.load(path)
+                size = os.path.getsize(path)
+        except Exception as e:
+            return self._fail(name, mtime, f"Error loading {self.paths[name]}: {e}")
+        elapsed = time.perf_counter() - started
+        kind = 'compact' if compact is not None else 'pickle'
+        self._failures.pop(name, None)
+        with self._lock:
+            self._models[name] = (model, size)
+            self._versions[name] = f"{int(mtime * 1e9)}-{os.path.getsize(path)}"
+            stats = self._stats[name]
+            stats.update(loads=stats['loads'] + 1, load_seconds=round(elapsed, 4), size_bytes=size, format=kind,
+                         error=None)
+            self._evict(keep=name)
+        logger.info(f"Loaded {kind} model {name} ({size / 1024:.0f} KiB) in {elapsed * 1000:.1f} ms")
+        return model
+
+    def _compact_path(self, name, path):
+        """The compact artifact exported from the current pickle, if there is one."""
+        if self.compact_root is None:
+            return None
+        compact = compact_models.artifact_dir(path, self.root, self.compact_root)
+        try:
+            manifest = compact_models.read_manifest(compact)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('source_sha256') != compact_models.file_sha256(path):
+            logger.warning(f"Compact artifact for {name} is stale; loading the pickle")
+            return None
+        return compact
+
+    def _fail(self, name, mtime, error):
+        self._failures[name] = (mtime, error)
+        with self._lock:
+            self._stats[name]['error'] = error
+        logger.error(f"Model {name} unavailable: {error}")
+        return None
+
+    def _evict(self, keep):
+        total = sum(size for _, size in self._models.values())
+        for name in list(self._models):
+            if total <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            _, size = self._models.pop(name)
+            total -= size
+            self._stats[name]['evictions'] += 1
+            logger.info(f"Evicted model {name} to stay within the {self.memory_budget // (1024 * 1024)} MiB budget")
+
+    def stats(self):
+        """Per-model load counts, hit counts, load time, size and last error."""
+        with self._lock:
+            return {name: dict(stats, loaded=name in self._models, version=self._versions.get(name))
+                    for name, stats in self._stats.items()}
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(size for _, size in self._models.values())
+
+
+HEAVY_MODULES = ('sklearn', 'pandas', 'cv2', 'joblib', 'xgboost')
+
+_COLD_IMPORT = """
+import json, sys, time
+started = time.perf_counter()
+import AlertNow
+print(json.dumps([time.perf_counter() - started, [m for m in sys.argv[1:] if m in sys.modules]]))
+"""
+
+_EAGER_LOAD = """
+import json, os, sys, time
+started = time.perf_counter()
+import cv2, joblib, pandas, sklearn
+for path in sys.argv[2:]:
+    if os.path.exists(path):
+        joblib.load(path)
+print(json.dumps([time.perf_counter() - started, []]))
+"""
+
+
+def _time_fresh(script, args, env):
+    out = subprocess.run([sys.executable, '-c', script, *args], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)), env=env).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def benchmark(repeats=3, root=DEFAULT_MODEL_DIR):
+    """Cold start of `import AlertNow` in a fresh interpreter, against loading every model up front.
+
+    The eager baseline imports cv2, pandas and sklearn and joblib.loads
+    every model pickle, which is what AlertNow's import used to do. Best of
+    repeats runs each; then the first get() of each model in this process.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        # Keep the users database the app migrates on import out of the checkout
+        env = dict(os.environ, DB_PATH=os.path.join(directory, 'users.db'))
+        lazy = min((_time_fresh(_COLD_IMPORT, HEAVY_MODULES, env) for _ in range(repeats)), key=lambda r: r[0])
+    paths = [os.path.join(root, path) for path in MODEL_PATHS.values()]
+    eager = min((_time_fresh(_EAGER_LOAD, ['--', *paths], None) for _ in range(repeats)), key=lambda r: r[0])
+    registry = ModelRegistry(root)
+    first_get = {}
+    for name in registry.paths:
+        started = time.perf_counter()
+        loaded = registry.get(name) is not None
+        first_get[name] = round((time.perf_counter() - started) * 1000, 1) if loaded else None
+    return {'import_alertnow_s': round(lazy[0], 3), 'heavy_modules_at_import': lazy[1],
+            'eager_load_s': round(eager[0], 3), 'first_get_ms': first_get}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold start with lazily loaded models.')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for key, value in benchmark(args.repeats).items():
+        logger.info(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
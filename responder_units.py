@@ -0,0 +1,268 @@
+import argparse
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from spatial_index import EARTH_RADIUS_KM, parse_point
+
+logger = logging.getLogger(__name__)
+
+AGENCIES = ('cdrrmo', 'pnp', 'bfp')
+# Which agencies answer an emergency type; anything else goes to CDRRMO
+AGENCIES_BY_TYPE = {'fire': ('bfp',), 'road_accident': ('pnp',)}
+DEFAULT_AGENCIES = ('cdrrmo',)
+# Units farther than this are not sent; the alert falls back to room routing
+DEFAULT_MAX_DISTANCE_KM = float(os.getenv('RESPONDER_MAX_DISTANCE_KM', '30'))
+
+
+class ResponderUnits:
+    """Positions and availability of responder units, for nearest-unit assignment.
+
+    Each unit is a logged-in CDRRMO, PNP or BFP dashboard that reports its
+    position. State lives in parallel NumPy arrays (radians, cosine of the
+    latitude, agency code, availability) grown by doubling, so a position
+    update is a few array writes and assign() is one masked haversine over
+    every unit. Reports, assignments and releases are published on the bus
+    and applied by every worker, so all of them pick from the same units.
+    Assignments are sequenced: the first one for a unit in bus order takes
+    it on every worker, and a worker whose pick lost picks again.
+    Dashboard connections are counted the same way; a unit goes off duty
+    when the last one closes, not when one of several tabs does.
+    """
+
+    def __init__(self, bus=None, max_distance_km=DEFAULT_MAX_DISTANCE_KM, capacity=64):
+        self.max_distance_km = max_distance_km
+        self._bus = bus
+        self._lock = threading.Lock()
+        self._ids = []
+        self._index = {}
+        self._municipality = []
+        self._assigned = {}  # unit id -> alert id
+        self._connections = {}  # unit id -> open dashboards, across workers
+        self._rlat = np.zeros(capacity)
+        self._rlon = np.zeros(capacity)
+        self._cos = np.zeros(capacity)
+        self._agency = np.full(capacity, -1, dtype=np.int8)
+        # On duty is what the unit reports; available also means it isn't on an alert
+        self._on_duty = np.zeros(capacity, dtype=bool)
+        self._available = np.zeros(capacity, dtype=bool)
+        self.assigned = 0
+        self.unassigned = 0
+        self.contested = 0
+        if bus is not None:
+            bus.subscribe('responders', self._apply)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _publish(self, message, sequenced=False):
+        if self._bus is None:
+            return self._apply(message, None, True)
+        return self._bus.publish('responders', message, sequenced=sequenced)
+
+    def report(self, unit_id, agency, lat, lon, municipality=None, available=True):
+        """Records a unit's position and whether it can take an alert."""
+        if agency not in AGENCIES:
+            raise ValueError(f"Unknown responder agency: {agency}")
+        point = parse_point(lat, lon)
+        if point is None:
+            raise ValueError(f"Invalid position for unit {unit_id}: {lat!r}, {lon!r}")
+        self._publish({'op': 'report', 'unit': unit_id, 'agency': agency, 'lat': point[0], 'lon': point[1],
+                       'municipality': municipality, 'available': bool(available)})
+
+    def set_available(self, unit_id, available):
+        self._publish({'op': 'available', 'unit': unit_id, 'available': bool(available)})
+
+    def connect(self, unit_id):
+        """Counts an open dashboard of the unit."""
+        self._publish({'op': 'connect', 'unit': unit_id})
+
+    def disconnect(self, unit_id):
+        """Counts a closed dashboard; the unit goes off duty when it was the last one."""
+        self._publish({'op': 'disconnect', 'unit': unit_id})
+
+    def release(self, unit_id, alert_id=None):
+        """Frees a unit whose alert is over; with alert_id, only if that is still the unit's alert."""
+        self._publish({'op': 'release', 'unit': unit_id, 'alert': alert_id})
+
+    def assign(self, alert):
+        """Picks and reserves the nearest available unit of the agency the alert's type calls for.
+
+        Returns {'unit', 'agency', 'municipality', 'distance_km'}, or None
+        when the alert has no usable position or no unit is in range.
+        """
+        point = parse_point(alert.get('lat'), alert.get('lon'))
+        if point is None:
+            return None
+        agencies = AGENCIES_BY_TYPE.get(alert.get('emergency_type'), DEFAULT_AGENCIES)
+        rlat, rlon = math.radians(point[0]), math.radians(point[1])
+        while True:
+            result = self._nearest(agencies, rlat, rlon)
+            if result is None:
+                with self._lock:
+                    self.unassigned += 1
+                return None
+            # The reservation only holds if it is the first for the unit in bus order
+            if self._publish({'op': 'assign', 'unit': result['unit'], 'alert': alert.get('id')}, sequenced=True):
+                with self._lock:
+                    self.assigned += 1
+                return result
+            with self._lock:
+                self.contested += 1
+
+    def _nearest(self, agencies, rlat, rlon):
+        """The nearest available unit of the agencies within range, or None."""
+        with self._lock:
+            count = len(self._ids)
+            wanted = self._available[:count].copy()
+            if len(agencies) == 1:
+                wanted &= self._agency[:count] == AGENCIES.index(agencies[0])
+            else:
+                wanted &= np.isin(self._agency[:count], [AGENCIES.index(agency) for agency in agencies])
+            candidates = np.flatnonzero(wanted)
+            if not candidates.size:
+                return None
+            a = (np.sin((self._rlat[candidates] - rlat) / 2) ** 2
+                 + math.cos(rlat) * self._cos[candidates] * np.sin((self._rlon[candidates] - rlon) / 2) ** 2)
+            best = int(a.argmin())
+            distance = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(float(a[best]), 1.0)))
+            if self.max_distance_km is not None and distance > self.max_distance_km:
+                return None
+            index = int(candidates[best])
+            return {'unit': self._ids[index], 'agency': AGENCIES[self._agency[index]],
+                    'municipality': self._municipality[index], 'distance_km': round(distance, 3)}
+
+    def _slot(self, unit_id):
+        """Array index of a unit, adding it if new; caller holds the lock."""
+        index = self._index.get(unit_id)
+        if index is not None:
+            return index
+        index = len(self._ids)
+        if index == len(self._rlat):
+            size = 2 * len(self._rlat)
+            for name in ('_rlat', '_rlon', '_cos', '_agency', '_on_duty', '_available'):
+                old = getattr(self, name)
+                grown = np.zeros(size, dtype=old.dtype)
+                grown[:index] = old
+                setattr(self, name, grown)
+        self._ids.append(unit_id)
+        self._municipality.append(None)
+        self._index[unit_id] = index
+        return index
+
+    def _apply(self, message, seq, is_origin):
+        op, unit_id = message['op'], message['unit']
+        with self._lock:
+            if op == 'connect':
+                self._connections[unit_id] = self._connections.get(unit_id, 0) + 1
+                return None
+            if op == 'disconnect':
+                remaining = self._connections.pop(unit_id, 1) - 1
+                if remaining > 0:
+                    self._connections[unit_id] = remaining
+                    return None
+                op = 'available'
+                message = dict(message, available=False)
+            if op == 'report':
+                index = self._slot(unit_id)
+                rlat = math.radians(message['lat'])
+                self._rlat[index], self._rlon[index], self._cos[index] = rlat, math.radians(message['lon']), math.cos(rlat)
+                self._agency[index] = AGENCIES.index(message['agency'])
+                self._municipality[index] = message.get('municipality')
+                op = 'available'
+            index = self._index.get(unit_id)
+            if index is None:
+                return False if op == 'assign' else None
+            if op == 'assign' and not self._available[index]:
+                # An assignment sequenced earlier took the unit, or it went off duty; the publisher picks again
+                return False
+            if op == 'available':
+                self._on_duty[index] = message['available']
+            elif op == 'assign':
+                self._assigned[unit_id] = message['alert']
+            elif op == 'release' and message.get('alert') in (None, self._assigned.get(unit_id)):
+                self._assigned.pop(unit_id, None)
+            # A unit on an alert stays reserved until it is released
+            self._available[index] = self._on_duty[index] and unit_id not in self._assigned
+        return True if op == 'assign' else None
+
+    def unit(self, unit_id):
+        with self._lock:
+            index = self._index.get(unit_id)
+            if index is None:
+                return None
+            return {'unit': unit_id, 'agency': AGENCIES[self._agency[index]],
+                    'municipality': self._municipality[index],
+                    'lat': round(math.degrees(self._rlat[index]), 6), 'lon': round(math.degrees(self._rlon[index]), 6),
+                    'on_duty': bool(self._on_duty[index]), 'available': bool(self._available[index]),
+                    'alert': self._assigned.get(unit_id)}
+
+    def stats(self):
+        with self._lock:
+            count = len(self._ids)
+            available = {agency: int((self._available[:count] & (self._agency[:count] == i)).sum())
+                         for i, agency in enumerate(AGENCIES)}
+            return {'units': count, 'available': available, 'busy': len(self._assigned),
+                    'assigned': self.assigned, 'unassigned': self.unassigned, 'contested': self.contested}
+
+
+def benchmark(units=5000, alerts=20000, busy_for=200, seed=0):
+    """Assigns an alert storm across units spread over the two municipalities.
+
+    Each assigned unit is released busy_for alerts later, so availability
+    churns the way it would during a long incident spike.
+    """
+    rng = np.random.default_rng(seed)
+    pool = ResponderUnits()
+    for i in range(units):
+        pool.report(f"unit-{i}", AGENCIES[i % len(AGENCIES)], rng.uniform(13.6, 14.4), rng.uniform(121.1, 121.6))
+    types = rng.choice(['fire', 'road_accident', 'General'], alerts)
+    lats, lons = rng.uniform(13.6, 14.4, alerts), rng.uniform(121.1, 121.6, alerts)
+    timings, pending = [], []
+    for i in range(alerts):
+        alert = {'id': str(i), 'lat': lats[i], 'lon': lons[i], 'emergency_type': types[i]}
+        started = time.perf_counter()
+        result = pool.assign(alert)
+        timings.append(time.perf_counter() - started)
+        if result is not None:
+            pending.append((i + busy_for, result['unit']))
+        while pending and pending[0][0] <= i:
+            pool.release(pending.pop(0)[1])
+    timings = np.array(timings) * 1e6
+
+    # The same choice by walking every unit in Python
+    state = [(pool._ids[i], AGENCIES[pool._agency[i]], math.degrees(pool._rlat[i]), math.degrees(pool._rlon[i]))
+             for i in range(units)]
+    started = time.perf_counter()
+    for i in range(1000):
+        agencies = AGENCIES_BY_TYPE.get(types[i], DEFAULT_AGENCIES)
+        min((_haversine(lats[i], lons[i], lat, lon), unit_id) for unit_id, agency, lat, lon in state
+            if agency in agencies)
+    loop_us = (time.perf_counter() - started) / 1000 * 1e6
+    return {'units': units, 'alerts': alerts, 'assigned': pool.assigned, 'unassigned': pool.unassigned,
+            'mean_us': round(float(timings.mean()), 1), 'p50_us': round(float(np.percentile(timings, 50)), 1),
+            'p99_us': round(float(np.percentile(timings, 99)), 1), 'python_loop_us': round(loop_us, 1)}
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark nearest-unit assignment under an alert storm.')
+    parser.add_argument('--units', type=int, default=5000)
+    parser.add_argument('--alerts', type=int, default=20000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for key, value in benchmark(args.units, args.alerts).items():
+        logger.info(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+import bisect
+import logging
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+from analytics_windows import DEFAULT_DATASET_DIR, coords_barangay_name
+from dataset_cache import DatasetCache
+
+logger = logging.getLogger(__name__)
+
+MANILA = pytz.timezone('Asia/Manila')
+DEFAULT_DEADLINE = float(os.getenv('RISK_MODEL_DEADLINE_MS', '250')) / 1000
+# How long a model may wait for a pool thread before it is dropped; its deadline starts once it runs
+DEFAULT_QUEUE_TIMEOUT = float(os.getenv('RISK_MODEL_QUEUE_MS', '1000')) / 1000
+# What each family's models predict, and the registry names that serve it
+FAMILIES = {
+    'fire': {'dataset': 'fire', 'target': 'Fire_Cause', 'models': ('lr_fire', 'rf_fire', 'svm_fire', 'xgb_fire')},
+    'road': {'dataset': 'road', 'target': 'Accident_Type', 'models': ('lr_road', 'rf_road', 'svm_road', 'xgb_road')},
+}
+
+# catch_warnings swaps the process-wide filter list, so concurrent model runs take turns in it
+_WARNINGS_LOCK = threading.Lock()
+
+
+class LatencyHistogram:
+    """Cumulative latency counts over fixed millisecond buckets."""
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.total_ms = 0.0
+        self.missed = 0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms, missed=False):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BOUNDS_MS, elapsed_ms)] += 1
+            self.total_ms += elapsed_ms
+            self.missed += missed
+
+    def snapshot(self):
+        with self._lock:
+            count = sum(self.counts)
+            buckets = {f"le_{bound}ms": n for bound, n in zip(self.BOUNDS_MS, self.counts)}
+            buckets['over'] = self.counts[-1]
+            return {'count': count, 'missed_deadline': self.missed, 'buckets': buckets,
+                    'mean_ms': round(self.total_ms / count, 2) if count else None}
+
+
+class RiskScorer:
+    """Batch scoring of the fire and road incident models per (barangay, weather, hour).
+
+    The models predict what kind of incident is likely (fire cause, road
+    accident type); each row gets every available model's class
+    probabilities, their mean, and how many incidents the historical
+    dataset holds for that barangay and weather. Rows are encoded by each
+    model's own preprocessor in one vectorized frame, encoded rows are
+    cached per (municipality, barangay, weather, hour, weekday), and every
+    model runs a single predict_proba over the whole batch.
+
+    The models of a family run in parallel on a small pool, each against
+    its own deadline (deadlines[name], else deadline seconds), counted
+    from when the model starts running. A model that misses it is left
+    out of the ensemble mean and reported as dropped; its latency still
+    lands in that model's histogram. Each model has at most
+    max_in_flight runs going, late ones included since they finish in
+    the background; a model that can't get a slot and a pool thread
+    within queue_timeout is dropped as busy or queued.
+    """
+
+    def __init__(self, registry, barangay_coords, dataset_dir=DEFAULT_DATASET_DIR, max_cached_rows=20000,
+                 deadline=DEFAULT_DEADLINE, deadlines=None, workers=4, datasets=None,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT, max_in_flight=2):
+        self.registry = registry
+        self.deadline = deadline
+        self.deadlines = deadlines or {}
+        self.queue_timeout = queue_timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='risk-model')
+        self._in_flight = {name: threading.BoundedSemaphore(max_in_flight)
+                           for spec in FAMILIES.values() for name in spec['models']}
+        self._latency = {name: LatencyHistogram() for spec in FAMILIES.values() for name in spec['models']}
+        self.barangay_coords = barangay_coords
+        self.datasets = datasets or DatasetCache(dataset_dir)
+        self.max_cached_rows = max_cached_rows
+        self._lock = threading.Lock()
+        self._encoded = OrderedDict()  # (model, version, row key) -> encoded sparse row
+        self._profiles = {}
+        self.hits = 0
+        self.misses = 0
+
+    def barangay_rows(self, weather, hour, municipality=None):
+        """One row per barangay in coords.txt, optionally limited to one municipality."""
+        return [{'barangay': barangay, 'municipality': name, 'weather': weather, 'hour': hour}
+                for name, barangays in self.barangay_coords.items()
+                if municipality is None or name == municipality
+                for barangay in barangays]
+
+    def score(self, family, rows, now=None, deadline=None):
+        """Returns {'scores', 'contributors', 'dropped'} for rows of barangay, municipality, weather and hour."""
+        if family not in FAMILIES:
+            raise ValueError(f"Unknown risk model family: {family}")
+        spec = FAMILIES[family]
+        profile = self._profile(spec)
+        if not isinstance(rows, list):
+            raise ValueError(f"Rows must be a list of objects, got {type(rows).__name__}")
+        for row in rows:
+            if not isinstance(row, dict) or not isinstance(row.get('barangay'), str):
+                raise ValueError(f"Each row needs a barangay name, got {row!r}")
+            if row.get('weather') not in profile['weathers']:
+                raise ValueError(f"Unknown weather {row.get('weather')!r}; expected one of {profile['weathers']}")
+            if not isinstance(row.get('hour'), int) or not 0 <= row['hour'] <= 23:
+                raise ValueError(f"Hour must be an integer from 0 to 23, got {row.get('hour')!r}")
+        now = now or datetime.now(MANILA)
+        weekday = now.strftime('%A')
+        keys = [(row.get('municipality'), row['barangay'], row['weather'], row['hour'], weekday) for row in rows]
+
+        classes = profile['classes']
+        dropped = {}
+        # Loading happens before the clock starts; deadlines only cover inference
+        available = {}
+        for name in spec['models']:
+            model = self.registry.get(name)
+            if model is None:
+                dropped[name] = 'unavailable'
+            else:
+                available[name] = model
+        budgets = {name: deadline if deadline is not None else self.deadlines.get(name, self.deadline)
+                   for name in available}
+        queued = time.monotonic()
+        runs = {}
+        for name, model in available.items():
+            if not self._in_flight[name].acquire(timeout=max(0.0, queued + self.queue_timeout - time.monotonic())):
+                dropped[name] = 'busy'
+                continue
+            began = Future()
+            runs[name] = (began, self._pool.submit(self._run_model, name, model, keys, profile, now, classes,
+                                                   budgets[name], began))
+        per_model = {}
+        for name, (began, future) in runs.items():
+            try:
+                started = began.result(timeout=max(0.0, queued + self.queue_timeout - time.monotonic()))
+            except FutureTimeout:
+                if future.cancel():
+                    self._in_flight[name].release()
+                    dropped[name] = 'queued'
+                    continue
+                started = began.result()
+            try:
+                per_model[name] = future.result(timeout=max(0.0, started + budgets[name] - time.monotonic()))
+            except FutureTimeout:
+                dropped[name] = 'deadline'
+            except Exception as e:
+                logger.error(f"Risk model {name} failed: {e}", exc_info=True)
+                dropped[name] = 'error'
+        if not per_model:
+            raise RuntimeError(f"No {family} model answered in time: {dropped}")
+
+        mean = np.mean(list(per_model.values()), axis=0)
+        history = profile['history']
+        results = []
+        for i, row in enumerate(rows):
+            dataset_name = profile['names'].get(row['barangay'], row['barangay'])
+            results.append({
+                'barangay': row['barangay'],
+                'municipality': row.get('municipality'),
+                'weather': row['weather'],
+                'hour': row['hour'],
+                'likely': classes[int(mean[i].argmax())],
+                'probabilities': {label: round(float(p), 4) for label, p in zip(classes, mean[i])},
+                'models': {name: classes[int(probabilities[i].argmax())] for name, probabilities in per_model.items()},
+                'historical_incidents': int(history.get((dataset_name, row['weather']), 0)),
+            })
+        return {'scores': results, 'contributors': list(per_model), 'dropped': dropped}
+
+    def _run_model(self, name, model, keys, profile, now, classes, budget, began):
+        started = time.monotonic()
+        began.set_result(started)
+        try:
+            encoded = self._encode(name, model, keys, profile, now)
+            return _probabilities(model.named_steps['classifier'], encoded, classes)
+        finally:
+            elapsed = time.monotonic() - started
+            self._latency[name].observe(elapsed * 1000, missed=elapsed > budget)
+            self._in_flight[name].release()
+
+    def _encode(self, name, model, keys, profile, now):
+        from scipy import sparse
+
+        version = self.registry.version(name)
+        encoded = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                row = self._encoded.get((name, version, key))
+                if row is None:
+                    missing.append(i)
+                else:
+                    self._encoded.move_to_end((name, version, key))
+                    encoded[i] = row
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            frame = self._frame([keys[i] for i in missing], profile, now)
+            matrix = sparse.csr_matrix(_transform(model.named_steps['preprocessor'], frame))
+            with self._lock:
+                for offset, i in enumerate(missing):
+                    encoded[i] = matrix[offset]
+                    self._encoded[(name, version, keys[i])] = encoded[i]
+                while len(self._encoded) > self.max_cached_rows:
+                    self._encoded.popitem(last=False)
+        return sparse.vstack(encoded, format='csr')
+
+    def _frame(self, keys, profile, now):
+        import pandas as pd
+
+        frame = pd.DataFrame(keys, columns=['municipality', 'coords_barangay', 'Weather', 'hour', 'Day_of_Week'])
+        points = [self._point(municipality, barangay) for municipality, barangay, *_ in keys]
+        frame['Barangay'] = frame['coords_barangay'].map(lambda b: profile['names'].get(b, b))
+        frame['Latitude'] = [lat for lat, _ in points]
+        frame['Longitude'] = [lon for _, lon in points]
+        frame['Time'] = frame['hour'].astype(str) + ':00'
+        # The training dates never recur, so today's date one-hot encodes to zeros like any unseen date
+        frame['Date'] = now.strftime('%d/%m/%Y')
+        for column, value in profile['defaults'].items():
+            frame[column] = value
+        return frame
+
+    def _point(self, municipality, barangay):
+        point = self.barangay_coords.get(municipality, {}).get(barangay)
+        if point is None:
+            # Unknown places are left for the models' imputers
+            return np.nan, np.nan
+        return point['lat'], point['lon']
+
+    def _profile(self, spec):
+        """Class labels, default feature values and historical counts derived from the training dataset."""
+        data = self.datasets.load(spec['dataset'])
+        if data is None:
+            raise RuntimeError(f"No {spec['dataset']} dataset to build risk profiles from")
+        cached = self._profiles.get(spec['dataset'])
+        if cached is not None and cached['version'] == data.version:
+            return cached
+
+        target = spec['target']
+        fixed = {'Date', 'Time', 'Day_of_Week', 'Barangay', 'Latitude', 'Longitude', 'Weather', target}
+        # Features a risk query doesn't specify are held at their typical values
+        defaults = {column: data.mode(column) if data.is_categorical(column) else float(np.nanmedian(data[column]))
+                    for column in data.columns if column not in fixed}
+        barangays = data.dictionaries['Barangay']
+        weathers = data.dictionaries['Weather']
+        pairs = data['Barangay'].astype(np.int64) * len(weathers) + data['Weather']
+        pairs = np.bincount(pairs[(data['Barangay'] >= 0) & (data['Weather'] >= 0)],
+                            minlength=len(barangays) * len(weathers))
+        profile = {
+            'version': data.version,
+            # Dictionaries are sorted; the xgb models were trained on LabelEncoder codes, i.e. the sorted labels
+            'classes': list(data.dictionaries[target]),
+            'weathers': list(weathers),
+            'defaults': defaults,
+            'names': {coords_barangay_name(name): name for name in barangays},
+            'history': {(barangays[i // len(weathers)], weathers[i % len(weathers)]): int(n)
+                        for i, n in enumerate(pairs) if n},
+        }
+        self._profiles[spec['dataset']] = profile
+        logger.info(f"Built {spec['dataset']} risk profile")
+        return profile
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            cache = {'cached_rows': len(self._encoded), 'hits': self.hits, 'misses': self.misses,
+                     'hit_rate': round(self.hits / lookups, 4) if lookups else None}
+        return {'cache': cache, 'latency': {name: histogram.snapshot() for name, histogram in self._latency.items()}}
+
+
+def _transform(preprocessor, frame):
+    """Encodes risk rows without sklearn's warning about unknown categories.
+
+    Risk rows carry today's date, whole hours and barangays the training
+    data may lack; the one-hot encoders map those to zeros by design.
+    """
+    with _WARNINGS_LOCK, warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='Found unknown categories', category=UserWarning,
+                                module=r'sklearn\.preprocessing')
+        return preprocessor.transform(frame)
+
+
+def _probabilities(classifier, encoded, classes):
+    """predict_proba columns in the order of classes."""
+    probabilities = np.asarray(classifier.predict_proba(encoded))
+    known = [str(label) for label in classifier.classes_]
+    if set(known) == set(classes):
+        probabilities = probabilities[:, [known.index(label) for label in classes]]
+    return probabilities
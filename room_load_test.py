@@ -0,0 +1,114 @@
+import argparse
+import json
+import logging
+import random
+import time
+
+import numpy as np
+from flask import Flask, session
+from flask_socketio import SocketIO, join_room
+
+from alert_store import alert_rooms, session_rooms
+
+logger = logging.getLogger(__name__)
+
+# Per municipality: barangay officials, then one dashboard group per responder agency
+DASHBOARDS_PER_ROLE = {'barangay': 10, 'cdrrmo': 5, 'pnp': 5, 'bfp': 5}
+BARANGAYS_PER_MUNICIPALITY = 5
+
+
+def build_app():
+    """A Socket.IO app whose connect handler joins session_rooms() like AlertNow's."""
+    app = Flask(__name__)
+    app.secret_key = 'room-load-test'
+    socketio = SocketIO(app)
+
+    @socketio.on('connect')
+    def handle_connect():
+        for room in session_rooms(session.get('role'), session.get('assigned_municipality'),
+                                  session.get('barangay'), session.get('unique_id')):
+            join_room(room)
+
+    return app, socketio
+
+
+def connect_dashboards(app, socketio, municipalities):
+    clients = []
+    for municipality in municipalities:
+        for role, count in DASHBOARDS_PER_ROLE.items():
+            for i in range(count):
+                http = app.test_client()
+                with http.session_transaction() as sess:
+                    sess['role'] = role
+                    sess['assigned_municipality'] = municipality
+                    sess['unique_id'] = f"{role}_{municipality}_{i}"
+                    if role == 'barangay':
+                        sess['barangay'] = f"{municipality} Barangay {i % BARANGAYS_PER_MUNICIPALITY}"
+                clients.append(socketio.test_client(app, flask_test_client=http))
+    return clients
+
+
+def received_bytes(clients):
+    """Drains every client and returns the JSON bytes of the events they got."""
+    return sum(len(json.dumps(packet['args'])) for client in clients for packet in client.get_received())
+
+
+def run(socketio, clients, alerts, routed):
+    latencies, delivered = [], 0
+    for alert in alerts:
+        started = time.perf_counter()
+        if routed:
+            socketio.emit('new_alert', alert, to=alert_rooms(alert))
+        else:
+            socketio.emit('new_alert', alert)
+        latencies.append(time.perf_counter() - started)
+        delivered += received_bytes(clients)
+    latencies = np.array(latencies) * 1000
+    return {'bytes_per_alert': round(delivered / len(alerts)),
+            'emit_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+            'emit_ms_p99': round(float(np.percentile(latencies, 99)), 3)}
+
+
+def benchmark(municipalities=20, alerts=200, seed=0):
+    """Bytes delivered and emit latency per alert, routed to rooms versus broadcast to every dashboard.
+
+    Each municipality has 25 dashboards (10 barangay, 5 each for CDRRMO,
+    PNP and BFP), so the default is 500 connected clients. Latency is the
+    time socketio.emit takes to hand the event to every recipient's queue.
+    """
+    rng = random.Random(seed)
+    names = [f"Municipality {i}" for i in range(municipalities)]
+    app, socketio = build_app()
+    clients = connect_dashboards(app, socketio, names)
+    received_bytes(clients)
+
+    batch = []
+    for i in range(alerts):
+        municipality = rng.choice(names)
+        batch.append({'id': str(i), 'lat': 14.07, 'lon': 121.32, 'role': 'barangay',
+                      'emergency_type': rng.choice(['fire', 'road_accident', 'General']),
+                      'barangay': f"{municipality} Barangay {rng.randrange(BARANGAYS_PER_MUNICIPALITY)}",
+                      'municipality': municipality, 'house_no': '12', 'street_no': 'Rizal St',
+                      'timestamp': '2026-10-17T08:00:00+08:00', 'status': 'new'})
+    broadcast = run(socketio, clients, batch, routed=False)
+    routed = run(socketio, clients, batch, routed=True)
+    for client in clients:
+        client.disconnect()
+    result = {'dashboards': len(clients), 'municipalities': municipalities, 'alerts': alerts}
+    result.update({f"broadcast_{key}": value for key, value in broadcast.items()})
+    result.update({f"routed_{key}": value for key, value in routed.items()})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test room routing of alert events with Socket.IO test clients.')
+    parser.add_argument('--municipalities', type=int, default=20)
+    parser.add_argument('--alerts', type=int, default=200)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for key, value in benchmark(args.municipalities, args.alerts).items():
+        logger.info(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
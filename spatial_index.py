@@ -0,0 +1,250 @@
+import argparse
+import ast
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COORDS_PATH = os.path.join(os.path.dirname(__file__), 'assets', 'coords.txt')
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Points farther than this from every barangay are not attributed to one
+DEFAULT_MAX_DISTANCE_KM = float(os.getenv('BARANGAY_MAX_DISTANCE_KM', '3'))
+# Pruning works on a flat projection; the slack keeps it conservative against true great-circle distances
+_SLACK = 1.01
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km; arguments broadcast like NumPy arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def parse_point(lat, lon):
+    """(lat, lon) as floats, or None if either is missing, unparsable or out of range."""
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def load_coords(path=DEFAULT_COORDS_PATH):
+    with open(path) as f:
+        return ast.literal_eval(f.read())
+
+
+def grid_cell(lat, lon, cell_deg):
+    """The (row, col) of a fixed cell_deg-degree grid a point falls in."""
+    return math.floor(lat / cell_deg), math.floor(lon / cell_deg)
+
+
+def cells_within(lat, lon, radius_km, cell_deg):
+    """Every grid_cell() a circle of radius_km around (lat, lon) can touch."""
+    dlat = radius_km / KM_PER_DEGREE
+    # Longitude degrees shrink towards the poles; use the circle's widest latitude
+    widest = min(89.9, abs(lat) + dlat)
+    dlon = dlat / math.cos(math.radians(widest))
+    row0, col0 = grid_cell(lat - dlat, lon - dlon, cell_deg)
+    row1, col1 = grid_cell(lat + dlat, lon + dlon, cell_deg)
+    return [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+
+class BarangayIndex:
+    """Nearest-barangay lookups over coords.txt on a uniform lat/lon grid.
+
+    Every cell keeps the few barangays that can be nearest to some point
+    inside it (those no farther from the cell than the farthest corner is
+    from the cell's best barangay), so a lookup is one cell fetch and a
+    handful of haversines, usually two or three. Candidate lists are stored
+    flat with per-cell offsets, which lets nearest_many() resolve a whole
+    batch with vectorized NumPy. Points outside the grid compare against
+    every barangay.
+    """
+
+    def __init__(self, coords, cell_km=0.5, max_distance_km=DEFAULT_MAX_DISTANCE_KM):
+        self.max_distance_km = max_distance_km
+        points = [(barangay, municipality, point['lat'], point['lon'])
+                  for municipality, barangays in coords.items() for barangay, point in barangays.items()]
+        self.barangays = [barangay for barangay, *_ in points]
+        self.municipalities = [municipality for _, municipality, *_ in points]
+        self.lat = np.array([lat for *_, lat, _ in points], dtype=np.float64)
+        self.lon = np.array([lon for *_, lon in points], dtype=np.float64)
+        self._rlat, self._rlon = np.radians(self.lat), np.radians(self.lon)
+        self._cos = np.cos(self._rlat)
+        self._points = list(zip(self._rlat.tolist(), self._rlon.tolist(), self._cos.tolist()))
+        self.shape = (0, 0)
+        if len(self):
+            self._build_grid(cell_km)
+
+    def __len__(self):
+        return len(self.barangays)
+
+    def _build_grid(self, cell_km):
+        self.cell_lat = cell_km / KM_PER_DEGREE
+        self.cell_lon = self.cell_lat / math.cos(math.radians(float(np.abs(self.lat).max())))
+        # One spare cell on every side so points just outside the barangays still hit the grid
+        self.origin = (float(self.lat.min()) - self.cell_lat, float(self.lon.min()) - self.cell_lon)
+        rows = int((self.lat.max() - self.origin[0]) // self.cell_lat) + 2
+        cols = int((self.lon.max() - self.origin[1]) // self.cell_lon) + 2
+        self.shape = (rows, cols)
+
+        # Flat km coordinates of the points and the cell edges, for pruning only
+        scale = math.cos(math.radians(float(self.lat.mean())))
+        py = (self.lat - self.origin[0]) * KM_PER_DEGREE
+        px = (self.lon - self.origin[1]) * KM_PER_DEGREE * scale
+        y0, x0 = np.meshgrid(np.arange(rows) * self.cell_lat * KM_PER_DEGREE,
+                             np.arange(cols) * self.cell_lon * KM_PER_DEGREE * scale, indexing='ij')
+        y0, x0 = y0.reshape(-1, 1), x0.reshape(-1, 1)
+        y1, x1 = y0 + self.cell_lat * KM_PER_DEGREE, x0 + self.cell_lon * KM_PER_DEGREE * scale
+        # (cell, point) distance from the nearest and from the farthest point of the cell
+        near = np.hypot(np.maximum(0, np.maximum(y0 - py, py - y1)), np.maximum(0, np.maximum(x0 - px, px - x1)))
+        far = np.hypot(np.maximum(np.abs(py - y0), np.abs(py - y1)), np.maximum(np.abs(px - x0), np.abs(px - x1)))
+        keep = near <= far.min(axis=1, keepdims=True) * _SLACK + 1e-9
+        self._offsets = np.concatenate([[0], np.cumsum(keep.sum(axis=1))]).astype(np.int64)
+        self._members = np.nonzero(keep)[1].astype(np.int64)
+        self._offsets_list = self._offsets.tolist()
+        self._members_list = self._members.tolist()
+
+    def _cells(self, lat, lon):
+        """Flat cell index per point, or -1 outside the grid."""
+        row = np.floor((lat - self.origin[0]) / self.cell_lat)
+        col = np.floor((lon - self.origin[1]) / self.cell_lon)
+        inside = (row >= 0) & (row < self.shape[0]) & (col >= 0) & (col < self.shape[1])
+        return np.where(inside, row * self.shape[1] + col, -1).astype(np.int64)
+
+    def _half_chord(self, rlat, rlon, members):
+        """The haversine 'a' term (monotonic in distance) from points to barangays, elementwise."""
+        return (np.sin((self._rlat[members] - rlat) / 2) ** 2
+                + np.cos(rlat) * self._cos[members] * np.sin((self._rlon[members] - rlon) / 2) ** 2)
+
+    def nearest_many(self, lat, lon):
+        """(index, distance_km) arrays of the nearest barangay to each point."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        index = np.full(lat.shape, -1, dtype=np.int64)
+        a = np.full(lat.shape, np.nan)
+        if not len(self) or not lat.size:
+            return index, np.full(lat.shape, np.inf)
+        rlat, rlon = np.radians(lat), np.radians(lon)
+        cells = self._cells(lat, lon)
+        inside = np.flatnonzero(cells >= 0)
+        if inside.size:
+            # One (point, candidate) pair per candidate of each point's cell, grouped by point
+            starts, counts = self._offsets[cells[inside]], np.diff(self._offsets)[cells[inside]]
+            first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            owner = np.repeat(np.arange(inside.size), counts)
+            members = self._members[np.repeat(starts - first, counts) + np.arange(owner.size)]
+            pair_a = self._half_chord(rlat[inside][owner], rlon[inside][owner], members)
+            best = np.minimum.reduceat(pair_a, first)
+            # First candidate of each point that reaches its minimum
+            hits = np.flatnonzero(pair_a == best[owner])
+            firsts = np.concatenate([[True], owner[hits][1:] != owner[hits][:-1]])
+            index[inside] = members[hits[firsts]]
+            a[inside] = best
+        outside = np.flatnonzero(cells < 0)
+        if outside.size:
+            every = np.arange(len(self))
+            pair_a = self._half_chord(rlat[outside, None], rlon[outside, None], every)
+            index[outside] = pair_a.argmin(axis=1)
+            a[outside] = pair_a.min(axis=1)
+        return index, 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def nearest(self, lat, lon):
+        """(barangay, municipality, distance_km) nearest to a point, or None if there are no barangays."""
+        if not len(self):
+            return None
+        row = math.floor((lat - self.origin[0]) / self.cell_lat)
+        col = math.floor((lon - self.origin[1]) / self.cell_lon)
+        if not (0 <= row < self.shape[0] and 0 <= col < self.shape[1]):
+            index, distance = self.nearest_many([lat], [lon])
+            return self.barangays[index[0]], self.municipalities[index[0]], float(distance[0])
+        # A single point is cheaper in plain Python than through NumPy's per-call overhead
+        cell = row * self.shape[1] + col
+        rlat, rlon = math.radians(lat), math.radians(lon)
+        cos_lat = math.cos(rlat)
+        best, best_a = -1, math.inf
+        for i in self._members_list[self._offsets_list[cell]:self._offsets_list[cell + 1]]:
+            plat, plon, pcos = self._points[i]
+            a = math.sin((plat - rlat) / 2) ** 2 + cos_lat * pcos * math.sin((plon - rlon) / 2) ** 2
+            if a < best_a:
+                best, best_a = i, a
+        distance = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(best_a, 1.0)))
+        return self.barangays[best], self.municipalities[best], distance
+
+    def resolve(self, lat, lon):
+        """(barangay, municipality) of a reported point, or None when it is unusable or too far from any barangay."""
+        point = parse_point(lat, lon)
+        if point is None:
+            return None
+        found = self.nearest(*point)
+        if found is None or found[2] > self.max_distance_km:
+            return None
+        return found[0], found[1]
+
+    def within(self, lat, lon, radius_km):
+        """[(barangay, municipality, distance_km)] within radius_km of a point, nearest first."""
+        km = haversine_km(lat, lon, self.lat, self.lon)
+        order = np.argsort(km, kind='stable')
+        return [(self.barangays[i], self.municipalities[i], float(km[i])) for i in order if km[i] <= radius_km]
+
+
+def linear_nearest(index, lat, lon):
+    """The same answer as BarangayIndex.nearest_many() by a full haversine scan, for checking and benchmarks."""
+    km = haversine_km(np.asarray(lat)[:, None], np.asarray(lon)[:, None], index.lat, index.lon)
+    return km.argmin(axis=1), km.min(axis=1)
+
+
+def benchmark(points=100_000, coords_path=DEFAULT_COORDS_PATH, seed=0):
+    """Resolves random points around the barangays with the grid and with a linear scan."""
+    index = BarangayIndex(load_coords(coords_path))
+    rng = np.random.default_rng(seed)
+    # Mostly inside the area, some well outside it
+    margin = 0.05
+    lat = rng.uniform(index.lat.min() - margin, index.lat.max() + margin, points)
+    lon = rng.uniform(index.lon.min() - margin, index.lon.max() + margin, points)
+    results = {'points': points, 'barangays': len(index), 'grid': index.shape,
+               'mean_candidates': round(float(np.diff(index._offsets).mean()), 2)}
+
+    started = time.perf_counter()
+    grid_index, grid_km = index.nearest_many(lat, lon)
+    results['grid_batch_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    started = time.perf_counter()
+    scan_index, scan_km = linear_nearest(index, lat, lon)
+    results['linear_batch_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    started = time.perf_counter()
+    for i in range(points):
+        index.nearest(lat[i], lon[i])
+    results['grid_single_us'] = round((time.perf_counter() - started) / points * 1e6, 1)
+
+    started = time.perf_counter()
+    for i in range(points):
+        haversine_km(lat[i], lon[i], index.lat, index.lon).argmin()
+    results['linear_single_us'] = round((time.perf_counter() - started) / points * 1e6, 1)
+
+    results['mismatches'] = int(np.sum(~np.isclose(grid_km, scan_km, rtol=0, atol=1e-9)))
+    results['same_barangay'] = round(float(np.mean(grid_index == scan_index)), 6)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark nearest-barangay resolution against a linear scan.')
+    parser.add_argument('--points', type=int, default=100_000)
+    parser.add_argument('--coords', default=DEFAULT_COORDS_PATH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for key, value in benchmark(args.points, args.coords).items():
+        logger.info(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,11 @@
 const socket = io(window.location.origin); // e.g., http://localhost:5000 or https://alertnow.onrender.com
 const alertContainer = document.getElementById('alert-container');
 
+socket.on('alert_thumbnail', (data) => {
+    document.querySelectorAll(`img[data-image-id="${data.image_id}"]`)
+        .forEach(img => img.src = `data:image/jpeg;base64,${data.thumbnail}`);
+});
+
 socket.on('new_alert', (data) => {
     const div = document.createElement('div');
     const now = new Date();
@@ -11,7 +16,7 @@ socket.on('new_alert', (data) => {
     div.innerHTML = `
         <p><strong>Type:</strong> ${data.emergency_type || 'Not Specified'}</p>
         <p><strong>Location:</strong> ${data.lat}, ${data.lon}</p>
-        ${data.image && isImageValid ? `<img src="data:image/jpeg;base64,${data.image}" width="200"/>` : ''}
+        ${data.image_id && isImageValid ? `<a href="/images/${data.image_id}" target="_blank"><img data-image-id="${data.image_id}" alt="Loading photo..." ${data.thumbnail ? `src="data:image/jpeg;base64,${data.thumbnail}"` : ''} width="200"/></a>` : ''}
         <hr>
     `;
     alertContainer.prepend(div);
@@ -0,0 +1,38 @@
+// Incident density from /api/heatmap for the map's viewport, as a Leaflet.heat layer.
+// layers limits it to 'fire', 'road' or 'other' (comma-separated); omit it for all.
+function addIncidentHeatmap(map, layers) {
+    const heat = L.heatLayer([], { radius: 25, blur: 20, maxZoom: 17 });
+    let pending = null;
+
+    function refresh() {
+        clearTimeout(pending);
+        // Panning fires moveend repeatedly and alerts can arrive in bursts; fetch once things settle
+        pending = setTimeout(() => {
+            if (!map.hasLayer(heat)) return;
+            const bounds = map.getBounds();
+            const bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()]
+                .map(value => value.toFixed(4)).join(',');
+            const params = new URLSearchParams({ bbox });
+            if (layers) params.set('layers', layers);
+            // The response carries an ETag, so an unchanged heatmap is revalidated rather than resent
+            fetch(`/api/heatmap?${params}`)
+                .then(res => res.ok ? res.json() : Promise.reject(new Error(`HTTP ${res.status}`)))
+                .then(tiles => {
+                    const half = tiles.cell_deg / 2;
+                    heat.setOptions({ max: Math.max(tiles.max, 1) });
+                    heat.setLatLngs(tiles.rows.map((row, i) => [
+                        tiles.origin[0] + row * tiles.cell_deg + half,
+                        tiles.origin[1] + tiles.cols[i] * tiles.cell_deg + half,
+                        tiles.counts[i]
+                    ]));
+                })
+                .catch(err => console.warn('Heatmap unavailable:', err.message));
+        }, 250);
+    }
+
+    map.on('moveend', refresh);
+    heat.on('add', refresh);
+    heat.refresh = refresh;
+    heat.addTo(map);
+    return heat;
+}
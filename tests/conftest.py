@@ -0,0 +1,25 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# AlertNow opens its alert and user databases at import, so point them at a scratch
+# directory before any test module imports it or alert_store
+DATA_DIR = tempfile.mkdtemp(prefix='alertnow-tests-')
+os.environ['ALERT_DATA_DIR'] = DATA_DIR
+os.environ['DB_PATH'] = os.path.join(DATA_DIR, 'users.db')
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def alertnow():
+    import AlertNow
+
+    return AlertNow
@@ -0,0 +1,93 @@
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+from alert_store import AlertStore
+
+
+def make_alert(i, **fields):
+    alert = {'timestamp': f"2026-10-17T08:{i % 60:02d}:00+08:00", 'role': 'barangay',
+             'barangay': f"Barangay {i % 3}", 'municipality': 'San Pablo City' if i % 2 else 'Quezon Province',
+             'emergency_type': ('fire', 'road_accident', 'General')[i % 3]}
+    alert.update(fields)
+    return alert
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'alerts.db')
+
+
+@pytest.fixture
+def store(db_path):
+    store = AlertStore(db_path, hot_size=10, check_counters=True)
+    yield store
+    store.close()
+
+
+def test_append_updates_counters(store):
+    for i in range(6):
+        store.append(make_alert(i))
+    assert store.counts() == Counter({'fire': 2, 'road_accident': 2, 'General': 2})
+    assert store.counts(municipality='San Pablo City') == Counter({'road_accident': 1, 'fire': 1, 'General': 1})
+    assert store.counts(role='barangay', barangay='Barangay 1') == Counter({'road_accident': 2})
+    store.verify_counters()
+
+
+def test_respond_counts_once(store):
+    alert = store.append(make_alert(0))
+    store.append(make_alert(1))
+    store.transition(alert['id'], 'responded')
+    store.transition(alert['id'], 'closed')
+    assert store.counts(responded=True) == Counter({'fire': 1})
+    assert store.counts(barangay='Barangay 0', responded=True) == Counter({'fire': 1})
+    store.verify_counters()
+
+
+def test_evict_removes_counts(store):
+    first = store.append(make_alert(0))
+    store.transition(first['id'], 'responded')
+    for i in range(1, 13):
+        store.append(make_alert(i))
+    assert len(store) == 10
+    assert sum(store.counts().values()) == 10
+    assert store.counts(responded=True) == Counter()
+    store.verify_counters()
+
+
+def test_reads_between_appends(store):
+    # Some alerts are indexed by a read before they are evicted, the rest leave unread
+    alerts = []
+    for i in range(25):
+        alerts.append(store.append(make_alert(i)))
+        if i % 4 == 0:
+            store.counts()
+        if i % 3 == 0:
+            store.transition(alerts[-1]['id'], 'responded')
+    # Long evicted, and its row may still be queued for the writer
+    store.transition(alerts[1]['id'], 'responded')
+    store.verify_counters()
+    assert sum(store.counts(responded=True).values()) == 4
+    assert [alert['seq'] for alert in store.query(role='barangay')] == [alert['seq'] for alert in alerts[-10:]]
+
+    noon = datetime.fromisoformat('2026-10-17T12:00:00+08:00').timestamp()
+    assert store.trend('day', 1, now=noon) == ([25], [10])
+    assert store.trend('hour', 1, role='barangay', now=noon - 3.5 * 3600) == ([25], [10])
+
+
+def test_restart_reloads_counters(db_path):
+    store = AlertStore(db_path, hot_size=10)
+    alerts = [store.append(make_alert(i)) for i in range(14)]
+    store.transition(alerts[-1]['id'], 'responded')
+    before = (store.counts(), store.counts(responded=True), store.counts(role='pnp', municipality='Quezon Province'))
+    store.close()
+
+    reloaded = AlertStore(db_path, hot_size=10, check_counters=True)
+    try:
+        after = (reloaded.counts(), reloaded.counts(responded=True),
+                 reloaded.counts(role='pnp', municipality='Quezon Province'))
+        assert after == before
+        reloaded.verify_counters()
+    finally:
+        reloaded.close()
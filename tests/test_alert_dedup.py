@@ -0,0 +1,53 @@
+import itertools
+
+import pytest
+
+# Each test reports from its own spot, well outside the dedup radius of the others
+_spots = itertools.count()
+
+
+@pytest.fixture
+def spot():
+    return 14.0 + next(_spots) * 0.01, 121.3
+
+
+def report(client, spot, **fields):
+    payload = dict(lat=spot[0], lon=spot[1], emergency_type='fire', user_role='barangay', barangay='Atisan',
+                   **fields)
+    response = client.post('/send_alert', json=payload)
+    return response.status_code, response.get_json()
+
+
+def test_duplicate_report_merges(alertnow, spot):
+    client = alertnow.app.test_client()
+    _, first = report(client, spot)
+    _, second = report(client, spot)
+    assert second['id'] == first['id']
+    assert second['reporters'] == 2
+    assert alertnow.alerts.get(first['id'])['reporters'] == 2
+
+
+def test_failed_append_releases_incident(alertnow, spot, monkeypatch):
+    client = alertnow.app.test_client()
+    with monkeypatch.context() as patch:
+        patch.setattr(alertnow.alerts, 'append', lambda alert: 1 / 0)
+        status, _ = report(client, spot)
+    assert status == 500
+    _, body = report(client, spot)
+    assert body['message'] == 'Alert sent'
+    assert alertnow.alerts.get(body['id']) is not None
+
+
+def test_report_into_unstored_incident_becomes_alert(alertnow, spot):
+    client = alertnow.app.test_client()
+    # An incident another request registered but has not stored (yet, or ever)
+    assert alertnow.dedup.claim({'id': 'in-flight', 'lat': spot[0], 'lon': spot[1], 'emergency_type': 'fire'}) is None
+    _, body = report(client, spot)
+    assert body['message'] == 'Alert sent'
+    assert body['id'] != 'in-flight'
+    assert alertnow.alerts.get(body['id']) is not None
+
+    # Later reports join the stored alert instead of the unstored incident
+    _, again = report(client, spot)
+    assert again['id'] == body['id']
+    assert alertnow.alerts.get(body['id'])['reporters'] == 2
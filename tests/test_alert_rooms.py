@@ -0,0 +1,40 @@
+from alert_store import alert_rooms, session_rooms
+
+
+def test_sessions_join_only_scoped_rooms():
+    assert session_rooms('barangay', 'San Pablo City', 'Atisan') == ['barangay:Atisan']
+    assert session_rooms('pnp', 'San Pablo City', unit_id='pnp-1') == ['pnp:San Pablo City', 'unit:pnp-1']
+    assert session_rooms('cdrrmo') == []
+
+
+def test_unscoped_alert_has_no_rooms():
+    assert alert_rooms({'role': 'cdrrmo', 'emergency_type': 'fire', 'barangay': 'N/A'}) == []
+    assert alert_rooms({'role': 'barangay', 'emergency_type': 'General', 'municipality': 'San Pablo City'}) == [
+        'bfp:San Pablo City', 'cdrrmo:San Pablo City', 'pnp:San Pablo City']
+
+
+def new_alerts(client):
+    return [packet['args'][0] for packet in client.get_received() if packet['name'] == 'new_alert']
+
+
+def test_unscoped_alert_reaches_no_dashboard(alertnow):
+    http = alertnow.app.test_client()
+    with http.session_transaction() as sess:
+        sess['role'] = 'cdrrmo'
+        sess['unique_id'] = 'cdrrmo-rooms'
+        sess['assigned_municipality'] = 'San Pablo City'
+    dashboard = alertnow.socketio.test_client(alertnow.app, flask_test_client=http)
+    dashboard.get_received()
+
+    # Nowhere near a known barangay and no municipality given
+    client = alertnow.app.test_client()
+    response = client.post('/send_alert', json={'lat': 0.0, 'lon': 0.0, 'emergency_type': 'fire',
+                                                'user_role': 'cdrrmo'})
+    assert response.status_code == 200
+    assert alertnow.alerts.get(response.get_json()['id']) is not None
+    assert new_alerts(dashboard) == []
+
+    response = client.post('/send_alert', json={'lat': 1.0, 'lon': 1.0, 'emergency_type': 'fire',
+                                                'user_role': 'cdrrmo', 'municipality': 'San Pablo City'})
+    assert [alert['id'] for alert in new_alerts(dashboard)] == [response.get_json()['id']]
+    dashboard.disconnect()
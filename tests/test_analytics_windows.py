@@ -0,0 +1,24 @@
+import shutil
+from datetime import datetime
+
+from alert_store import AlertStore
+from analytics_windows import MANILA, WindowedAnalytics
+from dataset_cache import DEFAULT_DATASET_DIR, DatasetCache
+
+
+def test_edited_dataset_replaces_cached_result(tmp_path):
+    dataset_dir = tmp_path / 'dataset'
+    dataset_dir.mkdir()
+    csv = dataset_dir / 'fire_incident.csv'
+    shutil.copy(f"{DEFAULT_DATASET_DIR}/fire_incident.csv", csv)
+    store = AlertStore(str(tmp_path / 'alerts.db'))
+    analytics = WindowedAnalytics(store, datasets=DatasetCache(str(dataset_dir)))
+    now = MANILA.localize(datetime(2026, 10, 17, 9))
+    try:
+        assert 'Lightning' not in analytics.get('year', 'bfp', now=now)['causes']
+        # Nothing in the store changes and the hour stays the same
+        with open(csv, 'a') as f:
+            f.write('31/12/2024,8:00,Tuesday,IV-A,14.068,121.320,Rainy,Residential,Lightning,High,0,5,30\n')
+        assert analytics.get('year', 'bfp', now=now)['causes']['Lightning'] == 1
+    finally:
+        store.close()
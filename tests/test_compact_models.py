@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+import compact_models
+from model_registry import MODEL_PATHS
+
+DATASET_DIR = os.path.join(os.path.dirname(compact_models.DEFAULT_MODEL_DIR), 'dataset')
+TOLERANCE = 1e-6
+
+
+def exported_models():
+    """(name, pickle path, artifact dir) for each served model that has a compact artifact."""
+    for name, path in MODEL_PATHS.items():
+        path = os.path.join(compact_models.DEFAULT_MODEL_DIR, path)
+        out_dir = compact_models.artifact_dir(path)
+        if os.path.exists(path) and os.path.exists(os.path.join(out_dir, compact_models.MANIFEST)):
+            yield pytest.param(path, out_dir, id=name)
+
+
+def test_every_artifact_is_served():
+    served = {compact_models.artifact_dir(path) for path in compact_models.served_pickles()}
+    artifacts = {directory for directory, _, files in os.walk(compact_models.DEFAULT_COMPACT_DIR)
+                 if compact_models.MANIFEST in files}
+    assert artifacts <= served, f"Artifacts no model loads: {sorted(artifacts - served)}"
+
+
+@pytest.mark.parametrize('path, out_dir', list(exported_models()))
+def test_artifact_matches_pickle(path, out_dir):
+    pytest.importorskip('joblib')
+    pytest.importorskip('sklearn')
+    manifest = compact_models.read_manifest(out_dir)
+    assert manifest['source_sha256'] == compact_models.file_sha256(path), 're-run python compact_models.py'
+    if manifest['classifier'].get('kind') == 'xgboost':
+        pytest.importorskip('xgboost')
+    error, agreement = compact_models.verify(path, out_dir, DATASET_DIR, tolerance=TOLERANCE)
+    assert error <= TOLERANCE
+    assert agreement == 1.0
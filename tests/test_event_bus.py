@@ -0,0 +1,31 @@
+import socket
+import threading
+
+from event_bus import UnixSocketEventBus
+
+
+def test_reconnect_replays_missed_messages(tmp_path):
+    path = str(tmp_path / 'bus' / 'bus.sock')
+    relay_worker = UnixSocketEventBus(path)
+    worker = UnixSocketEventBus(path)
+    received, done = [], threading.Event()
+
+    def handler(message, seq, is_origin):
+        received.append((seq, message))
+        if message == 100:
+            # Drops the connection with later frames already queued for it at the relay
+            worker._sock.shutdown(socket.SHUT_RDWR)
+        if message == 499:
+            done.set()
+
+    worker.subscribe('test', handler)
+    relay_worker.subscribe('test', lambda message, seq, is_origin: None)
+    # Comes back only once the relay has registered the worker
+    worker.publish('ready', None, sequenced=True)
+    for i in range(500):
+        relay_worker.publish('test', i, sequenced=True)
+
+    assert done.wait(10)
+    assert [message for _, message in received] == list(range(500))
+    assert [seq for seq, _ in received] == list(range(2, 502))
+    assert worker.missed == 0
@@ -0,0 +1,86 @@
+import pytest
+
+from alert_store import AlertStore
+from dataset_cache import DatasetCache
+from event_bus import LocalEventBus
+from heatmap import HeatmapGrid
+
+COORDS = {'San Pablo City': {'Atisan': {'lat': 14.0, 'lon': 121.0}, 'Bagong Bayan': {'lat': 14.1, 'lon': 121.1}}}
+FIRE_HEADER = ('Date,Time,Day_of_Week,Barangay,Latitude,Longitude,Weather,Property_Type,Fire_Cause,Fire_Severity,'
+               'Casualty_Count,Response_Time,Fire_Duration\n')
+
+
+def fire_row(time, lat, lon, severity):
+    return f"01/03/2024,{time},Friday,Atisan,{lat},{lon},Sunny,Residential,Electrical,{severity},0,5,30\n"
+
+
+@pytest.fixture
+def bus():
+    return LocalEventBus()
+
+
+@pytest.fixture
+def store(tmp_path, bus):
+    store = AlertStore(str(tmp_path / 'alerts.db'), bus=bus)
+    yield store
+    store.close()
+
+
+def grid_for(store, bus, tmp_path, rows=()):
+    dataset_dir = tmp_path / 'dataset'
+    dataset_dir.mkdir(exist_ok=True)
+    if rows:
+        (dataset_dir / 'fire_incident.csv').write_text(FIRE_HEADER + ''.join(rows))
+    return HeatmapGrid(store, bus, DatasetCache(str(dataset_dir)), COORDS)
+
+
+def cells(tiles):
+    return dict(zip(zip(tiles['rows'], tiles['cols']), tiles['counts']))
+
+
+def cell_of(grid, lat, lon):
+    index, inside = grid.cells(lat, lon)
+    assert inside
+    return divmod(int(index), grid.shape[1])
+
+
+def test_tiles_sum_history_slices(store, bus, tmp_path):
+    grid = grid_for(store, bus, tmp_path, [fire_row('18:10', 14.0011, 121.0011, 'High'),
+                                           fire_row('18:40', 14.0012, 121.0012, 'High'),
+                                           fire_row('7:00', 14.1, 121.1, 'Low'),
+                                           fire_row('9:00', 0.0, 0.0, 'Low')])
+    near, far = cell_of(grid, 14.0011, 121.0011), cell_of(grid, 14.1, 121.1)
+
+    tiles = grid.tiles()
+    assert cells(tiles) == {near: 2, far: 1}
+    assert tiles['max'] == 2
+    assert cells(grid.tiles(hours=[18])) == {near: 2}
+    assert cells(grid.tiles(severities=['low'])) == {far: 1}
+    assert cells(grid.tiles(layers=['road'])) == {}
+    assert cells(grid.tiles(bbox=(13.99, 120.99, 14.01, 121.01))) == {near: 2}
+    with pytest.raises(ValueError, match='layer'):
+        grid.tiles(layers=['flood'])
+
+
+def alert(lat, lon, emergency_type, hour):
+    return {'lat': lat, 'lon': lon, 'emergency_type': emergency_type, 'role': 'barangay', 'barangay': 'Atisan',
+            'municipality': 'San Pablo City', 'timestamp': f"2026-10-17T{hour:02d}:15:00+08:00"}
+
+
+def test_live_inserts_are_counted_once(store, bus, tmp_path):
+    # Stored before the grid exists, so it is loaded from SQLite
+    store.append(alert(14.0011, 121.0011, 'fire', 9))
+    grid = grid_for(store, bus, tmp_path)
+    near = cell_of(grid, 14.0011, 121.0011)
+    version = grid.version
+
+    store.append(alert(14.0012, 121.0012, 'fire', 9))
+    store.append(alert(14.0012, 121.0012, 'road_accident', 21))
+    store.append(alert(0.0, 0.0, 'fire', 9))
+    assert grid.version != version
+    assert cells(grid.tiles(sources=['live'])) == {near: 3}
+    assert cells(grid.tiles(layers=['fire'], hours=[9])) == {near: 2}
+    assert cells(grid.tiles(layers=['road'])) == {near: 1}
+    # Live alerts have no severity to filter by
+    assert cells(grid.tiles(severities=['high'])) == {}
+    assert grid.stats()['outside_grid_alerts'] == 1
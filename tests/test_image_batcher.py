@@ -0,0 +1,135 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import numpy as np
+import pytest
+
+from image_batcher import DEFAULT_INLINE_DECODE_BYTES, ImageBatcher
+
+pytest.importorskip('gevent')
+pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a gevent-patched interpreter, like a gunicorn gevent worker: one greenlet
+# emits a Socket.IO event every 5 ms while others classify large photos
+EMIT_LATENCY = textwrap.dedent('''
+    from gevent import monkey
+    monkey.patch_all()
+
+    import base64, json, sys, time
+    import cv2, gevent, numpy as np
+    from flask import Flask
+    from flask_socketio import SocketIO
+
+    from image_batcher import ImageBatcher, decode_features
+
+    class Model:
+        def predict(self, rows):
+            return np.zeros(len(rows), dtype=int)
+
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (1500, 2000, 3), dtype=np.uint8)
+    photo = base64.b64encode(cv2.imencode('.jpg', pixels)[1].tobytes()).decode()
+
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='gevent')
+    client = socketio.test_client(app)
+    gaps = []
+
+    def ticker():
+        last = time.perf_counter()
+        while True:
+            gevent.sleep(0.005)
+            socketio.emit('tick', {})
+            now = time.perf_counter()
+            gaps.append(now - last - 0.005)
+            last = now
+
+    def run(classify, photos=8, clients=4):
+        gaps.clear()
+        started = time.perf_counter()
+        tick = gevent.spawn(ticker)
+        gevent.sleep(0.02)
+        workers = [gevent.spawn(lambda: [classify(photo) for _ in range(photos // clients)]) for _ in range(clients)]
+        gevent.joinall(workers)
+        gevent.sleep(0.02)
+        tick.kill()
+        return {'max_lag': max(gaps), 'elapsed': time.perf_counter() - started}
+
+    model = Model()
+    batcher = ImageBatcher(lambda: model, decode_workers=2)
+    batcher.predict_many([photo] * 4)
+    pooled = run(batcher.predict)
+    inline = run(lambda image: model.predict(decode_features(image)[None]))
+    received = len(client.get_received())
+    print(json.dumps({'pooled': pooled, 'inline': inline, 'received': received}))
+''')
+
+
+def test_decoding_does_not_stall_emits():
+    output = subprocess.run([sys.executable, '-c', EMIT_LATENCY], cwd=ROOT, capture_output=True, text=True,
+                            timeout=300, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    assert result['received'] > 0
+    # Decoding inline holds the event loop for whole photos at a time; the pool leaves it free
+    assert result['inline']['max_lag'] > 0.05
+    assert result['pooled']['max_lag'] < result['inline']['max_lag'] / 3
+
+
+class Model:
+    def predict(self, rows):
+        return np.zeros(len(rows), dtype=int)
+
+
+def photo(width, height):
+    import cv2
+
+    pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return base64.b64encode(cv2.imencode('.jpg', pixels)[1].tobytes()).decode()
+
+
+@pytest.mark.parametrize('inline_decode_bytes', [DEFAULT_INLINE_DECODE_BYTES, 0])
+def test_lone_request_skips_batch_window(inline_decode_bytes):
+    model = Model()
+    batcher = ImageBatcher(lambda: model, max_wait=5.0, inline_decode_bytes=inline_decode_bytes)
+    image = photo(64, 64)
+    # The first pool decode starts the pool
+    batcher.predict(image)
+    started = time.perf_counter()
+    assert batcher.predict(image) == 0
+    assert time.perf_counter() - started < 1.0
+
+
+# Stands in for `python AlertNow.py`: a main script with work at import time
+MAIN_SCRIPT = textwrap.dedent('''
+    import base64, os
+    import cv2, numpy as np
+    from image_batcher import ImageBatcher
+
+    print('main script ran', flush=True)
+
+    class Model:
+        def predict(self, rows):
+            return np.zeros(len(rows), dtype=int)
+
+    if __name__ == '__main__':
+        model = Model()
+        batcher = ImageBatcher(lambda: model, inline_decode_bytes=0)
+        photo = base64.b64encode(cv2.imencode('.jpg', np.zeros((480, 640, 3), np.uint8))[1].tobytes()).decode()
+        print(batcher.predict_many([photo] * 4), flush=True)
+''')
+
+
+def test_decode_workers_do_not_rerun_main_script(tmp_path):
+    script = tmp_path / 'app.py'
+    script.write_text(MAIN_SCRIPT)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.run([sys.executable, str(script)], cwd=ROOT, env=env, capture_output=True, text=True,
+                            timeout=120, check=True).stdout
+    assert output.splitlines() == ['main script ran', '[0, 0, 0, 0]']
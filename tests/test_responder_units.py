@@ -0,0 +1,112 @@
+import threading
+import time
+
+from event_bus import LocalEventBus, UnixSocketEventBus
+from responder_units import ResponderUnits
+
+# Far from the spots other test modules report from, so only this module's units are in range
+BASE = (15.5, 120.9)
+
+
+def test_unit_stays_on_duty_until_last_dashboard_closes():
+    units = ResponderUnits()
+    units.connect('bfp-1')
+    units.connect('bfp-1')
+    units.report('bfp-1', 'bfp', *BASE)
+    units.disconnect('bfp-1')
+    assert units.unit('bfp-1')['available']
+    units.disconnect('bfp-1')
+    assert not units.unit('bfp-1')['on_duty']
+
+
+def dashboard(alertnow, role, unit_id):
+    http = alertnow.app.test_client()
+    with http.session_transaction() as sess:
+        sess['role'] = role
+        sess['unique_id'] = unit_id
+        sess['assigned_municipality'] = 'San Pablo City'
+    return alertnow.socketio.test_client(alertnow.app, flask_test_client=http)
+
+
+def send_fire(alertnow, offset):
+    response = alertnow.app.test_client().post('/send_alert', json={
+        'lat': BASE[0] + offset, 'lon': BASE[1], 'emergency_type': 'fire', 'user_role': 'barangay',
+        'barangay': 'Atisan'})
+    return alertnow.alerts.get(response.get_json()['id'])
+
+
+def test_assign_respond_reassign(alertnow):
+    first_tab = dashboard(alertnow, 'bfp', 'bfp-station-1')
+    second_tab = dashboard(alertnow, 'bfp', 'bfp-station-1')
+    first_tab.emit('unit_status', {'lat': BASE[0], 'lon': BASE[1]})
+
+    # Closing one of the station's two tabs leaves it on duty
+    second_tab.disconnect()
+    first = send_fire(alertnow, 0.01)
+    assert first['assigned_unit'] == 'bfp-station-1'
+    assert 'assigned_unit' not in send_fire(alertnow, 0.02)
+
+    # Responding is the last thing a dashboard does with an alert, so the unit is free again
+    first_tab.emit('responded', {'id': first['id']})
+    assert alertnow.responders.unit('bfp-station-1')['available']
+    assert send_fire(alertnow, 0.03)['assigned_unit'] == 'bfp-station-1'
+
+    first_tab.disconnect()
+    assert not alertnow.responders.unit('bfp-station-1')['on_duty']
+
+
+def test_first_sequenced_assign_wins(monkeypatch):
+    bus = LocalEventBus()
+    first, second = ResponderUnits(bus), ResponderUnits(bus)
+    first.report('bfp-near', 'bfp', *BASE)
+    first.report('bfp-far', 'bfp', BASE[0] + 0.05, BASE[1])
+    fire = {'lat': BASE[0], 'lon': BASE[1], 'emergency_type': 'fire'}
+    raced = []
+    pick = second._nearest
+
+    def racing(*args):
+        choice = pick(*args)
+        # The other worker's assignment is sequenced between this pick and its reservation
+        if not raced:
+            raced.append(first.assign(dict(fire, id='alert-first')))
+        return choice
+
+    monkeypatch.setattr(second, '_nearest', racing)
+    assert second.assign(dict(fire, id='alert-second'))['unit'] == 'bfp-far'
+    assert raced[0]['unit'] == 'bfp-near'
+    for units in (first, second):
+        assert units.unit('bfp-near')['alert'] == 'alert-first'
+        assert units.unit('bfp-far')['alert'] == 'alert-second'
+    assert second.stats()['contested'] == 1
+
+
+def test_workers_never_share_a_unit(tmp_path):
+    path = str(tmp_path / 'bus' / 'bus.sock')
+    buses = [UnixSocketEventBus(path) for _ in range(2)]
+    workers = [ResponderUnits(bus) for bus in buses]
+    for bus in buses:
+        # Comes back only once the relay has registered the worker
+        bus.publish('ready', None, sequenced=True)
+    for i in range(10):
+        workers[0].report(f"bfp-{i}", 'bfp', BASE[0] + i * 0.001, BASE[1])
+    # Reports are relayed, not sequenced; wait until both workers have applied them
+    deadline = time.monotonic() + 5
+    while any(units.stats()['available']['bfp'] < 10 for units in workers) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert all(units.stats()['available']['bfp'] == 10 for units in workers)
+
+    results = []
+
+    def storm(units, name):
+        for i in range(10):
+            results.append(units.assign({'id': f"{name}-{i}", 'lat': BASE[0], 'lon': BASE[1],
+                                         'emergency_type': 'fire'}))
+
+    threads = [threading.Thread(target=storm, args=(units, f"worker-{n}")) for n, units in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assigned = [result['unit'] for result in results if result is not None]
+    assert sorted(assigned) == sorted(f"bfp-{i}" for i in range(10))
+    assert sum(units.stats()['assigned'] for units in workers) == 10
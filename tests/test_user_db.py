@@ -0,0 +1,32 @@
+import pytest
+
+from user_db import UserDatabase, UserDatabaseBusy
+
+
+def test_exhausted_pool_raises_busy(tmp_path):
+    db = UserDatabase(str(tmp_path / 'users.db'), pool_size=1, timeout=0.05)
+    db.add_user('barangay', '09000000001', 'pw', barangay='Atisan')
+    with db.connection():
+        with pytest.raises(UserDatabaseBusy, match='1 user database connections'):
+            db.find_barangay_user('Atisan', '09000000001')
+    assert db.find_barangay_user('Atisan', '09000000001')['role'] == 'barangay'
+    db.close()
+
+
+def busy(*args, **kwargs):
+    raise UserDatabaseBusy('All 8 user database connections stayed busy for 30 s')
+
+
+def test_routes_answer_503_when_busy(alertnow, monkeypatch):
+    client = alertnow.app.test_client()
+    monkeypatch.setattr(alertnow.users, 'find_barangay_user', busy)
+    monkeypatch.setattr(alertnow.users, 'contact_exists', busy)
+
+    response = client.post('/api/login', json={'barangay': 'Atisan', 'contact_no': '0900', 'password': 'pw'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert response.get_json()['error'] == 'Too many requests, retry shortly'
+
+    form = {'barangay': 'Atisan', 'municipality': 'San Pablo City', 'province': 'Laguna', 'contact_no': '0900',
+            'password': 'pw'}
+    assert client.post('/signup_barangay', data=form).status_code == 503
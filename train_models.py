@@ -0,0 +1,334 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import numpy as np
+
+import compact_models
+from dataset_cache import DATASETS, DEFAULT_DATASET_DIR, DatasetCache
+from model_registry import DEFAULT_MODEL_DIR, MODEL_PATHS
+from risk_scoring import FAMILIES
+
+logger = logging.getLogger(__name__)
+
+MODEL_FAMILIES = ('lr', 'rf', 'svm', 'xgb')
+TEST_SIZE = 0.3
+RANDOM_STATE = 42
+# Bump when build_preprocessor or the split changes, so cached matrices are rebuilt
+PREPROCESS_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(DEFAULT_MODEL_DIR, '.cache')
+DEFAULT_RUNS_DIR = os.path.join(DEFAULT_MODEL_DIR, 'runs')
+# Slowest first, so the longest fits start before the pool fills up
+FIT_ORDER = ('svm', 'rf', 'xgb', 'lr')
+
+
+def build_preprocessor(features):
+    """The notebooks' ColumnTransformer: mean-imputed scaled numbers, one-hot categories."""
+    from sklearn.compose import ColumnTransformer
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+    categorical = list(features.select_dtypes(include=['object', 'string']).columns)
+    numeric = list(features.select_dtypes(include=['float64', 'int64']).columns)
+    return ColumnTransformer(transformers=[
+        ('num', Pipeline(steps=[('imputer', SimpleImputer(strategy='mean')), ('scaler', StandardScaler())]),
+         numeric),
+        ('cat', Pipeline(steps=[('imputer', SimpleImputer(strategy='constant', fill_value='missing')),
+                                ('onehot', OneHotEncoder(handle_unknown='ignore', drop='first'))]),
+         categorical),
+    ])
+
+
+def build_classifier(family):
+    if family == 'lr':
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression(max_iter=1000)
+    if family == 'rf':
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(random_state=RANDOM_STATE, n_jobs=1)
+    if family == 'svm':
+        from sklearn.svm import SVC
+        return SVC(probability=True, random_state=RANDOM_STATE)
+    if family == 'xgb':
+        from xgboost import XGBClassifier
+        return XGBClassifier(eval_metric='mlogloss', random_state=RANDOM_STATE, n_jobs=1)
+    raise ValueError(f"Unknown model family: {family}")
+
+
+def encode(dataset, dataset_dir=DEFAULT_DATASET_DIR, cache_dir=DEFAULT_CACHE_DIR):
+    """Splits and encodes a dataset once per CSV content; returns (cache path, cache hit)."""
+    columns = DatasetCache(dataset_dir).load(dataset)
+    if columns is None:
+        raise FileNotFoundError(f"{DATASETS[dataset]} not found in {dataset_dir}")
+    key = f"{dataset}-{columns.version[:16]}-p{PREPROCESS_VERSION}"
+    out_dir = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(out_dir, 'preprocessor.joblib')):
+        return out_dir, True
+
+    import joblib
+    from scipy import sparse
+    from sklearn.model_selection import train_test_split
+
+    data = columns.to_frame()
+    target = FAMILIES[dataset]['target']
+    features = data.drop(target, axis=1)
+    X_train, X_test, y_train, y_test = train_test_split(features, data[target], test_size=TEST_SIZE,
+                                                        random_state=RANDOM_STATE)
+    preprocessor = build_preprocessor(features).fit(X_train)
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    sparse.save_npz(os.path.join(tmp_dir, 'X_train.npz'), sparse.csr_matrix(preprocessor.transform(X_train)))
+    sparse.save_npz(os.path.join(tmp_dir, 'X_test.npz'), sparse.csr_matrix(preprocessor.transform(X_test)))
+    np.save(os.path.join(tmp_dir, 'y_train.npy'), y_train.to_numpy().astype(str))
+    np.save(os.path.join(tmp_dir, 'y_test.npy'), y_test.to_numpy().astype(str))
+    # The preprocessor goes last: its presence marks the entry complete
+    joblib.dump(preprocessor, os.path.join(tmp_dir, 'preprocessor.joblib'))
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return out_dir, False
+
+
+def fit(dataset, family, encoded_dir, out_path=None, scale=1):
+    """Fits one classifier on cached matrices and scores it on the held-out split.
+
+    Writes the full preprocessor + classifier pipeline to out_path when given.
+    scale > 1 repeats the training rows, for benchmarking larger histories.
+    """
+    import joblib
+    from scipy import sparse
+    from sklearn.metrics import accuracy_score, f1_score, log_loss
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import LabelEncoder
+
+    X_train = sparse.load_npz(os.path.join(encoded_dir, 'X_train.npz'))
+    X_test = sparse.load_npz(os.path.join(encoded_dir, 'X_test.npz'))
+    y_train = np.load(os.path.join(encoded_dir, 'y_train.npy'))
+    y_test = np.load(os.path.join(encoded_dir, 'y_test.npy'))
+    if scale > 1:
+        X_train = sparse.vstack([X_train] * scale, format='csr')
+        y_train = np.tile(y_train, scale)
+    classifier = build_classifier(family)
+    if family == 'xgb':
+        # XGBoost wants integer classes; sorted label codes are what the risk scorer expects
+        labels = LabelEncoder().fit(y_train)
+        y_train, y_test = labels.transform(y_train), labels.transform(y_test)
+
+    started = time.perf_counter()
+    classifier.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    predicted = classifier.predict(X_test)
+    probabilities = classifier.predict_proba(X_test)
+    predict_seconds = time.perf_counter() - started
+
+    metrics = {
+        'dataset': dataset, 'family': family, 'train_rows': X_train.shape[0], 'test_rows': X_test.shape[0],
+        'features': X_train.shape[1], 'fit_seconds': round(fit_seconds, 3),
+        'predict_seconds': round(predict_seconds, 4),
+        'accuracy': round(float(accuracy_score(y_test, predicted)), 4),
+        'macro_f1': round(float(f1_score(y_test, predicted, average='macro')), 4),
+        'log_loss': round(float(log_loss(y_test, probabilities, labels=classifier.classes_)), 4),
+    }
+    if out_path is not None:
+        preprocessor = joblib.load(os.path.join(encoded_dir, 'preprocessor.joblib'))
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        joblib.dump(Pipeline(steps=[('preprocessor', preprocessor), ('classifier', classifier)]), out_path)
+        metrics['size_bytes'] = os.path.getsize(out_path)
+    return metrics
+
+
+def _run_fits(jobs, workers):
+    """Runs (dataset, family, encoded_dir, out_path, scale) jobs on a process pool; returns metrics and errors."""
+    results, errors = [], {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fit, *job): job for job in jobs}
+        for future in as_completed(futures):
+            dataset, family = futures[future][:2]
+            try:
+                metrics = future.result()
+            except Exception as e:
+                logger.error(f"Training {family}_{dataset} failed: {e}")
+                errors[f"{family}_{dataset}"] = str(e)
+                continue
+            logger.info(f"{family}_{dataset}: {metrics['train_rows']} rows in {metrics['fit_seconds']:.2f} s, "
+                        f"accuracy {metrics['accuracy']:.3f}, macro F1 {metrics['macro_f1']:.3f}")
+            results.append(metrics)
+    return results, errors
+
+
+def _encode_all(datasets, dataset_dir, cache_dir):
+    encoded, timings = {}, {}
+    for dataset in datasets:
+        started = time.perf_counter()
+        encoded[dataset], hit = encode(dataset, dataset_dir, cache_dir)
+        timings[dataset] = {'seconds': round(time.perf_counter() - started, 3), 'cache_hit': hit}
+        logger.info(f"Encoded {dataset} in {timings[dataset]['seconds']:.2f} s"
+                    f"{' (cached)' if hit else ''}: {encoded[dataset]}")
+    return encoded, timings
+
+
+def _ordered(datasets, families):
+    return [(dataset, family) for family in FIT_ORDER if family in families for dataset in datasets]
+
+
+def fit_image_model(out_path, cache_dir=os.path.join(DEFAULT_CACHE_DIR, 'images'), workers=None):
+    """Fits the image classifier (the notebook's depth-3 tree) on the cached image features."""
+    import joblib
+    from sklearn.tree import DecisionTreeClassifier
+
+    from image_dataset import load_image_dataset
+
+    started = time.perf_counter()
+    X, y = load_image_dataset(cache_dir=cache_dir, workers=workers)
+    features_seconds = time.perf_counter() - started
+    classifier = DecisionTreeClassifier(max_depth=3, random_state=RANDOM_STATE)
+    started = time.perf_counter()
+    classifier.fit(X, y)
+    fit_seconds = time.perf_counter() - started
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    joblib.dump(classifier, out_path)
+    metrics = {'dataset': 'images', 'family': 'decision_tree', 'train_rows': X.shape[0], 'features': X.shape[1],
+               'labels': sorted(set(y.tolist())), 'features_seconds': round(features_seconds, 3),
+               'fit_seconds': round(fit_seconds, 3),
+               'train_accuracy': round(float(classifier.score(X, y)), 4), 'size_bytes': os.path.getsize(out_path)}
+    logger.info(f"decision_tree: {metrics['train_rows']} images, features in {features_seconds:.2f} s, "
+                f"fit in {fit_seconds:.2f} s")
+    return metrics
+
+
+def train(datasets=tuple(DATASETS), families=MODEL_FAMILIES, dataset_dir=DEFAULT_DATASET_DIR,
+          runs_dir=DEFAULT_RUNS_DIR, cache_dir=DEFAULT_CACHE_DIR, workers=None, publish=False,
+          model_dir=DEFAULT_MODEL_DIR, images=False):
+    """Trains every (dataset, family) pair into a new versioned run directory.
+
+    The run holds the pickles and metrics.json (scores, timings, dataset
+    hashes, library versions). images also retrains the image classifier
+    from the cached Road_Accident features. publish copies the pickles over
+    the ones the app serves and re-exports their compact artifacts.
+    """
+    import sklearn
+
+    started = time.perf_counter()
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    run_dir = os.path.join(runs_dir, version)
+    encoded, encode_timings = _encode_all(datasets, dataset_dir, cache_dir)
+    jobs = [(dataset, family, encoded[dataset],
+             os.path.join(run_dir, os.path.basename(MODEL_PATHS[f"{family}_{dataset}"])))
+            for dataset, family in _ordered(datasets, families)]
+    results, errors = _run_fits(jobs, workers)
+    models = {f"{m['family']}_{m['dataset']}": m for m in sorted(results, key=lambda m: (m['dataset'], m['family']))}
+    if images:
+        try:
+            models['decision_tree'] = fit_image_model(
+                os.path.join(run_dir, os.path.basename(MODEL_PATHS['decision_tree'])),
+                os.path.join(cache_dir, 'images'), workers)
+        except Exception as e:
+            logger.error(f"Training decision_tree failed: {e}")
+            errors['decision_tree'] = str(e)
+
+    report = {
+        'version': version,
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'workers': workers or os.cpu_count(),
+        'datasets': {dataset: {'file': DATASETS[dataset], 'cache': os.path.basename(encoded[dataset]),
+                               **encode_timings[dataset]} for dataset in datasets},
+        'libraries': {'sklearn': sklearn.__version__, 'numpy': np.__version__, 'xgboost': _xgboost_version()},
+        'models': models,
+        'errors': errors,
+    }
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, 'metrics.json'), 'w') as f:
+        json.dump(report, f, indent=1)
+    logger.info(f"Run {version}: {len(models)} models in {report['wall_seconds']:.1f} s -> {run_dir}")
+    if publish:
+        _publish(run_dir, report['models'], model_dir)
+    return report
+
+
+def _publish(run_dir, models, model_dir):
+    import joblib
+
+    for name in models:
+        destination = os.path.join(model_dir, MODEL_PATHS[name])
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(os.path.join(run_dir, os.path.basename(destination)), destination)
+        artifact = compact_models.artifact_dir(destination, model_dir, os.path.join(model_dir, 'compact'))
+        try:
+            compact_models.export_model(joblib.load(destination), artifact, source=destination)
+        except compact_models.UnsupportedModel:
+            # The registry would skip a stale artifact anyway; don't leave one around
+            shutil.rmtree(artifact, ignore_errors=True)
+        logger.info(f"Published {name} to {destination}")
+
+
+def benchmark(datasets=tuple(DATASETS), families=MODEL_FAMILIES, scales=(1, 2, 4), dataset_dir=DEFAULT_DATASET_DIR,
+              cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """Fit time per model as the training set grows (rows repeated scale times); nothing is written."""
+    report = {'encode': {}, 'fits': [], 'wall_seconds': {}}
+    encoded = {}
+    for dataset in datasets:
+        # Cold encode into a scratch cache, then the cached path a nightly run would take
+        scratch = os.path.join(cache_dir, f"bench-{os.getpid()}")
+        started = time.perf_counter()
+        encode(dataset, dataset_dir, scratch)
+        cold = time.perf_counter() - started
+        shutil.rmtree(scratch, ignore_errors=True)
+        started = time.perf_counter()
+        encoded[dataset], _ = encode(dataset, dataset_dir, cache_dir)
+        report['encode'][dataset] = {'cold_seconds': round(cold, 3),
+                                     'cached_seconds': round(time.perf_counter() - started, 3)}
+    for scale in scales:
+        started = time.perf_counter()
+        results, _ = _run_fits([(dataset, family, encoded[dataset], None, scale)
+                                for dataset, family in _ordered(datasets, families)], workers)
+        report['wall_seconds'][scale] = round(time.perf_counter() - started, 3)
+        report['fits'].extend(dict(m, scale=scale) for m in results)
+
+    print(f"{'model':<12}" + ''.join(f"{f'x{scale} s':>10}" for scale in scales))
+    for dataset, family in _ordered(datasets, families):
+        times = {m['scale']: m['fit_seconds'] for m in report['fits']
+                 if m['dataset'] == dataset and m['family'] == family}
+        print(f"{family + '_' + dataset:<12}" + ''.join(f"{times.get(scale, float('nan')):>10.2f}" for scale in scales))
+    print(f"{'wall':<12}" + ''.join(f"{report['wall_seconds'][scale]:>10.2f}" for scale in scales))
+    return report
+
+
+def _xgboost_version():
+    try:
+        import xgboost
+    except ImportError:
+        return None
+    return xgboost.__version__
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the fire and road incident models.')
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument('--families', nargs='+', choices=MODEL_FAMILIES, default=list(MODEL_FAMILIES))
+    parser.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR)
+    parser.add_argument('--runs-dir', default=DEFAULT_RUNS_DIR)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=None, help='training processes (default: one per core)')
+    parser.add_argument('--images', action='store_true', help='also retrain the image classifier')
+    parser.add_argument('--publish', action='store_true', help='replace the served models with this run')
+    parser.add_argument('--benchmark', action='store_true', help='time the fits at 1x, 2x and 4x the data')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.benchmark:
+        benchmark(args.datasets, args.families, args.scales, args.dataset_dir, args.cache_dir, args.workers)
+        return
+    report = train(args.datasets, args.families, args.dataset_dir, args.runs_dir, args.cache_dir, args.workers,
+                   args.publish, images=args.images)
+    if report['errors']:
+        raise SystemExit(f"{len(report['errors'])} models failed: {', '.join(report['errors'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+import argparse
+import logging
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.getenv('DB_PATH', os.path.join(os.path.dirname(__file__), 'database', 'users_web.db'))
+DEFAULT_POOL_SIZE = int(os.getenv('USER_DB_POOL_SIZE', '8'))
+
+# Applied in order; PRAGMA user_version records how many have run on a database
+MIGRATIONS = (
+    ('''
+        CREATE TABLE IF NOT EXISTS users (
+            barangay TEXT,
+            role TEXT NOT NULL,
+            contact_no TEXT UNIQUE NOT NULL,
+            assigned_municipality TEXT,
+            province TEXT,
+            password TEXT NOT NULL
+        )
+    ''',),
+    # The login and dashboard lookups; older databases have no UNIQUE contact_no, so it gets its own index
+    ('CREATE INDEX IF NOT EXISTS idx_users_barangay_contact ON users (barangay, contact_no)',
+     'CREATE INDEX IF NOT EXISTS idx_users_role_municipality_contact '
+     'ON users (role, assigned_municipality, contact_no)',
+     'CREATE INDEX IF NOT EXISTS idx_users_contact_no ON users (contact_no)'),
+)
+# Columns that databases created before the current table definition may lack
+COLUMNS = ('barangay', 'assigned_municipality', 'province')
+
+# Fixed statement text, so each pooled connection prepares a statement once and reuses it
+FIND_BARANGAY_USER = 'SELECT * FROM users WHERE barangay = ? AND contact_no = ?'
+LOGIN_BARANGAY_USER = 'SELECT * FROM users WHERE barangay = ? AND contact_no = ? AND password = ?'
+FIND_AGENCY_USER = 'SELECT * FROM users WHERE role = ? AND assigned_municipality = ? AND contact_no = ?'
+LOGIN_AGENCY_USER = ('SELECT * FROM users WHERE role = ? AND assigned_municipality = ? AND contact_no = ? '
+                     'AND password = ?')
+CONTACT_EXISTS = 'SELECT 1 FROM users WHERE contact_no = ? LIMIT 1'
+INSERT_USER = '''
+    INSERT INTO users (barangay, role, contact_no, assigned_municipality, province, password)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+class UserDatabaseBusy(RuntimeError):
+    pass
+
+
+class UserDatabase:
+    """Pooled access to the users table shared by the signup, login and dashboard routes.
+
+    Connections are opened once in WAL mode and handed out from a LIFO
+    queue, so a request borrows a warm connection with its prepared
+    statements instead of opening the file, and concurrent requests on
+    other threads or greenlets each get their own. At most pool_size are
+    open; a request beyond that waits up to timeout seconds for one to
+    come back and then raises UserDatabaseBusy. The schema is migrated
+    when the database is first opened.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, pool_size=DEFAULT_POOL_SIZE, timeout=30):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self.waits = 0
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self.connection() as conn:
+            self._migrate(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False, cached_statements=64)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _migrate(self, conn):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= len(MIGRATIONS):
+            return
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            if number == 1:
+                columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+                for column in COLUMNS:
+                    if column not in columns:
+                        conn.execute(f'ALTER TABLE users ADD COLUMN {column} TEXT')
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+            logger.info(f"Migrated {os.path.basename(self.db_path)} to schema version {number}")
+
+    @contextmanager
+    def connection(self):
+        """Borrows a pooled connection; commits when the block succeeds and rolls back when it raises."""
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.put(conn)
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            opening = self._opened < self.pool_size
+            if opening:
+                self._opened += 1
+        if opening:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        with self._lock:
+            self.waits += 1
+        try:
+            return self._pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise UserDatabaseBusy(f"All {self.pool_size} user database connections stayed busy for "
+                                   f"{self.timeout} s") from None
+
+    def _fetch_one(self, sql, params):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def find_barangay_user(self, barangay, contact_no, password=None):
+        """The barangay official's row, or None; with password, only if it matches."""
+        if password is None:
+            return self._fetch_one(FIND_BARANGAY_USER, (barangay, contact_no))
+        return self._fetch_one(LOGIN_BARANGAY_USER, (barangay, contact_no, password))
+
+    def find_agency_user(self, role, assigned_municipality, contact_no, password=None):
+        """The CDRRMO, PNP or BFP user's row, or None; with password, only if it matches."""
+        if password is None:
+            return self._fetch_one(FIND_AGENCY_USER, (role, assigned_municipality, contact_no))
+        return self._fetch_one(LOGIN_AGENCY_USER, (role, assigned_municipality, contact_no, password))
+
+    def contact_exists(self, contact_no):
+        return self._fetch_one(CONTACT_EXISTS, (contact_no,)) is not None
+
+    def add_user(self, role, contact_no, password, barangay=None, assigned_municipality=None, province=None):
+        """Inserts a user; raises sqlite3.IntegrityError if the contact number is taken."""
+        with self.connection() as conn:
+            conn.execute(INSERT_USER, (barangay, role, contact_no, assigned_municipality, province, password))
+
+    def stats(self):
+        with self._lock:
+            return {'pool_size': self.pool_size, 'open': self._opened, 'idle': self._pool.qsize(),
+                    'waits': self.waits}
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._opened = 0
+
+
+def benchmark(users=100000, logins=20000, threads=4, seed=0):
+    """Login throughput against a table of users: pooled and indexed, per-login connections, and neither.
+
+    The baseline opens a connection per login on an unindexed copy of the
+    table, the way the routes used to; it runs fewer logins because each
+    one scans the whole table.
+    """
+    rng = random.Random(seed)
+    municipalities = ['San Pablo City', 'Quezon Province']
+    rows = []
+    for i in range(users):
+        contact_no = f"09{i:09d}"
+        if i % 10:
+            rows.append((f"Barangay {i % 700}", 'barangay', contact_no, rng.choice(municipalities), 'Laguna', f"pw{i}"))
+        else:
+            rows.append((None, ('cdrrmo', 'pnp', 'bfp')[i // 10 % 3], contact_no, rng.choice(municipalities), None,
+                         f"pw{i}"))
+    attempts = [rows[rng.randrange(users)] for _ in range(logins)]
+
+    def login(find, row):
+        if row[1] == 'barangay':
+            return find('barangay', row, LOGIN_BARANGAY_USER, (row[0], row[2], row[5]))
+        return find('agency', row, LOGIN_AGENCY_USER, (row[1], row[3], row[2], row[5]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline_path = os.path.join(directory, 'baseline.db')
+        conn = sqlite3.connect(baseline_path)
+        conn.execute(MIGRATIONS[0][0].replace('UNIQUE ', ''))
+        conn.executemany(INSERT_USER, rows)
+        conn.commit()
+        conn.close()
+
+        def per_request(kind, row, sql, params, path=baseline_path):
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            user = conn.execute(sql, params).fetchone()
+            conn.close()
+            return user
+
+        baseline_logins = min(logins, 500)
+        started = time.perf_counter()
+        found = sum(login(per_request, row) is not None for row in attempts[:baseline_logins])
+        baseline_rate = baseline_logins / (time.perf_counter() - started)
+        assert found == baseline_logins
+
+        db = UserDatabase(os.path.join(directory, 'users.db'), pool_size=threads)
+        with db.connection() as conn:
+            conn.executemany(INSERT_USER, rows)
+
+        db_path = os.path.join(directory, 'users.db')
+        started = time.perf_counter()
+        for row in attempts:
+            login(partial(per_request, path=db_path), row)
+        indexed_rate = logins / (time.perf_counter() - started)
+
+        def pooled(kind, row, sql, params):
+            if kind == 'barangay':
+                return db.find_barangay_user(*params)
+            return db.find_agency_user(*params)
+
+        found = []
+
+        def worker(part):
+            found.append(sum(login(pooled, row) is not None for row in part))
+
+        workers = [threading.Thread(target=worker, args=(attempts[i::threads],)) for i in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        pooled_rate = logins / (time.perf_counter() - started)
+        assert sum(found) == logins
+        stats = db.stats()
+        db.close()
+
+    return {'users': users, 'per_request_unindexed_logins_per_s': round(baseline_rate),
+            'per_request_indexed_logins_per_s': round(indexed_rate),
+            'pooled_indexed_logins_per_s': round(pooled_rate), 'speedup': round(pooled_rate / baseline_rate, 1),
+            'threads': threads, 'connections_opened': stats['open']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark login lookups against the users table.')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--logins', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for key, value in benchmark(args.users, args.logins, args.threads).items():
+        logger.info(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()